@@ -0,0 +1,101 @@
+"""
+Cache policy of the responses.
+
+The responses of the public views (the views with a `public_cache` attribute) to anonymous `GET` requests
+are cached by `PublicCacheMiddleware` and can be reused by the browsers and the proxies.
+All the other responses are never cached (see `NeverCacheMiddleware`).
+
+The cached responses are cleared when the public content is saved or deleted.
+The views whose content depends on the current time set a shorter `public_cache_timeout`.
+"""
+
+from hashlib import md5
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse
+
+# how long the public responses are kept in the cache
+PUBLIC_CACHE_TIMEOUT = getattr(settings, "PUBLIC_CACHE_TIMEOUT", 60 * 10)
+# how long the public responses that depend on the current time (e.g. the upcoming dates) are kept in the cache
+PUBLIC_CACHE_DATED_TIMEOUT = getattr(settings, "PUBLIC_CACHE_DATED_TIMEOUT", 60)
+# the only query parameters of the public requests (the other requests aren't cached)
+PUBLIC_CACHE_QUERY_PARAMS = getattr(settings, "PUBLIC_CACHE_QUERY_PARAMS", ("page",))
+# how long the browsers and the proxies can reuse the public responses
+PUBLIC_CACHE_MAX_AGE = getattr(settings, "PUBLIC_CACHE_MAX_AGE", 60)
+
+# the cache keys contain a version that changes when the public content changes
+VERSION_KEY = "public_cache_version"
+
+# cookies of the visitors that may get a personalized page
+PRIVATE_COOKIES = [settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME, "messages"]
+
+
+def public_cache(view):
+    """
+    Mark a function view as public (set `public_cache = True` on the class-based views).
+    """
+    view.public_cache = True
+    return view
+
+
+def is_public_request(request: HttpRequest) -> bool:
+    """
+    Return `True` if the request can be answered with a public response.
+    """
+    return (
+        request.method in ("GET", "HEAD")
+        and not any(name in request.COOKIES for name in PRIVATE_COOKIES)
+        # anyone could fill the cache with random query strings
+        and all(name in PUBLIC_CACHE_QUERY_PARAMS for name in request.GET)
+    )
+
+
+def _get_view(request: HttpRequest):
+    func = request.resolver_match.func  # type: ignore
+    return getattr(func, "view_class", func)
+
+
+def is_public_response(request: HttpRequest, response: HttpResponse) -> bool:
+    """
+    Return `True` if the response can be cached and shared between the visitors.
+    """
+    if not is_public_request(request) or request.resolver_match is None:
+        return False
+    return (
+        getattr(_get_view(request), "public_cache", False)
+        and response.status_code == 200
+        and not getattr(response, "streaming", False)
+        and not response.cookies
+    )
+
+
+def get_cache_timeout(request: HttpRequest) -> int:
+    """
+    Return how long the public response of the request is kept in the cache.
+    """
+    return getattr(_get_view(request), "public_cache_timeout", PUBLIC_CACHE_TIMEOUT)
+
+
+def get_cache_key(request: HttpRequest) -> str:
+    version = cache.get_or_set(VERSION_KEY, lambda: uuid4().hex, None)
+    # the same parameters in another order give the same response
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    url = request.build_absolute_uri(request.path) + "?" + query
+    return f"public_response:{version}:{md5(url.encode('utf-8'), usedforsecurity=False).hexdigest()}"
+
+
+def _clear():
+    cache.set(VERSION_KEY, uuid4().hex, None)
+
+
+def invalidate(**_kwargs):
+    """
+    Clear the cached responses (connected to the `post_save` and `post_delete` signals of the public models).
+    """
+    _clear()
+    # another request may cache the previous content before the transaction is committed
+    transaction.on_commit(_clear)
@@ -1,14 +1,59 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from typing import Callable
 
 try:
     import minify_html
 except ImportError:
     minify_html = None
+from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpRequest, HttpResponse
-from django.utils.cache import add_never_cache_headers
+from django.middleware.gzip import GZipMiddleware as DjangoGZipMiddleware
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_vary_headers, set_response_etag
+
+from .cache import PUBLIC_CACHE_MAX_AGE, get_cache_key, get_cache_timeout, is_public_request, is_public_response
+
+MINIFY_HTML_CACHE_SIZE = getattr(settings, "MINIFY_HTML_CACHE_SIZE", 100)
+
+# LRU cache of the minified HTML of this process, by hash of the original HTML
+_minified: OrderedDict[bytes, bytes] = OrderedDict()
+_minified_lock = threading.Lock()
+
+
+def minify(content: bytes, charset: str) -> tuple[bytes, bool]:
+    """
+    Return the minified HTML and `True` if it comes from the cache.
+    """
+    digest = hashlib.blake2b(content, digest_size=16).digest()
+    with _minified_lock:
+        minified = _minified.get(digest)
+        if minified is not None:
+            _minified.move_to_end(digest)
+            return minified, True
+
+    minified = minify_html.minify(  # type: ignore
+        content.decode(charset),
+        minify_css=True,
+        minify_js=True,
+    ).encode(charset)
+
+    with _minified_lock:
+        _minified[digest] = minified
+        while len(_minified) > MINIFY_HTML_CACHE_SIZE:
+            _minified.popitem(last=False)
+    return minified, False
 
 
 class MinifyHtmlMiddleware:
+    """
+    Minify the HTML responses (the streaming responses are left as is).
+
+    The time spent is added to the `Server-Timing` header.
+    """
+
     sync_capable = True
     async_capable = True
 
@@ -18,18 +63,18 @@ class MinifyHtmlMiddleware:
     def __call__(self, request: HttpRequest) -> HttpResponse:
         response = self.get_response(request)
         if self.should_minify(request, response):
-            content = response.content.decode(response.charset)
+            start = time.perf_counter()
             try:
-                content = minify_html.minify(  # type: ignore
-                    content,
-                    minify_css=True,
-                    minify_js=True,
-                )
+                content, cached = minify(response.content, response.charset)
             except:
                 return response
+            duration = (time.perf_counter() - start) * 1000
             response.content = content
             if "Content-Length" in response:
                 response["Content-Length"] = len(response.content)
+
+            timing = f'minify;dur={duration:.2f};desc="{"cached" if cached else "minified"}"'
+            response["Server-Timing"] = ", ".join(filter(None, (response.get("Server-Timing"), timing)))
         return response
 
     def should_minify(self, request: HttpRequest, response: HttpResponse) -> bool:
@@ -51,5 +96,63 @@ class NeverCacheMiddleware:
 
     def __call__(self, request: HttpRequest) -> HttpResponse:
         response = self.get_response(request)
-        add_never_cache_headers(response)
+        if response.has_header("Cache-Control"):
+            # the view has its own cache policy (e.g. the static files)
+            return response
+        if is_public_response(request, response):
+            patch_cache_control(response, public=True, max_age=PUBLIC_CACHE_MAX_AGE)
+            # the logged in users get another version of the page
+            patch_vary_headers(response, ["Cookie"])
+        else:
+            add_never_cache_headers(response)
+        return response
+
+
+class PublicCacheMiddleware:
+    """
+    Serve the public responses to the anonymous visitors from the cache (see `cate.cache`).
+
+    Must be placed before `MinifyHtmlMiddleware` so the minified responses are cached.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not is_public_request(request):
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        key = get_cache_key(request)
+        response = cache.get(key)
+        if response is not None:
+            duration = (time.perf_counter() - start) * 1000
+            response["Server-Timing"] = f'cache;dur={duration:.2f};desc="hit"'
+            return response
+
+        response = self.get_response(request)
+        if request.method == "GET" and is_public_response(request, response):
+            # the ETag is computed once for all the visitors
+            set_response_etag(response)
+            patch_vary_headers(response, ["Cookie"])
+            # the timings are specific to this request
+            timing = response.headers.pop("Server-Timing", None)
+            cache.set(key, response, get_cache_timeout(request))
+            if timing is not None:
+                response["Server-Timing"] = timing
         return response
+
+
+class GZipMiddleware(DjangoGZipMiddleware):
+    """
+    GZip middleware that doesn't compress the files that can be requested by byte ranges
+    (the ranges refer to the uncompressed file).
+    """
+
+    def process_response(self, request, response):
+        if response.get("Accept-Ranges") == "bytes":
+            return response
+        return super().process_response(request, response)
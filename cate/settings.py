@@ -113,9 +113,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "django.middleware.gzip.GZipMiddleware",
+    "cate.middleware.GZipMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.http.ConditionalGetMiddleware",
+    "cate.middleware.PublicCacheMiddleware",
     "django.middleware.common.CommonMiddleware",
     "simple_redirects.middleware.RedirectFallbackMiddleware",
     "cate.middleware.MinifyHtmlMiddleware",
@@ -194,7 +195,7 @@ STORAGES = {
         ),
     },
     "staticfiles": {
-        "BACKEND": "django.contrib.staticfiles.storage.ManifestStaticFilesStorage",
+        "BACKEND": "storage.storages.CustomStaticFilesStorage",
     },
 }
 
@@ -360,6 +361,11 @@ STATIC_ROOT = BASE_DIR / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache) to let the web server send the documents
+SENDFILE_MODE = os.environ.get("SENDFILE_MODE", "")
+# internal location of the media files in nginx (for "x-accel-redirect")
+SENDFILE_URL = "/internal-media/"
+
 THUMBNAIL_BASEDIR = "thumbs"
 
 
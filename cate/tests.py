@@ -1,8 +1,24 @@
+import gzip
+import tempfile
 from datetime import date
+from pathlib import Path
+from unittest import mock
 
-from django.test import TestCase
+import minify_html
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.shortcuts import resolve_url
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
 
+from common.models import Page
+from storage.storages import CustomStaticFilesStorage
+
+from .cache import PUBLIC_CACHE_DATED_TIMEOUT, PUBLIC_CACHE_TIMEOUT, get_cache_key, get_cache_timeout
+from .middleware import minify
 from .templatetags.school_year import school_year
+from .views import serve_static
 
 
 class SchoolYearTests(TestCase):
@@ -23,3 +39,180 @@ class SchoolYearTests(TestCase):
         """
         for month in range(1, 7 + 1):
             self.assertEqual(school_year(date(2022, month, 1)), "2021-2022")
+
+
+class PublicCacheTests(TestCase):
+    """
+    Tests for the cache of the public pages.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous(self):
+        """
+        The public pages are cached for the anonymous visitors until the content changes
+        """
+        page = Page.objects.create(title="Test page", content="The content of the page...")
+
+        response = self.client.get(resolve_url(page))
+        self.assertContains(response, "The content of the page...")
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("Cookie", response["Vary"])
+        self.assertIn("ETag", response)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(resolve_url(page))
+        self.assertEqual(cached_response.content, response.content)
+        self.assertIn("Cookie", cached_response["Vary"])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(resolve_url(page), headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+        page.content = "The new content"
+        page.save()
+        response = self.client.get(resolve_url(page))
+        self.assertContains(response, "The new content")
+
+    def test_query_string(self):
+        """
+        The requests with unexpected query parameters aren't cached
+        """
+        page = Page.objects.create(title="Test page", content="The content of the page...")
+
+        self.client.get(resolve_url(page) + "?utm_source=abc")
+        response = self.client.get(resolve_url(page) + "?utm_source=abc")
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertEqual(cache.get(get_cache_key(response.wsgi_request)), None)
+
+        self.client.get(resolve_url(page) + "?page=1")
+        with self.assertNumQueries(0):
+            response = self.client.get(resolve_url(page) + "?page=1")
+        self.assertContains(response, "The content of the page...")
+
+    def test_timeout(self):
+        """
+        The pages that depend on the current time are cached for a shorter time
+        """
+        response = self.client.get(reverse("dates"))
+        self.assertEqual(get_cache_timeout(response.wsgi_request), PUBLIC_CACHE_DATED_TIMEOUT)
+        response = self.client.get(reverse("documents"))
+        self.assertEqual(get_cache_timeout(response.wsgi_request), PUBLIC_CACHE_TIMEOUT)
+
+    def test_logged_in(self):
+        """
+        The pages are never cached for the logged in users
+        """
+        page = Page.objects.create(title="Test page", content="The content of the page...")
+        self.client.force_login(get_user_model().objects.create_user("lfavole"))
+
+        self.client.get(resolve_url(page))
+        response = self.client.get(resolve_url(page))
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertIn("private", response["Cache-Control"])
+
+    def test_not_public(self):
+        """
+        The other views are never cached
+        """
+        response = self.client.get(reverse("account_login"))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+
+class MinifyHtmlTests(TestCase):
+    """
+    Tests for the minification of the HTML responses.
+    """
+
+    def test_cache(self):
+        """
+        The same HTML is minified only once
+        """
+        content = b"<p>  Some   text  </p>"
+        with mock.patch("minify_html.minify", wraps=minify_html.minify) as minify_mock:
+            self.assertEqual(minify(content, "utf-8"), (b"<p>Some text", False))
+            self.assertEqual(minify(content, "utf-8"), (b"<p>Some text", True))
+        minify_mock.assert_called_once()
+
+    def test_server_timing(self):
+        """
+        The minification time is added to the Server-Timing header
+        """
+        response = self.client.get(reverse("account_login"))
+        self.assertRegex(response["Server-Timing"], r'minify;dur=[0-9.]+;desc="(cached|minified)"')
+
+        # the cached public responses don't replay the timings of the first request
+        cache.clear()
+        self.client.cookies.clear()
+        page = Page.objects.create(title="Test page", content="The content of the page...")
+        response = self.client.get(resolve_url(page))
+        self.assertIn("minify;", response["Server-Timing"])
+        response = self.client.get(resolve_url(page))
+        self.assertRegex(response["Server-Timing"], r'^cache;dur=[0-9.]+;desc="hit"$')
+
+
+class StaticFilesTests(TestCase):
+    """
+    Tests for the precompressed static files.
+    """
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.root = Path(tmpdir.name)
+
+    def test_collectstatic(self):
+        """
+        The collected files are compressed
+        """
+        (self.root / "src").mkdir()
+        (self.root / "src" / "script.js").write_text("console.log('Hello world!');\n" * 100)
+        (self.root / "src" / "image.png").write_bytes(b"\x89PNG" * 100)
+        source = FileSystemStorage(self.root / "src")
+        storage = CustomStaticFilesStorage(location=self.root / "static")
+        paths = {}
+        for name in ("script.js", "image.png"):
+            with source.open(name) as file:
+                storage.save(name, file)
+            paths[name] = (source, name)
+
+        processed = list(storage.post_process(paths))
+        hashed_name = storage.stored_name("script.js")
+        self.assertIn(("script.js", hashed_name, True), processed)
+        for name in ("script.js", hashed_name):
+            self.assertTrue(storage.exists(name + ".gz"))
+            with storage.open(name + ".gz") as file:
+                self.assertEqual(gzip.decompress(file.read()), (self.root / "src" / "script.js").read_bytes())
+        self.assertFalse(storage.exists("image.png.gz"))
+
+    def test_serve(self):
+        """
+        The precompressed files are served if the client accepts them
+        """
+        content = b"console.log('Hello world!');\n" * 100
+        (self.root / "script.0123456789ab.js").write_bytes(content)
+        (self.root / "script.0123456789ab.js.gz").write_bytes(gzip.compress(content))
+
+        request = RequestFactory().get("/", headers={"Accept-Encoding": "gzip, deflate, br;q=0"})
+        with override_settings(STATIC_ROOT=self.root):
+            response = serve_static(request, "script.0123456789ab.js", self.root)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/javascript")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), content)
+        response.close()
+
+        request = RequestFactory().get("/", headers={"Accept-Encoding": "identity"})
+        response = serve_static(request, "script.0123456789ab.js", self.root)
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(b"".join(response.streaming_content), content)
+        response.close()
+
+        # the media files are never immutable
+        (self.root / "report.202401011200.pdf").write_bytes(b"%PDF")
+        with override_settings(STATIC_ROOT=self.root / "static"):
+            response = serve_static(request, "report.202401011200.pdf", self.root)
+        self.assertNotIn("Cache-Control", response)
+        response.close()
@@ -19,7 +19,6 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.sitemaps import views as sitemap_views
 from django.urls import converters, include, path
-from django.views.static import serve
 
 from . import sitemap, views
 
@@ -97,6 +96,16 @@ if not os.environ.get("PYTHONANYWHERE"):
     # urlpatterns += static(settings.STATIC_URL, document_root = settings.STATIC_ROOT or "")
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT or "")
     urlpatterns += [
-        path(settings.STATIC_URL.lstrip("/") + "<path:path>", serve, {"document_root": settings.STATIC_ROOT})
+        path(
+            settings.STATIC_URL.lstrip("/") + "<path:path>",
+            views.serve_static,
+            {"document_root": settings.STATIC_ROOT},
+        )
+    ]
+    urlpatterns += [
+        path(
+            settings.MEDIA_URL.lstrip("/") + "<path:path>",
+            views.serve_static,
+            {"document_root": settings.MEDIA_ROOT},
+        )
     ]
-    urlpatterns += [path(settings.MEDIA_URL.lstrip("/") + "<path:path>", serve, {"document_root": settings.MEDIA_ROOT})]
@@ -3,6 +3,7 @@ import hmac
 import importlib
 import mimetypes
 import os
+import re
 import sys
 from hashlib import sha1
 from ipaddress import ip_address, ip_network
@@ -17,6 +18,7 @@ from common.views import _encode_filename, has_permission
 from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.serializers import deserialize, get_serializer, _serializers
 from django.core.serializers.json import DjangoJSONEncoder
 from django.http import (
@@ -33,11 +35,14 @@ from django.http import (
 from django.shortcuts import get_object_or_404, render, resolve_url
 from django.template import Context, Engine, RequestContext
 from django.template import context_processors as django_cps
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.encoding import force_bytes
 from django.utils.safestring import SafeString
 from django.utils.translation import gettext_lazy as _
 from django.views.debug import ExceptionReporter, technical_404_response
 from django.views.decorators.csrf import csrf_exempt
+from django.views.static import serve
 from sentry_sdk import Hub
 
 from .forms import ImportForm
@@ -297,6 +302,58 @@ def reload_website(request: HttpRequest):
     return HttpResponse(status=204)
 
 
+# names with the hash of `ManifestStaticFilesStorage` (the media files may have similar names)
+HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{12}\.\w+$")
+# precompressed versions of the files (see `storage.compressed`), by order of preference
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def accepted_encodings(request: HttpRequest) -> set[str]:
+    """
+    Return the content encodings accepted by the client.
+    """
+    ret = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        encoding, _, params = item.partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        ret.add(encoding.strip().lower())
+    return ret
+
+
+def serve_static(request: HttpRequest, path: str, document_root):
+    """
+    Serve a static or media file (like `django.views.static.serve`) with its best precompressed version
+    accepted by the client, and with far-future cache headers if it's a static file whose name contains a hash.
+    """
+    accepted = accepted_encodings(request)
+    response = None
+    compressed = False
+    for encoding, ext in PRECOMPRESSED_ENCODINGS:
+        try:
+            is_file = os.path.isfile(safe_join(document_root, path + ext))
+        except SuspiciousFileOperation:
+            raise Http404() from None
+        if is_file:
+            compressed = True
+            if encoding in accepted or "*" in accepted:
+                response = serve(request, path + ext, document_root)
+                break
+    if response is None:
+        response = serve(request, path, document_root)
+
+    if compressed:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    is_static = bool(settings.STATIC_ROOT) and Path(document_root).resolve() == Path(settings.STATIC_ROOT).resolve()
+    if is_static and HASHED_NAME_RE.search(path):
+        patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response
+
+
 def robots(_request):
     robots_file = Path(__file__).resolve().parent.parent / "robots.txt"
     if robots_file.exists():
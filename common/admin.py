@@ -1,10 +1,20 @@
-from functools import partial
+import datetime as dt
 import sys
+from functools import partial
 from typing import Type
 
 from adminsortable2.admin import SortableAdminMixin
-from django.db.models.query import QuerySet
-from django.http.request import HttpRequest
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.helpers import Fieldset
+from django.contrib.admin.utils import model_ngettext
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from django.shortcuts import redirect, render
+from django.utils.translation import gettext_lazy as _
+from django.utils.translation import pgettext_lazy
+
+from cate import cache as public_cache
 from common.models import (
     Article,
     ArticleImage,
@@ -17,17 +27,9 @@ from common.models import (
     Page,
     PageImage,
 )
-from django import forms
-from django.contrib import admin
-from django.contrib.admin.helpers import Fieldset
-from django.contrib.admin.utils import model_ngettext
-from django.db.models import QuerySet
-from django.http import HttpRequest
-from django.shortcuts import redirect, render
-from django.utils.translation import gettext_lazy as _
-from django.utils.translation import pgettext_lazy
 from tinymce.widgets import AdminTinyMCE
 
+from . import nav
 from .forms import DateForm
 from .models import Attendance, Child, Year
 
@@ -120,6 +122,13 @@ class PageAdmin(SortableAdminMixin, admin.ModelAdmin):
     form = PageAdminForm
     inlines = [PageImagesInline]
 
+    def _update_order(self, updated_items, extra_model_filters):
+        # the new order is saved with `bulk_update`, which doesn't send `post_save`
+        ret = super()._update_order(updated_items, extra_model_filters)
+        nav.invalidate()
+        public_cache.invalidate()
+        return ret
+
 
 class ArticleImagesInline(CommonImagesInline):
     """
@@ -195,7 +204,7 @@ class CommonChildAdmin(admin.ModelAdmin):
         return bool(obj.autres_infos)
 
     readonly_fields = ("date_inscription",)
-    actions = ["mark_paid", "mark_signed", "change_group"]
+    actions = ["mark_paid", "mark_signed", "change_group", "assign_groups"]
 
     @admin.action(permissions=["change"], description=_("Mark as paid"))
     @message_user(pgettext_lazy("admin action message", "marked as paid"))
@@ -235,6 +244,11 @@ class CommonChildAdmin(admin.ModelAdmin):
         }
         return render(request, "admin/change_group.html", context)
 
+    @admin.action(permissions=["change"], description=_("Assign the groups of the classes"))
+    @message_user(pgettext_lazy("admin action message", "changed group"))
+    def assign_groups(self, request, queryset):
+        Group.objects.assign_groups(queryset)
+
     def redirect_to(self, obj):
         # Get the name of the previously called function in the stack
         # (the one that called get_obj_does_not_exist_redirect)
@@ -275,6 +289,12 @@ class DateCategoryAdmin(SortableAdminMixin, admin.ModelAdmin):
     Admin interface for date categories.
     """
 
+    def _update_order(self, updated_items, extra_model_filters):
+        # the new order is saved with `bulk_update`, which doesn't send `post_save`
+        ret = super()._update_order(updated_items, extra_model_filters)
+        public_cache.invalidate()
+        return ret
+
 
 class CommonAttendancesInline(admin.TabularInline):
     """
@@ -303,6 +323,7 @@ class CommonMeetingAdmin(admin.ModelAdmin):
 
     fields = ("date", "kind", "name")
     list_display = ("__str__", "date")
+    actions = ("repeat_weekly",)
     # you must add `inlines = [CommonAttendancesInline]` to each subclass
 
     def __init__(self, *args, **kwargs):
@@ -314,6 +335,36 @@ class CommonMeetingAdmin(admin.ModelAdmin):
             return []
         return super().get_inlines(request, obj)  # type: ignore
 
+    @admin.action(permissions=["add"], description=_("Repeat every week until the end of the term"))
+    def repeat_weekly(self, request, queryset):
+        existing = set(self.model.objects.values_list("date", "kind", "name"))
+        meetings = []
+        for meeting in queryset:
+            term_end = next(
+                (end for start, end in Year.get_for_date(meeting.date).trs if start <= meeting.date < end),
+                meeting.date,
+            )
+            date = meeting.date + dt.timedelta(weeks=1)
+            while date < term_end:
+                if (date, meeting.kind, meeting.name) not in existing:
+                    existing.add((date, meeting.kind, meeting.name))
+                    meetings.append(
+                        self.model(date=date, kind=meeting.kind, name=meeting.name, group_id=meeting.group_id)
+                    )
+                date += dt.timedelta(weeks=1)
+
+        self.model.bulk_create_with_attendances(meetings)
+        n = len(meetings)
+        self.message_user(
+            request,
+            _("Successfully %(action)s %(count)d %(items)s.")
+            % {
+                "action": pgettext_lazy("admin action message", "created"),
+                "count": n,
+                "items": model_ngettext(self.opts, n),
+            },
+        )
+
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
@@ -1,6 +1,12 @@
+from allauth.account.signals import email_added, email_confirmed, user_signed_up
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_migrate, post_save
 
+from cate import cache as public_cache
+
+from . import years
 from .management import create_date_categories, create_pages, create_year
 
 
@@ -22,3 +28,53 @@ class CommonConfig(AppConfig):
             create_year,
             dispatch_uid="common.management.create_year",
         )
+
+        from . import linking
+
+        email_confirmed.connect(
+            linking.link_children_on_email_confirmed,
+            dispatch_uid="common.linking.link_children_on_email_confirmed",
+        )
+        user_logged_in.connect(
+            linking.link_children_on_login,
+            dispatch_uid="common.linking.link_children_on_login",
+        )
+        user_signed_up.connect(
+            linking.link_children_on_signup,
+            dispatch_uid="common.linking.link_children_on_signup",
+        )
+        email_added.connect(
+            linking.link_children_on_email_added,
+            dispatch_uid="common.linking.link_children_on_email_added",
+        )
+
+        Year = self.get_model("Year")
+        post_save.connect(years.invalidate, sender=Year, dispatch_uid="common.years.invalidate_save")
+        post_delete.connect(years.invalidate, sender=Year, dispatch_uid="common.years.invalidate_delete")
+        request_started.connect(years.start_request_memo, dispatch_uid="common.years.start_request_memo")
+        request_finished.connect(years.end_request_memo, dispatch_uid="common.years.end_request_memo")
+
+        from . import nav
+        from .models import invalidate_group_routes
+
+        Group = self.get_model("Group")
+        post_save.connect(
+            invalidate_group_routes, sender=Group, dispatch_uid="common.models.invalidate_group_routes_save"
+        )
+        post_delete.connect(
+            invalidate_group_routes, sender=Group, dispatch_uid="common.models.invalidate_group_routes_delete"
+        )
+
+        Page = self.get_model("Page")
+        post_save.connect(nav.invalidate, sender=Page, dispatch_uid="common.nav.invalidate_save")
+        post_delete.connect(nav.invalidate, sender=Page, dispatch_uid="common.nav.invalidate_delete")
+
+        # models displayed on the public pages (see `cate.cache`)
+        for model_name in ("Page", "Article", "Date", "DateCategory", "Document", "DocumentCategory"):
+            model = self.get_model(model_name)
+            post_save.connect(
+                public_cache.invalidate, sender=model, dispatch_uid=f"cate.cache.invalidate_save_{model_name}"
+            )
+            post_delete.connect(
+                public_cache.invalidate, sender=model, dispatch_uid=f"cate.cache.invalidate_delete_{model_name}"
+            )
@@ -0,0 +1,75 @@
+from allauth.account import app_settings as account_settings
+from allauth.account.models import EmailAddress
+from django.contrib.messages import add_message
+from django.contrib.messages.constants import INFO
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.http import HttpRequest
+
+from .models import LastChildVersion
+
+
+def link_children(user, request: HttpRequest | None = None) -> list[LastChildVersion]:
+    """
+    Link the children that don't have a user to the given user if an email of the user matches.
+    The emails must be verified unless the email verification is disabled (`ACCOUNT_EMAIL_VERIFICATION`).
+    Return the linked children.
+    """
+    emails = EmailAddress.objects.filter(user=user)
+    if account_settings.EMAIL_VERIFICATION != account_settings.EmailVerificationMethod.NONE:
+        emails = emails.filter(verified=True)
+    emails = emails.values_list("email", flat=True)
+    emails = {email.lower() for email in emails}
+    if not emails:
+        return []
+
+    # the lowercase emails use the `common_child_email_*` indexes
+    children = list(
+        LastChildVersion.objects.filter(user=None)
+        .alias(
+            email_jeune_lower=Lower("email_jeune"),
+            email_mere_lower=Lower("email_mere"),
+            email_pere_lower=Lower("email_pere"),
+        )
+        .filter(Q(email_jeune_lower__in=emails) | Q(email_mere_lower__in=emails) | Q(email_pere_lower__in=emails))
+    )
+    if not children:
+        return []
+
+    for child in children:
+        child.user = user
+    # the default manager would skip the children of the previous years
+    LastChildVersion._base_manager.bulk_update(children, ["user"])
+
+    if request is not None:
+        for child in children:
+            add_message(request, INFO, f"Enfant {child} lié à votre compte.", fail_silently=True)
+    return children
+
+
+def link_children_on_email_confirmed(request, email_address, **_kwargs):
+    """
+    Link the children when an email is confirmed (connected to `allauth.account.signals.email_confirmed`).
+    """
+    link_children(email_address.user, request)
+
+
+def link_children_on_login(sender, request, user, **_kwargs):
+    """
+    Link the children added since the last login (connected to `user_logged_in`).
+    """
+    link_children(user, request)
+
+
+def link_children_on_signup(request, user, **_kwargs):
+    """
+    Link the children when a user signs up (connected to `allauth.account.signals.user_signed_up`).
+    """
+    link_children(user, request)
+
+
+def link_children_on_email_added(request, user, email_address, **_kwargs):
+    """
+    Link the children when an email is added (connected to `allauth.account.signals.email_added`).
+    """
+    link_children(user, request)
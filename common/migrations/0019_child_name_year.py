@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common", "0018_alter_phone_number_fields"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="child",
+            index=models.Index(fields=["nom", "prenom", "year"], name="common_child_name_year"),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:58
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common", "0019_child_name_year"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="child",
+            index=models.Index(django.db.models.functions.text.Lower("email_jeune"), name="common_child_email_jeune"),
+        ),
+        migrations.AddIndex(
+            model_name="child",
+            index=models.Index(django.db.models.functions.text.Lower("email_mere"), name="common_child_email_mere"),
+        ),
+        migrations.AddIndex(
+            model_name="child",
+            index=models.Index(django.db.models.functions.text.Lower("email_pere"), name="common_child_email_pere"),
+        ),
+    ]
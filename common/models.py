@@ -1,22 +1,24 @@
 import base64
+import binascii
 import datetime as dt
 from functools import total_ordering
 import hashlib
+import html
 import mimetypes
 import re
 from typing import Any, Callable, Type
-from urllib.parse import urlparse
+from urllib.parse import unquote_to_bytes
 import warnings
 from zoneinfo import ZoneInfo
 
-from bs4 import BeautifulSoup
 from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
-from django.db import DatabaseError, models
-from django.db.models import Manager
+from django.db import DatabaseError, IntegrityError, connection, models, transaction
+from django.db.models import Case, Exists, Manager, OuterRef, Q, Value, When
+from django.db.models.functions import Lower
 from django.db.utils import NotSupportedError
 from django.shortcuts import resolve_url
 from django.urls import NoReverseMatch, reverse
@@ -26,10 +28,12 @@ from phonenumber_field.formfields import PhoneNumberField as PhoneNumberFormFiel
 from phonenumber_field.modelfields import PhoneNumberField
 from phonenumber_field.phonenumber import PhoneNumber, to_python
 from storage.fields import FileField, ImageField
+from tracking.cache import CacheManager
 
 from cate.utils.text import slugify
 
 from .fields import DatalistField, PriceField
+from .years import get_cached, set_cached
 
 
 def fix_format_value(func):
@@ -43,7 +47,7 @@ def fix_format_value(func):
 PhoneNumberFormField.__init__ = fix_format_value(PhoneNumberFormField.__init__)
 
 
-class YearManager(models.Manager):
+class YearManager(CacheManager):
     def get_by_natural_key(self, start_year: int) -> "Year":
         return self.get_or_create(start_year=start_year)[0]
 
@@ -127,7 +131,7 @@ class Year(models.Model):
         """
         Return the current year.
         """
-        year = cache.get("current_year")
+        year = get_cached(cls)
 
         if not year:
             try:
@@ -138,7 +142,9 @@ class Year(models.Model):
                 except DatabaseError:
                     year = cls.get_for_date()
 
-            cache.set("current_year", year)
+            # don't cache the years that aren't in the database
+            if year.pk:
+                set_cached(year)
 
         return year
 
@@ -146,6 +152,13 @@ class Year(models.Model):
     def get_current_pk(cls):
         return cls.get_current(True).pk
 
+    @classmethod
+    def get_current_start_year(cls) -> int:
+        """
+        Return the start year of the current year (a shortcut for `get_current().start_year`).
+        """
+        return cls.get_current().start_year
+
     @classmethod
     def get_for_date(cls, date: dt.date | None = None, save=False):
         if not date:
@@ -199,6 +212,45 @@ class HasSlugManager(models.Manager):
     def get_by_natural_key(self, slug: str) -> "HasSlug":
         return self.get(slug=slug)
 
+    def free_slugs(self, slugs: list[str]) -> list[str]:
+        """
+        Return free slugs for the given slugs (adding `-1`, `-2`, ... if they are taken)
+        with only one query. The same slug can be given several times.
+        """
+        if not slugs:
+            return []
+
+        prefixes = Q()
+        for slug in set(slugs):
+            prefixes |= Q(slug__startswith=slug)
+        taken = set(self.filter(prefixes).values_list("slug", flat=True))
+
+        ret = []
+        for slug in slugs:
+            candidate = slug
+            i = 0
+            while candidate in taken:
+                i += 1
+                candidate = f"{slug}-{i}"
+            taken.add(candidate)
+            ret.append(candidate)
+        return ret
+
+    def allocate_slugs(self, objs: "list[HasSlug]"):
+        """
+        Set a free slug on the objects that don't have one.
+        """
+        objs = [obj for obj in objs if not obj.slug]
+        if not objs:
+            return
+        for obj, slug in zip(objs, self.free_slugs([obj._generate_slug(False) for obj in objs])):
+            obj.slug = slug
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self.allocate_slugs(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class HasSlug(models.Model):
     """
@@ -214,25 +266,28 @@ class HasSlug(models.Model):
         abstract = True
 
     def _generate_slug(self, try_slugs=True):
-        value = self.title
-        slug_candidate = slug_original = slugify(value)
+        slug = slugify(self.title)
         if not try_slugs:
-            return slug_candidate
-
-        i = 0
-        while True:
-            i += 1
-            if not type(self).objects.filter(slug=slug_candidate).exists():  # type: ignore
-                break
-            slug_candidate = slug_original + "-" + str(i)
-
-        return slug_candidate
+            return slug
+        return type(self).objects.free_slugs([slug])[0]  # type: ignore
 
     def save(self, *args, **kwargs):
-        if self._state.adding and not self.slug:
-            self.slug = self._generate_slug()
+        if not self._state.adding or self.slug:
+            super().save(*args, **kwargs)
+            return
 
-        super().save(*args, **kwargs)
+        attempts = 3
+        for attempt in range(attempts):
+            self.slug = self._generate_slug()
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                slug, self.slug = self.slug, ""
+                # another object may have taken the slug in the meantime
+                if attempt == attempts - 1 or not type(self).objects.filter(slug=slug).exists():  # type: ignore
+                    raise
 
     def __str__(self):  # pylint: disable=E0307
         return self.title
@@ -241,6 +296,13 @@ class HasSlug(models.Model):
         return (self.slug,)
 
 
+# `src` attribute of an `<img>` tag that contains a data URI
+DATA_IMG_RE = re.compile(
+    r"""(?P<start><img\b[^>]*?\bsrc\s*=\s*(?P<quote>["']))data:(?P<mimetype>[^"',]*),(?P<data>[^"']*)(?P=quote)""",
+    re.IGNORECASE,
+)
+
+
 class PageBase(HasSlug):
     """
     Base class for pages and articles.
@@ -253,51 +315,47 @@ class PageBase(HasSlug):
         abstract = True
 
     def save(self, *args, **kwargs):
+        images = self._write_base64_images()
         super().save(*args, **kwargs)
+        if images:
+            type(images[0]).objects.bulk_create(images)
 
-        self._write_base64_images()
-
-    def _write_base64_images(self):
+    def _write_base64_images(self) -> "list[ImageBase]":
         """
-        Creates the corresponding objects for Base64 images in the page/article.
-        Saves the element only if needed.
+        Writes the files of the Base64 images in the page/article and replaces them with their URL,
+        so the content is saved only once.
+        Returns the corresponding image objects (that must be saved after the page/article).
         """
-        edited = False
-
-        soup = BeautifulSoup(self.content, features="html.parser")
-        for i, img in enumerate(soup.find_all("img")):
-            if not (src := img.attrs.get("src")):
-                continue
+        # fast path: most of the contents don't have any Base64 image
+        if "data:" not in self.content:
+            return []
 
-            if (parse_result := urlparse(src)).scheme != "data":
-                continue
+        Image: Type[ImageBase] = apps.get_model(self._meta.app_label, self._meta.model_name + "Image")  # type: ignore
+        image_field = Image._meta.get_field("image")
+        images: list[ImageBase] = []
 
-            mimetype, data = parse_result.path.split(",", 1)
-            if mimetype.endswith(";base64"):
-                mimetype = mimetype.removesuffix(";base64")
-                data = base64.b64decode(data)
+        def replace(match: re.Match):
+            mimetype, data = match["mimetype"], match["data"]
+            try:
+                if mimetype.endswith(";base64"):
+                    mimetype = mimetype.removesuffix(";base64")
+                    content = base64.b64decode(data)
+                else:
+                    content = unquote_to_bytes(data)
+            except (binascii.Error, ValueError):
+                return match[0]
 
             if not (ext := mimetypes.guess_extension(mimetype)):
-                continue
-
-            if not (path := self._save_image(f"blobid{i}{ext}", data)):
-                continue
-            img.attrs["src"] = path
+                return match[0]
 
-            edited = True
+            image = Image(page=self, image=ContentFile(content, f"blobid{len(images)}{ext}"))
+            # compresses and writes the file
+            file = image_field.pre_save(image, True)  # type: ignore
+            images.append(image)
+            return match["start"] + html.escape(file.url) + match["quote"]
 
-        if edited:
-            self.content = soup.prettify()
-            super().save()
-
-    def _save_image(self, filename, content):
-        """
-        Saves the image with the corresponding filename and content.
-        Returns the URL.
-        """
-        Image: Type[ImageBase] = apps.get_model(self._meta.app_label, self._meta.model_name + "Image")  # type: ignore
-        image_obj = Image.objects.create(page=self, image=ContentFile(content, filename))
-        return image_obj.image.url
+        self.content = DATA_IMG_RE.sub(replace, self.content)
+        return images
 
     def __str__(self):  # pylint: disable=E0307
         return self.title
@@ -423,10 +481,66 @@ class ArticleImage(ImageBase):
         verbose_name_plural = _("article images")
 
 
-class GroupManager(models.Manager):
+# cache key of the routing table of the classes to the groups (see `GroupManager.get_routes`)
+GROUP_ROUTES_CACHE_KEY = "group_routes"
+# the cache may be local to each process, so the changes made in another process are seen after this delay
+GROUP_ROUTES_CACHE_TIMEOUT = getattr(settings, "GROUP_ROUTES_CACHE_TIMEOUT", 60)
+
+
+class GroupManager(CacheManager):
     def get_by_natural_key(self, name: str) -> "Group":
         return self.get_or_create(name=name)[0]
 
+    def get_routes(self) -> tuple[dict[str, int], int]:
+        """
+        Return a dictionary of the classes to the primary keys of their groups
+        and the primary key of the default group (for the other classes).
+        """
+        routes = cache.get(GROUP_ROUTES_CACHE_KEY)
+        if routes is None:
+            classes_to_groups: dict[str, int] = {}
+            for pk, classes in self.order_by("pk").values_list("pk", "classes"):
+                for classe in classes.splitlines():
+                    # the first group that contains the class wins
+                    classes_to_groups.setdefault(classe.strip(), pk)
+            classes_to_groups.pop("", None)
+            routes = (classes_to_groups, self.get_or_create(name="Autre")[0].pk)
+            # don't cache the groups of a transaction that may be rolled back
+            transaction.on_commit(lambda: cache.set(GROUP_ROUTES_CACHE_KEY, routes, GROUP_ROUTES_CACHE_TIMEOUT))
+        return routes
+
+    def get_for_class(self, classe: str) -> "Group":
+        """
+        Return the group of the children of the given class.
+        """
+        classes_to_groups, default = self.get_routes()
+        return self.get_by_pk(classes_to_groups.get(classe, default))
+
+    def assign_groups(self, queryset: "models.QuerySet[Child]") -> int:
+        """
+        Move the children of the queryset to the groups of their classes with a single `UPDATE`.
+        Return the number of updated children.
+        """
+        classes_to_groups, default = self.get_routes()
+        groups_to_classes: dict[int, list[str]] = {}
+        for classe, pk in classes_to_groups.items():
+            groups_to_classes.setdefault(pk, []).append(classe)
+        return queryset.update(
+            groupe=Case(
+                *(When(classe__in=classes, then=Value(pk)) for pk, classes in groups_to_classes.items()),
+                default=Value(default),
+            )
+        )
+
+
+def invalidate_group_routes(**_kwargs):
+    """
+    Clear the routing table of the groups (connected to the `post_save` and `post_delete` signals of `Group`).
+    """
+    cache.delete(GROUP_ROUTES_CACHE_KEY)
+    # another request may build the table from the previous groups before the transaction is committed
+    transaction.on_commit(lambda: cache.delete(GROUP_ROUTES_CACHE_KEY))
+
 
 class Group(models.Model):
     """
@@ -451,13 +565,35 @@ class Group(models.Model):
         verbose_name = _("group")
 
 
+# order of the school classes
+CLASSES_ORDER = ["PS", "MS", "GS", "CP", "CE1", "CE2", "CM1", "CM2", "6eme", "5eme", "4eme", "3eme", "2nde", "1ere", "terminale"]
+CLASS_RANKS = {classe: rank for rank, classe in enumerate(CLASSES_ORDER)}
+
+
+def class_rank(classe: str) -> int:
+    """Return the rank of a school class (the other classes are sorted last)."""
+    return CLASS_RANKS.get(classe, len(CLASSES_ORDER))
+
+
+def class_rank_expression(field="classe"):
+    """
+    Return an expression that computes the rank of the school class in the database,
+    e.g. `Child.objects.alias(class_rank=class_rank_expression()).order_by("class_rank")`.
+    """
+    return Case(
+        *(When(**{field: classe}, then=Value(rank)) for classe, rank in CLASS_RANKS.items()),
+        default=Value(len(CLASSES_ORDER)),
+        output_field=models.IntegerField(),
+    )
+
+
 @total_ordering
 class ClassesMixin:
     """Common methods to the `Classes` enums."""
-    order = ["PS", "MS", "GS", "CP", "CE1", "CE2", "CM1", "CM2", "6eme", "5eme", "4eme", "3eme", "2nde", "1ere", "terminale"]
+    order = CLASSES_ORDER
 
     def __lt__(self, other):
-        return self.order.index(self.value) < self.order.index(other.value)
+        return class_rank(self.value) < class_rank(other.value)
 
     def __getitem__(self, index):
         if isinstance(index, int):
@@ -465,12 +601,12 @@ class ClassesMixin:
         return super().__getitem__(index)
 
     def __add__(self, count):
-        return type(self)(self.order[self.order.index(self.value) + count])
+        return type(self)(self.order[class_rank(self.value) + count])
 
     def __sub__(self, other):
         if isinstance(other, type(self)):
-            return self.order.index(self.value) - self.order.index(other.value)
-        return type(self)(self.order[self.order.index(self.value) - other])
+            return class_rank(self.value) - class_rank(other.value)
+        return type(self)(self.order[class_rank(self.value) - other])
 
     def changed_school(self, other):
         """Return `True` if the child changed school between the two classes, `False` otherwise."""
@@ -489,40 +625,31 @@ class ClassesMixin:
 class ChildManager(models.Manager):
     """Manager for children. Returns only children for the current year (and the future years)."""
     def get_queryset(self):
-        return super().get_queryset().filter(year__start_year__gte=Year.get_current().start_year)
+        return super().get_queryset().filter(year__start_year__gte=Year.get_current_start_year())
 
     def get_by_natural_key(self, nom: str, prenom: str, year: int | None = None) -> "Child":
         if year is None:
-            year = Year.get_current().start_year
+            year = Year.get_current_start_year()
         return self.get(nom=nom, prenom=prenom, year__start_year=year)
 
 
 class OldChildManager(ChildManager):
     """Manager for old children. Returns only children for the previous years."""
     def get_queryset(self):
-        return super(ChildManager, self).get_queryset().filter(year__start_year__lt=Year.get_current().start_year)
+        return super(ChildManager, self).get_queryset().filter(year__start_year__lt=Year.get_current_start_year())
 
 
 class LastVersionManager(ChildManager):
     """Manager for children's last version. Returns the most recent version of a child."""
     def get_queryset(self):
-        seen_previous_years = set()
-        seen_this_year = set()
-        previous_year = None
-        pks = []
-
-        for child in super(ChildManager, self).get_queryset().order_by("year"):
-            if child.year != previous_year:
-                seen_previous_years.update(seen_this_year)
-                seen_this_year.clear()
-
-            if (child.nom, child.prenom) not in seen_previous_years:
-                pks.append(child.pk)
-            seen_this_year.add((child.nom, child.prenom))
-
-            previous_year = child.year
-
-        return super(ChildManager, self).get_queryset().order_by("year").filter(pk__in=pks)
+        children = super(ChildManager, self).get_queryset()
+        # the same child in a more recent year (uses the `common_child_name_year` index)
+        newer_versions = children.filter(
+            nom=OuterRef("nom"),
+            prenom=OuterRef("prenom"),
+            year__start_year__gt=OuterRef("year__start_year"),
+        )
+        return children.filter(~Exists(newer_versions)).order_by("year")
 
 
 def items_for(app, manager_class=models.Manager):
@@ -534,10 +661,10 @@ def items_for(app, manager_class=models.Manager):
 
 
 def get_default_group(pk=True):
-    ret, _ = Group.objects.get_or_create(name="Autre")
+    ret = Group.objects.get_routes()[1]
     if pk:
-        return ret.pk
-    return ret
+        return ret
+    return Group.objects.get_by_pk(ret)
 
 
 class Child(models.Model):
@@ -629,6 +756,13 @@ class Child(models.Model):
     class Meta:
         verbose_name = _("child")
         ordering = ["nom", "prenom"]
+        indexes = [
+            models.Index(fields=["nom", "prenom", "year"], name="common_child_name_year"),
+            # linking of the children to the users (see `common.linking`)
+            models.Index(Lower("email_jeune"), name="common_child_email_jeune"),
+            models.Index(Lower("email_mere"), name="common_child_email_mere"),
+            models.Index(Lower("email_pere"), name="common_child_email_pere"),
+        ]
 
     @property
     def app(self):
@@ -638,7 +772,7 @@ class Child(models.Model):
         return f"{self.prenom} {self.nom}"
 
     def natural_key(self) -> tuple[str, str, int]:
-        return (self.nom, self.prenom, self.year.start_year)
+        return (self.nom, self.prenom, Year.objects.get_by_pk(self.year_id).start_year)  # type: ignore
 
     @property
     def official_name(self):
@@ -646,11 +780,7 @@ class Child(models.Model):
 
     def get_assigned_group(self):
         """Return the group assigned to this child based on their class."""
-        groups = Group.objects.all()
-        for group in groups:
-            if any(self.classe == classe.strip() for classe in group.classes.splitlines()):
-                return group
-        return get_default_group(pk=False)
+        return Group.objects.get_for_class(self.classe)
 
     def has_two_parents(self) -> bool:
         """Return True if the child has two parents, False otherwise."""
@@ -957,11 +1087,43 @@ class Meeting(models.Model):
 
     def save(self, *args, **kwargs):
         add = self._state.adding
-        super().save(*args, **kwargs)
-        if add:
-            Attendance: Type[CommonAttendance] = apps.get_model(self._meta.app_label, "Attendance")  # type: ignore
-            for child in self.get_childs():
-                Attendance.objects.create(child=child, meeting=self, is_present=True, has_warned=False)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if add:
+                self.create_attendances([self])
+
+    @classmethod
+    def create_attendances(cls, meetings: "list[Meeting]") -> "list[Attendance]":
+        """
+        Create the attendances of the children of the given (saved) meetings with a single `INSERT`.
+        """
+        Attendance: Type[CommonAttendance] = apps.get_model(cls._meta.app_label, "Attendance")  # type: ignore
+        # the meetings of the same kind have the same children
+        child_pks: dict[str, list[int]] = {}
+        attendances = []
+        for meeting in meetings:
+            if meeting.kind not in child_pks:
+                child_pks[meeting.kind] = list(meeting.get_childs().values_list("pk", flat=True))
+            attendances.extend(
+                Attendance(child_id=pk, meeting=meeting, is_present=True, has_warned=False)
+                for pk in child_pks[meeting.kind]
+            )
+        return Attendance.objects.bulk_create(attendances)
+
+    @classmethod
+    def bulk_create_with_attendances(cls, meetings: "list[Meeting]") -> "list[Meeting]":
+        """
+        Create the given meetings and their attendances (with one `INSERT` for each table).
+        """
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                meetings = cls.objects.bulk_create(meetings)
+            else:
+                # we need the primary keys for the attendances
+                for meeting in meetings:
+                    super(Meeting, meeting).save()
+            cls.create_attendances(meetings)
+        return meetings
 
     def __str__(self):
         return self.name or self.get_kind_display()  # type: ignore
@@ -0,0 +1,135 @@
+"""
+Navigation menu of the pages (see the `nav` template tag).
+
+The menu is rendered once for each permission level and language and cached until a page is changed.
+The rendered menu is split before the `href` of each link, so the active link is highlighted
+for each request without resolving the URLs again.
+"""
+
+from typing import Any, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest
+from django.urls import Resolver404, ResolverMatch, resolve
+from django.utils.html import escape
+from django.utils.safestring import SafeString, mark_safe
+from django.utils.translation import get_language
+
+from .models import Page
+from .views import PageView, has_permission
+
+CACHE_KEY = "nav"
+# the cache may be local to each process, so the changes made in another process are seen after this delay
+CACHE_TIMEOUT = getattr(settings, "NAV_CACHE_TIMEOUT", 60)
+
+
+class RenderedNav(NamedTuple):
+    """
+    Menu rendered in `fragments` (a fragment before each link and a fragment at the end)
+    and the views of the links (see `view_key`).
+    """
+
+    fragments: list[str]
+    views: list[Any]
+
+
+def view_key(match: ResolverMatch | None):
+    """
+    Return a value that identifies the view of a resolved URL and its arguments.
+    """
+    if match is None:
+        return None
+    # `as_view()` returns a different function each time it's called
+    func = getattr(match.func, "view_class", match.func)
+    return (f"{func.__module__}.{func.__qualname__}", tuple(match.args), tuple(sorted(match.kwargs.items())))
+
+
+def build_nav(pages: list[Page]) -> RenderedNav:
+    """
+    Render the menu of the given pages (sorted by order).
+    """
+    child_pages: dict[int | None, list[Page]] = {}
+    for page in pages:
+        child_pages.setdefault(page.parent_page_id, []).append(page)  # type: ignore
+
+    fragments: list[str] = []
+    views: list[Any] = []
+    current = ['<ul>\n<label class="nav__close" for="menu-checkbox"></label>\n']
+
+    def render(page: Page):
+        href = page.get_absolute_url()
+        try:
+            match = resolve(href) if href != "#" else None
+        except Resolver404:
+            match = None
+
+        current.append("\t<li><a")
+        fragments.append("".join(current))
+        current.clear()
+        views.append(view_key(match))
+
+        subpages = child_pages.get(page.pk, [])
+        message = []
+        if page.hidden:
+            message.append("cachée")
+        if page.slug != Page.HOME_TEMPLATE.slug and not page.content and not page.url and not subpages:
+            message.append("vide")
+
+        current.append(' href="' + escape(href) + '">')
+        if message:
+            current.append(f"<i>(<small>Page {escape(', '.join(message))} :</small> ")
+        current.append(escape(page.title))
+        if message:
+            current.append(")</i>")
+        current.append("</a>")
+
+        if subpages:
+            current.append("<ul>\n")
+            for subpage in subpages:
+                render(subpage)
+            current.append("</ul>\n")
+        current.append("</li>\n")
+
+    for page in child_pages.get(None, []):
+        render(page)
+    current.append("</ul>\n")
+    fragments.append("".join(current))
+
+    return RenderedNav(fragments, views)
+
+
+def get_nav(request: HttpRequest) -> RenderedNav:
+    """
+    Return the cached menu for the permissions and the language of the request.
+    """
+    key = (has_permission(request, Page, "view"), get_language())
+    navs: dict[tuple[bool, str], RenderedNav] = cache.get(CACHE_KEY) or {}
+    if key not in navs:
+        navs[key] = build_nav(list(PageView(request=request).get_queryset(nav=True)))
+        cache.set(CACHE_KEY, navs, CACHE_TIMEOUT)
+    return navs[key]
+
+
+def render_nav(request: HttpRequest) -> SafeString:
+    """
+    Return the HTML code of the menu with the link of the current page highlighted.
+    """
+    nav = get_nav(request)
+    current_view = view_key(request.resolver_match)
+    ret = [nav.fragments[0]]
+    for view, fragment in zip(nav.views, nav.fragments[1:]):
+        if view is not None and view == current_view:
+            ret.append(' class="act"')
+        ret.append(fragment)
+    return mark_safe("".join(ret))
+
+
+def invalidate(**_kwargs):
+    """
+    Clear the cached menus (connected to the `post_save` and `post_delete` signals of `Page`).
+    """
+    cache.delete(CACHE_KEY)
+    # another request may cache the previous pages before the transaction is committed
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
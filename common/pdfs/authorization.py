@@ -6,7 +6,7 @@ from django.http import Http404, HttpRequest, QueryDict
 from django.shortcuts import get_object_or_404
 from fpdf.enums import Align, XPos, YPos
 
-from ..models import Child, Year
+from ..models import Child, Group, Year
 from . import PDF
 
 HERE = Path(__file__).resolve()
@@ -37,7 +37,7 @@ class AuthorizationData:
                 child = get_object_or_404(Child, user=request.user, pk=data["pk"])
             data = {
                 **data,
-                "app": child.groupe.app,
+                "app": Group.objects.get_by_pk(child.groupe_id).app,  # type: ignore
                 "child_name": str(child),
                 "photos": child.photos,
             }
@@ -118,7 +118,7 @@ class Calendar(PDF):
         super().__init__("L", *args, **kwargs)
 
     def render(self, app: Literal["espacecate", "aumonerie"], request: HttpRequest):
-        start_year = Year.get_current().start_year
+        start_year = Year.get_current_start_year()
 
         self.set_auto_page_break(False, margin=10)
 
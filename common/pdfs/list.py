@@ -3,6 +3,7 @@ from typing import Literal, Type
 
 from django.conf import settings
 from django.db import models
+from django.db.models import F
 from django.http import HttpRequest
 from django.utils.crypto import get_random_string
 from django.utils.formats import localize_input
@@ -11,7 +12,7 @@ from fpdf.enums import AccessPermission, Align, XPos, YPos
 from fpdf.fonts import FontFace
 from phonenumbers import region_codes_for_country_code
 
-from ..models import Child, Year
+from ..models import Child, Year, class_rank, class_rank_expression
 from . import PDF, Table
 
 
@@ -103,11 +104,16 @@ class List(PDF):
         return ret_str[0].upper() + ret_str[1:]
 
     def get_childs_and_regroup_check(self, regroup_by=None):
-        childs = self.Child.objects.all()
+        # the childs are sorted by class in the database
+        childs = self.Child.objects.alias(class_rank=class_rank_expression())
         if regroup_by == "groupe":
-            childs = childs.select_related("groupe")
-
-        childs = sorted(childs, key=lambda child: self.classes.index(child.classe))
+            # the childs without a group come first
+            childs = childs.select_related("groupe").order_by(
+                F("groupe__name").asc(nulls_first=True), "class_rank", "nom", "prenom"
+            )
+        else:
+            childs = childs.order_by("class_rank", "nom", "prenom")
+        childs = list(childs)
 
         regroup_check = None
 
@@ -116,17 +122,15 @@ class List(PDF):
 
         elif regroup_by == "groupe":
 
-            def get_group(child, sorting=True):
-                # use "" when sorting so the childs appear at the top
-                return child.groupe.name if child.groupe else ("" if sorting else "Aucun groupe")
+            def get_group(child):
+                return child.groupe.name if child.groupe else "Aucun groupe"
 
-            regroup_check = lambda row_n: get_group(childs[row_n], False)  # noqa
-            childs = sorted(childs, key=get_group)
+            regroup_check = lambda row_n: get_group(childs[row_n])  # noqa
 
         elif regroup_by == "annees" and self.app == "espacecate":
 
             def get_years(child):
-                classe = self.classes.index(child.classe)
+                classe = class_rank(child.classe)
                 if classe <= 3:  # PS, MS, GS, CP
                     return -1
                 return child.annees_kt or classe - 3
@@ -141,7 +145,7 @@ class List(PDF):
 
             childs = sorted(childs, key=get_years)
 
-        return list(childs), regroup_check  # fetch the childs
+        return childs, regroup_check
 
     filename = "liste"
 
@@ -8,6 +8,8 @@ from django.utils.crypto import get_random_string
 from fpdf.enums import AccessPermission, Align, XPos, YPos
 from fpdf.fonts import FontFace
 
+from tracking.cache import fill_related
+
 from ..models import Child, Year
 from . import PDF, Cell, Table
 
@@ -187,6 +189,7 @@ class QuickList(PDF):
             return str(ret) if ret else ""
 
         childs = list(self.Child.objects.all())  # fetch the childs
+        fill_related(childs, "groupe")
 
         table_data: list[tuple[str, ...]] = [
             # ("Nom", "Prénom"),
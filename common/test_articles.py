@@ -1,12 +1,17 @@
 import datetime
+import tempfile
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
+from django.db import connection
 from django.shortcuts import resolve_url
-from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .models import Article
+from common.test_utils import TestCase
+
+from .models import Article, ArticleImage
 
 now = datetime.datetime(2023, 1, 1, 12, 0, 0)
 one_day = datetime.timedelta(days=1)
@@ -125,3 +130,36 @@ class ArticlesTests(TestCase):
         response = self.client.get(resolve_url(article))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, article.content)
+
+    def test_slugs(self):
+        """
+        The slugs of the articles with the same title are numbered
+        """
+        Article.objects.create(title="Rencontre de caté", date=now)
+        Article.objects.create(title="Rencontre de caté", date=now)
+        Article.objects.create(title="Rencontre de caté suite", date=now)
+        with self.assertNumQueries(1):
+            self.assertEqual(Article.objects.free_slugs(["rencontre-de-cate"]), ["rencontre-de-cate-2"])
+
+        articles = Article.objects.bulk_create([Article(title="Rencontre de caté", date=now) for _ in range(2)])
+        self.assertEqual([article.slug for article in articles], ["rencontre-de-cate-2", "rencontre-de-cate-3"])
+        self.assertEqual(Article.objects.get(title="Rencontre de caté suite").slug, "rencontre-de-cate-suite")
+
+    def test_base64_images(self):
+        """
+        The Base64 images are written to files and the article is saved once
+        """
+        png = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+        content = f'<p>Text</p><img alt="a" src="data:image/png;base64,{png}"><img src="/image.png">'
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(MEDIA_ROOT=tmpdir):
+            with CaptureQueriesContext(connection) as queries:
+                article = Article.objects.create(title="Images", content=content, date=now)
+            # the article is inserted with the final content and never updated
+            writes = [query["sql"] for query in queries if '"common_article"' in query["sql"]]
+            self.assertEqual([sql.split()[0] for sql in writes], ["SELECT", "INSERT"])
+
+            image = ArticleImage.objects.get()
+            self.assertEqual(image.page, article)
+            self.assertTrue(image.image.storage.exists(image.image.name))
+            self.assertEqual(article.content, f'<p>Text</p><img alt="a" src="{image.image.url}"><img src="/image.png">')
+            self.assertEqual(Article.objects.get().content, article.content)
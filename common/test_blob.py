@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from storage.blob import BlobFileStorage, clear_blob_cache, stats
+
+PREFIX = "https://blob.test/"
+
+
+class BlobAPIHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the Vercel Blob API that fails with 503 errors `failures` times before answering.
+    """
+
+    failures = 0
+    # numbers of the parts of the multipart uploads that fail once
+    failing_parts: ClassVar[set[int]] = set()
+    blobs: ClassVar[dict[str, bytes]] = {}
+    parts: ClassVar[dict[int, bytes]] = {}
+    requests: ClassVar[list[tuple[str, str]]] = []
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.requests.append((self.command, self.path))
+        if BlobAPIHandler.failures:
+            BlobAPIHandler.failures -= 1
+            self.respond(503, {"error": "unavailable"})
+            return None
+        return body
+
+    def blob(self, pathname):
+        return {"url": PREFIX + pathname, "pathname": pathname, "size": len(self.blobs[pathname])}
+
+    def do_GET(self):  # pylint: disable=C0103
+        if self.handle_request() is None:
+            return
+        query = {key: value[0] for key, value in parse_qs(urlsplit(self.path).query).items()}
+        prefix = query.get("prefix", "")
+        pathnames = [pathname for pathname in sorted(self.blobs) if pathname.startswith(prefix)]
+        if query.get("mode") == "folded":
+            pathnames = [pathname for pathname in pathnames if "/" not in pathname.removeprefix(prefix)]
+        self.respond(200, {"blobs": [self.blob(pathname) for pathname in pathnames], "folders": []})
+
+    def do_PUT(self):  # pylint: disable=C0103
+        body = self.handle_request()
+        if body is None:
+            return
+        pathname = self.path.lstrip("/")
+        self.blobs[pathname] = body
+        self.respond(200, {"url": PREFIX + pathname, "pathname": pathname})
+
+    def do_POST(self):  # pylint: disable=C0103
+        body = self.handle_request()
+        if body is None:
+            return
+        pathname = parse_qs(urlsplit(self.path).query).get("pathname", [""])[0]
+        action = self.headers.get("X-Mpu-Action")
+        if action == "create":
+            self.parts.clear()
+            self.respond(200, {"key": "key/" + pathname, "uploadId": "upload"})
+        elif action == "upload":
+            number = int(self.headers["X-Mpu-Part-Number"])
+            if self.headers["X-Mpu-Key"] != "key%2F" + pathname.replace("/", "%2F"):
+                self.respond(400, {"error": "invalid key"})
+            elif number in self.failing_parts:
+                self.failing_parts.remove(number)
+                self.respond(503, {"error": "unavailable"})
+            else:
+                self.parts[number] = body
+                self.respond(200, {"etag": f"etag{number}"})
+        elif action == "complete":
+            parts = json.loads(body)
+            self.blobs[pathname] = b"".join(self.parts[part["partNumber"]] for part in parts)
+            self.respond(200, {"url": PREFIX + pathname, "pathname": pathname})
+        else:
+            for pathname in json.loads(body)["urls"]:
+                self.blobs.pop(pathname, None)
+            self.respond(200, {})
+
+    def log_message(self, *args):
+        pass
+
+
+class BlobTests(SimpleTestCase):
+    """
+    Tests on the Vercel Blob storage.
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_blob_cache()
+        BlobAPIHandler.failures = 0
+        BlobAPIHandler.failing_parts = set()
+        BlobAPIHandler.blobs = {
+            "folder/a.txt": b"a",
+            "folder/b.txt": b"bb",
+            "folder/sub/c.txt": b"ccc",
+            "folder/file.txt": b"f" * 42,
+        }
+        BlobAPIHandler.requests = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), BlobAPIHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.api_url = f"http://127.0.0.1:{server.server_address[1]}/"
+        self.storage = self.get_storage()
+
+    def get_storage(self, **kwargs):
+        return BlobFileStorage("folder", token="token", api_url=self.api_url, timeout=5, backoff_factor=0, **kwargs)
+
+    def test_retry(self):
+        """
+        The idempotent requests are retried with the same session, the other requests aren't
+        """
+        BlobAPIHandler.failures = 1
+        count = stats["GET.count"]
+        self.assertEqual(self.storage.size("file.txt"), 42)
+        self.assertEqual(len(BlobAPIHandler.requests), 2)
+        self.assertEqual(BlobAPIHandler.requests[0], BlobAPIHandler.requests[1])
+        self.assertEqual(stats["GET.count"], count + 1)
+
+        session = self.storage.session
+        self.storage.listdir("")
+        self.assertIs(self.storage.session, session)
+
+        BlobAPIHandler.requests = []
+        BlobAPIHandler.failures = 1
+        with self.assertRaises(requests.HTTPError):
+            self.storage.delete("file.txt")
+        self.assertEqual(BlobAPIHandler.requests, [("POST", "/delete")])
+
+    def test_cache(self):
+        """
+        The information of the blobs is cached
+        """
+        self.storage.prefetch(["a.txt", "b.txt", "missing.txt", "sub/c.txt"])
+        self.assertEqual(len(BlobAPIHandler.requests), 2)
+
+        BlobAPIHandler.requests = []
+        self.assertEqual(self.storage.url("sub/c.txt"), PREFIX + "folder/sub/c.txt")
+        self.assertEqual(self.storage.size("b.txt"), 2)
+        self.assertFalse(self.storage.exists("missing.txt"))
+        # the prefix is known
+        self.assertEqual(self.storage.url("other.txt"), PREFIX + "folder/other.txt")
+
+        # the information is shared with the other processes
+        clear_blob_cache()
+        storage = self.get_storage()
+        self.assertEqual(storage.url("a.txt"), PREFIX + "folder/a.txt")
+        self.assertTrue(storage.exists("a.txt"))
+        self.assertEqual(BlobAPIHandler.requests, [])
+
+        # a list request, then the upload
+        self.assertEqual(storage.save("new.txt", ContentFile(b"new")), "new.txt")
+        self.assertEqual(len(BlobAPIHandler.requests), 2)
+        self.assertEqual(storage.size("new.txt"), 3)
+        self.assertEqual(BlobAPIHandler.blobs["folder/new.txt"], b"new")
+
+        BlobAPIHandler.requests = []
+        storage.delete("new.txt")
+        self.assertFalse(storage.exists("new.txt"))
+        self.assertEqual(BlobAPIHandler.requests, [("POST", "/delete")])
+
+    def test_other_process(self):
+        """
+        The changes made by the other processes are seen through the Django cache
+        """
+        self.assertFalse(self.storage.exists("new.txt"))
+
+        # another process uploads the file, this process has nothing in memory about it
+        self.get_storage().save("new.txt", ContentFile(b"new"))
+        BlobAPIHandler.requests = []
+        self.assertTrue(self.storage.exists("new.txt"))
+        self.assertEqual(self.storage.size("new.txt"), 3)
+        self.assertEqual(BlobAPIHandler.requests, [])
+
+        # another process deletes the file (in the Django cache only, the memory of this process isn't shared)
+        cache.set(self.storage._cache_key("folder/new.txt"), False)
+        self.assertTrue(self.storage.exists("new.txt"))
+        with mock.patch("storage.blob.time.monotonic", return_value=time.monotonic() + 60):
+            self.assertFalse(self.storage.exists("new.txt"))
+
+    def test_multipart_upload(self):
+        """
+        The big files are uploaded in parts, and the failed parts are retried
+        """
+        storage = self.get_storage(multipart_threshold=10, part_size=4, max_workers=2)
+        content = bytes(range(30))
+        BlobAPIHandler.failing_parts = {2}
+        with self.assertLogs("storage.blob", "WARNING"):
+            self.assertEqual(storage.save("sub/big.bin", ContentFile(content)), "sub/big.bin")
+        self.assertEqual(BlobAPIHandler.blobs["folder/sub/big.bin"], content)
+        # a list request, the creation, 8 parts + 1 retry and the completion
+        self.assertEqual(len(BlobAPIHandler.requests), 12)
+        self.assertEqual(storage.size("sub/big.bin"), 30)
@@ -1,12 +1,19 @@
 import datetime as dt
+from unittest import mock
 from urllib.parse import urlparse
 
 from common.test_utils import REMOVED, DefaultArgs, TestCase, clean
+from allauth.account.models import EmailAddress
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.http import HttpResponseRedirect
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from espacecate.models import Meeting as EspacecateMeeting
 
-from .models import Child
+from .models import Attendance, Child, Group, LastChildVersion, Meeting, Year, class_rank_expression
 
 webpage_def_args = DefaultArgs(
     {
@@ -135,3 +142,163 @@ class ChildsTests(TestCase):
         for key, value in args.items():
             self.assertTrue(hasattr(child, key), f"The attribute {key} should exist")
             self.assertEqual(getattr(child, key), value)
+
+    def test_last_version(self):
+        """
+        Only the most recent version of each child is returned
+        """
+        current_year = Year.get_current()
+        old_year = Year.objects.create(start_year=current_year.start_year - 1, is_active=False)
+        older_year = Year.objects.create(start_year=current_year.start_year - 2, is_active=False)
+        Child.objects.create(**def_args(), year=older_year)
+        Child.objects.create(**def_args(), year=old_year)
+        Child.objects.create(**def_args(prenom="Paul"), year=older_year)
+        last = Child.objects.create(**def_args(), year=current_year)
+
+        with self.assertNumQueries(1):
+            children = list(LastChildVersion.objects.all())
+        self.assertEqual(
+            [(child.prenom, child.year_id) for child in children],
+            [("Laurent", last.year_id), ("Paul", older_year.pk)],
+        )
+
+    @override_settings(ACCOUNT_EMAIL_VERIFICATION="optional")
+    def test_link_children(self):
+        """
+        The children are linked to the user when they log in with a verified email
+        """
+        user = get_user_model().objects.create_user("lfavole")
+        EmailAddress.objects.create(user=user, email="ABC@gmail.com", verified=True)
+        EmailAddress.objects.create(user=user, email="def@gmail.com", verified=False)
+        linked = Child.objects.create(**def_args())
+        not_linked = Child.objects.create(**def_args(prenom="Paul", email_pere="", email_mere="def@gmail.com"))
+
+        self.client.force_login(user)
+        linked.refresh_from_db()
+        not_linked.refresh_from_db()
+        self.assertEqual(linked.user, user)
+        self.assertIsNone(not_linked.user)
+
+        response = self.client.get(reverse("inscription"))
+        self.assertContains(response, "Laurent")
+
+    def test_link_children_signup(self):
+        """
+        The children are linked to a new user when the email verification is disabled
+        """
+        child = Child.objects.create(**def_args())
+        response = self.client.post(
+            reverse("account_signup"),
+            {"username": "abc", "email": "abc@gmail.com", "password1": "K8r!pz2Wq", "password2": "K8r!pz2Wq"},
+        )
+        self.assertEqual(response.status_code, 302)
+        child.refresh_from_db()
+        self.assertEqual(child.user, get_user_model().objects.get(email="abc@gmail.com"))
+        self.assertFalse(EmailAddress.objects.get(email="abc@gmail.com").verified)
+
+        # a child added later is linked at the next login, not on the subscription page
+        other = Child.objects.create(**def_args(prenom="Paul"))
+        response = self.client.get(reverse("inscription"))
+        self.assertNotContains(response, "Paul")
+        self.client.logout()
+        self.client.force_login(child.user)
+        response = self.client.get(reverse("inscription"))
+        self.assertContains(response, "Paul")
+        other.refresh_from_db()
+        self.assertEqual(other.user, child.user)
+
+    def test_meeting_attendances(self):
+        """
+        The attendances of a new meeting are created with a single query
+        """
+        for name in ("Laurent", "Paul", "Marie"):
+            Child.objects.create(**def_args(prenom=name))
+
+        meeting = Meeting(date=dt.date(2023, 10, 1), kind=Meeting.Kind.MESSE_FAMILLES)
+        with CaptureQueriesContext(connection) as queries:
+            meeting.save()
+        inserts = [query["sql"] for query in queries if query["sql"].startswith('INSERT INTO "common_attendance"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(meeting.attendance_set.count(), 3)  # type: ignore
+
+        # the databases that don't return the primary keys of the bulk inserts (MySQL)
+        features = type(connection.features)
+        with mock.patch.object(features, "can_return_rows_from_bulk_insert", mock.PropertyMock(return_value=False)):
+            meetings = Meeting.bulk_create_with_attendances(
+                [Meeting(date=dt.date(2023, 10, day), kind=Meeting.Kind.MESSE_FAMILLES) for day in (8, 15)]
+            )
+        for meeting in meetings:
+            self.assertEqual(meeting.attendance_set.count(), 3)  # type: ignore
+
+    def test_repeat_meeting(self):
+        """
+        The meetings are repeated every week until the end of the term
+        """
+        Child.objects.create(**def_args())
+        user = get_user_model().objects.create_superuser("admin")
+        self.client.force_login(user)
+        meeting = EspacecateMeeting.objects.create(date=dt.date(2023, 11, 26), kind=Meeting.Kind.MESSE_FAMILLES)
+        EspacecateMeeting.objects.create(date=dt.date(2023, 12, 10), kind=Meeting.Kind.MESSE_FAMILLES)
+
+        response = self.client.post(
+            reverse("admin:espacecate_meeting_changelist"),
+            {"action": "repeat_weekly", ACTION_CHECKBOX_NAME: [meeting.pk]},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(Meeting.objects.order_by("date").values_list("date", flat=True)),
+            [
+                dt.date(2023, 11, 26),
+                dt.date(2023, 12, 3),
+                dt.date(2023, 12, 10),
+                dt.date(2023, 12, 17),
+                dt.date(2023, 12, 24),
+                dt.date(2023, 12, 31),
+            ],
+        )
+        self.assertEqual(Attendance.objects.count(), 6)
+
+    def test_assigned_group(self):
+        """
+        The groups are assigned from a cached routing table of the classes
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            cm = Group.objects.create(name="CM", classes="CM1\nCM2 \n")
+            ce = Group.objects.create(name="CE", classes="CE1\nCE2\nCM2")
+            default = Group.objects.get_by_pk(Group.objects.get_routes()[1])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Child(classe="CM2").get_assigned_group(), cm)
+            self.assertEqual(Child(classe="CE1").get_assigned_group(), ce)
+            self.assertEqual(Child(classe="6eme").get_assigned_group(), default)
+
+        # the table is rebuilt when a group is changed
+        with self.captureOnCommitCallbacks(execute=True):
+            ce.classes += "\n6eme"
+            ce.save()
+            self.assertEqual(Child(classe="6eme").get_assigned_group(), ce)
+
+        children = [
+            Child.objects.create(**def_args(classe=classe, prenom=classe)) for classe in ("CM1", "CE2", "6eme", "PS")
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(Group.objects.assign_groups(Child.objects.all()), 4)
+        self.assertEqual(
+            [Child.objects.get(pk=child.pk).groupe_id for child in children], [cm.pk, ce.pk, ce.pk, default.pk]
+        )
+
+    def test_class_rank(self):
+        """
+        The children are sorted by school class in the database
+        """
+        for classe in ("autre", "6eme", "PS", "CM2", "terminale"):
+            Child.objects.create(**def_args(classe=classe, prenom=classe))
+
+        children = Child.objects.alias(class_rank=class_rank_expression()).order_by("class_rank")
+        self.assertEqual([child.classe for child in children], ["PS", "CM2", "6eme", "terminale", "autre"])
+
+        self.assertLess(Child.Classes.CM2, Child.Classes.SIXIEME)
+        self.assertEqual(Child.Classes.CM2 + 1, Child.Classes.SIXIEME)
+        self.assertEqual(Child.Classes.SIXIEME - Child.Classes.CM1, 2)
+        with self.assertRaises(IndexError):
+            Child.Classes.AUTRE + 1
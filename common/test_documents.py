@@ -0,0 +1,77 @@
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from django.urls import reverse
+
+from common.test_utils import TestCase
+
+from .models import Document
+from .views import parse_range
+
+CONTENT = bytes(range(256)) * 40
+
+
+class DocumentsTests(TestCase):
+    """
+    Tests on the documents.
+    """
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=tmpdir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.document = Document.objects.create(title="Document", file=ContentFile(CONTENT, "document.pdf"))
+        self.url = reverse("document", args=(self.document.pk,))
+
+    def test_download(self):
+        """
+        The document is downloaded as an attachment with an ETag
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), CONTENT)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response["Content-Disposition"].startswith("attachment"))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(self.url, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        """
+        The byte ranges are supported
+        """
+        response = self.client.get(self.url, headers={"Range": "bytes=100-199", "Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(CONTENT)}")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(b"".join(response.streaming_content), CONTENT[100:200])
+
+        response = self.client.get(self.url, headers={"Range": "bytes=-10"})
+        self.assertEqual(b"".join(response.streaming_content), CONTENT[-10:])
+
+        # the file has changed
+        response = self.client.get(self.url, headers={"Range": "bytes=100-199", "If-Range": '"0-0"'})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        response = self.client.get(self.url, headers={"Range": f"bytes={len(CONTENT)}-"})
+        self.assertEqual(response.status_code, 416)
+
+        self.assertEqual(parse_range("bytes=0-10,20-30", 100), None)
+        self.assertEqual(parse_range("bytes=90-200", 100), (90, 99))
+
+    @override_settings(SENDFILE_MODE="x-accel-redirect")
+    def test_x_accel_redirect(self):
+        """
+        The web server can send the document
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/internal-media/" + self.document.file.name)
+        self.assertEqual(response.content, b"")
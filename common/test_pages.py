@@ -1,12 +1,15 @@
 import datetime
 
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import AnonymousUser, Permission
 from django.shortcuts import resolve_url
-from django.test import TestCase
-from django.urls import reverse
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from common.test_utils import TestCase
 
 from .models import Article, Page
+from .nav import render_nav
 
 now = datetime.datetime(2023, 1, 1, 12, 0, 0)
 one_day = datetime.timedelta(days=1)
@@ -139,3 +142,32 @@ class PagesTests(TestCase):
         response = self.client.get(resolve_url(article))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, article.content)
+
+    def test_nav(self):
+        """
+        The menu is cached until a page is changed and the current page is highlighted
+        """
+        page = Page.objects.create(title="Test page", content="The content of the page...")
+        hidden_page = Page.objects.create(title="Hidden page", content="...", hidden=True)
+
+        response = self.client.get(resolve_url(page))
+        self.assertContains(response, f"<a class=act href={resolve_url(page)}>Test page</a>")
+        self.assertNotContains(response, hidden_page.title)
+
+        request = RequestFactory().get(resolve_url(page))
+        request.user = AnonymousUser()
+        request.resolver_match = resolve(resolve_url(page))
+        with self.assertNumQueries(0):
+            self.assertIn("Test page", render_nav(request))
+
+        page.title = "Renamed page"
+        page.save()
+        response = self.client.get(resolve_url(page))
+        self.assertContains(response, "Renamed page")
+
+        # the admins have another menu
+        self.prepare_user()
+        view_pages = Permission.objects.get_by_natural_key("view_page", "common", "page")
+        get_user_model().objects.get(username="lfavole").user_permissions.add(view_pages)
+        response = self.client.get(resolve_url(page))
+        self.assertContains(response, "Page cachée")
@@ -1,5 +1,6 @@
 from contextlib import contextmanager
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.test import TestCase as DjangoTestCase
@@ -54,6 +55,11 @@ class TestCase(DjangoTestCase):
     Test case class with custom methods.
     """
 
+    def setUp(self):
+        super().setUp()
+        # the cache isn't rolled back with the database
+        cache.clear()
+
     # https://gist.github.com/hzlmn/6b7bc384301afefcac6de3829bd4c032
     @contextmanager
     def assertValidationOK(self):
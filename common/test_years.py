@@ -83,3 +83,20 @@ class YearTests(TestCase):
         # reload from database
         year2 = Year.objects.get(pk=year2.pk)
         self.assertTrue(year2.is_active, "The second year should be active")
+
+    def test_current_year_cache(self):
+        """
+        * 2022 => active
+        * 2023 => active
+
+        => the current year is cached, then it becomes 2023
+        """
+        Year.objects.all().delete()  # remove the default years
+
+        Year(start_year=y1, is_active=True).save()
+        self.assertEqual(Year.get_current().start_year, y1)
+        with self.assertNumQueries(0):
+            self.assertEqual(Year.get_current_start_year(), y1)
+
+        Year(start_year=y2, is_active=True).save()
+        self.assertEqual(Year.get_current_start_year(), y2)
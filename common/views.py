@@ -3,25 +3,26 @@ import mimetypes
 from pathlib import Path
 from typing import Any, Literal, Optional, Type
 from urllib.parse import quote, urlencode
-from django.conf import settings
-from django.db import models
 
 from allauth.account.models import EmailAddress
+from django.conf import settings
 from django.contrib.auth import get_permission_codename
 from django.contrib.auth.decorators import login_required
-from django.contrib.messages import add_message
-from django.contrib.messages.constants import INFO
+from django.db import models
 from django.db.models import Model
 from django.db.models.fields.files import FieldFile
 from django.db.models.query_utils import Q
-from django.http import FileResponse, Http404, HttpRequest, HttpResponse, HttpResponseNotModified
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.utils.http import content_disposition_header, http_date
 from django.utils.timezone import now
 from django.views import generic
-from django.views.static import was_modified_since
-from icalendar import Alarm, Calendar as ICalendar, Event
+from icalendar import Alarm, Event
+from icalendar import Calendar as ICalendar
+
+from cate.cache import PUBLIC_CACHE_DATED_TIMEOUT
 
 from .forms import SubscriptionForm
 from .models import (
@@ -53,28 +54,8 @@ def _encode_filename(filename: str):
         return "filename*=utf-8''{}".format(quote(filename))
 
 
-def link_children(request):
-    """
-    Link unlinked children that don't have a user to a user if a verified email matches.
-    """
-    children = LastChildVersion.objects.filter(user=None)
-    email_addresses = EmailAddress.objects.filter(user=request.user)
-    for child in children:
-        for email in email_addresses:
-            if any(
-                email_to_try == email.email
-                for email_to_try in (child.email_jeune, child.email_mere, child.email_pere)
-            ):
-                child.user = request.user
-                child.save()
-                add_message(request, INFO, f"Enfant {child} lié à votre compte.")
-                break
-
-
 @login_required
 def subscription(request):
-    link_children(request)
-
     emails = EmailAddress.objects.filter(user=request.user)
     children = LastChildVersion.objects.filter(user=request.user, year__lt=Year.get_current())
     registered_children = LastChildVersion.objects.filter(user=request.user, year=Year.get_current())
@@ -108,7 +89,8 @@ def subscription_old(request, pk):
     else:
         old_class = Child.Classes(child.classe)
         try:
-            child.classe = (Child.Classes(child.classe) + (Year.get_current() - child.year)).value
+            year = Year.objects.get_by_pk(child.year_id)  # type: ignore
+            child.classe = (Child.Classes(child.classe) + (Year.get_current() - year)).value
         except IndexError:
             child.classe = Child.Classes.AUTRE
 
@@ -270,6 +252,7 @@ class PageView(BaseView, generic.DetailView):
     """
 
     model = Page
+    public_cache = True
     context_object_name = "page"
     template_name = "common/page.html"
 
@@ -291,6 +274,9 @@ class ArticleListView(BaseView, generic.ListView):
     """
 
     model = Article
+    public_cache = True
+    # the articles are shown from their date
+    public_cache_timeout = PUBLIC_CACHE_DATED_TIMEOUT
     context_object_name = "articles"
     template_name = "common/articles.html"
 
@@ -307,6 +293,7 @@ class ArticleView(BaseView, generic.DetailView):
     """
 
     model = Article
+    public_cache = True
     context_object_name = "article"
     template_name = "common/article.html"
 
@@ -323,6 +310,9 @@ class DateListView(BaseView, generic.ListView):
     """
 
     model = Date
+    public_cache = True
+    # the past dates are shown differently
+    public_cache_timeout = PUBLIC_CACHE_DATED_TIMEOUT
     context_object_name = "dates"
     template_name = "common/dates.html"
 
@@ -341,6 +331,7 @@ class DocumentListView(BaseView, generic.ListView):
     """
 
     model = Document
+    public_cache = True
     context_object_name = "docs"
     template_name = "common/docs.html"
 
@@ -369,9 +360,53 @@ class DocumentListView(BaseView, generic.ListView):
         return kwargs
 
 
+# size of the chunks of the partial responses
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Return the first and last byte positions of a `Range` header with a single byte range,
+    `None` if the header must be ignored (e.g. multiple ranges).
+    Raise `ValueError` if the range can't be satisfied.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+    first, sep, last = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            # suffix range: the last bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(f"Unsatisfiable range {header!r} for {size} bytes")
+    return start, min(end, size - 1)
+
+
+def _read_range(path: Path, start: int, length: int):
+    with path.open("rb") as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
 def serve(request, obj: Document | FieldFile | Path | str):
     """
-    Return a response that serves a file.
+    Return a response that serves a file as an attachment.
+
+    The conditional requests (with a strong `ETag` made from the size and the modification time)
+    and the single byte ranges are supported.
+    With the `SENDFILE_MODE` setting, the web server sends the media files itself.
     """
     if isinstance(obj, Document):
         obj = obj.file
@@ -383,18 +418,57 @@ def serve(request, obj: Document | FieldFile | Path | str):
         return redirect(obj.url)
 
     fullpath = Path(obj)
-
-    # Respect the If-Modified-Since header.
     statobj = fullpath.stat()
-    if not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), statobj.st_mtime):
-        return HttpResponseNotModified()
+    size = statobj.st_size
+    etag = f'"{size:x}-{statobj.st_mtime_ns:x}"'
+    last_modified = int(statobj.st_mtime)
+
+    # Respect the If-None-Match, If-Modified-Since... headers.
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
     content_type, encoding = mimetypes.guess_type(str(fullpath))
     content_type = content_type or "application/octet-stream"
-    response = FileResponse(fullpath.open("rb"), as_attachment=True, content_type=content_type)
-    response.headers["Last-Modified"] = http_date(statobj.st_mtime)
+    headers = {
+        "Content-Disposition": content_disposition_header(True, fullpath.name),
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Accept-Ranges": "bytes",
+    }
     if encoding:
-        response.headers["Content-Encoding"] = encoding
-    return response
+        headers["Content-Encoding"] = encoding
+
+    sendfile_mode = getattr(settings, "SENDFILE_MODE", "")
+    if sendfile_mode:
+        # the web server sends the file (and handles the byte ranges)
+        if sendfile_mode == "x-sendfile":
+            return HttpResponse(content_type=content_type, headers={**headers, "X-Sendfile": str(fullpath)})
+        try:
+            relative_path = fullpath.resolve().relative_to(Path(settings.MEDIA_ROOT).resolve())
+        except ValueError:
+            pass
+        else:
+            url = getattr(settings, "SENDFILE_URL", "/internal-media/") + quote(relative_path.as_posix())
+            return HttpResponse(content_type=content_type, headers={**headers, "X-Accel-Redirect": url})
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or if_range in (etag, headers["Last-Modified"])):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(fullpath, start, end - start + 1), status=206, content_type=content_type, headers=headers
+            )
+            response["Content-Length"] = end - start + 1
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return response
+
+    return FileResponse(fullpath.open("rb"), as_attachment=True, content_type=content_type, headers=headers)
 
 
 def serve_document(request, pk):
@@ -0,0 +1,94 @@
+"""
+Caches of the current school year (see `Year.get_current`).
+
+The current year is looked up in:
+* a memo that lives for the duration of the request;
+* a process-local cache that expires after a few seconds;
+* the shared cache (only the primary key and the start year are stored).
+
+All of them are cleared when a year is saved or deleted.
+"""
+
+import time
+from typing import TYPE_CHECKING
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+if TYPE_CHECKING:
+    from .models import Year
+
+# the old key contained a pickled `Year`
+CACHE_KEY = "current_school_year"
+PROCESS_TIMEOUT = getattr(settings, "CURRENT_YEAR_PROCESS_TIMEOUT", 10)
+SHARED_TIMEOUT = getattr(settings, "CURRENT_YEAR_SHARED_TIMEOUT", 60 * 60)
+
+_request_memo = Local()
+_process_cache: dict[str, "tuple[Year, float] | None"] = {"year": None}
+
+
+def get_cached(model: "type[Year]") -> "Year | None":
+    """
+    Return the cached current year (or `None`).
+    """
+    year = getattr(_request_memo, "year", None)
+    if year is not None:
+        return year
+
+    cached = _process_cache["year"]
+    if cached is not None and cached[1] > time.monotonic():
+        year = cached[0]
+    else:
+        data = cache.get(CACHE_KEY)
+        if data is None:
+            return None
+        pk, start_year = data
+        year = model(pk=pk, start_year=start_year, is_active=True)
+        _process_cache["year"] = (year, time.monotonic() + PROCESS_TIMEOUT)
+
+    if getattr(_request_memo, "active", False):
+        _request_memo.year = year
+    return year
+
+
+def set_cached(year: "Year"):
+    """
+    Store the current year in all the caches.
+    """
+    if getattr(_request_memo, "active", False):
+        _request_memo.year = year
+    _process_cache["year"] = (year, time.monotonic() + PROCESS_TIMEOUT)
+    cache.set(CACHE_KEY, (year.pk, year.start_year), SHARED_TIMEOUT)
+
+
+def start_request_memo(**_kwargs):
+    """
+    Start memoizing the current year (connected to `request_started`).
+    """
+    _request_memo.active = True
+    _request_memo.year = None
+
+
+def end_request_memo(**_kwargs):
+    """
+    Stop memoizing the current year (connected to `request_finished`).
+    """
+    _request_memo.active = False
+    _request_memo.year = None
+
+
+def _clear():
+    _request_memo.year = None
+    _process_cache["year"] = None
+    cache.delete(CACHE_KEY)
+
+
+def invalidate(**_kwargs):
+    """
+    Clear all the caches (connected to the `post_save` and `post_delete` signals of `Year`).
+    """
+    _clear()
+    # another request may cache the previous year before the transaction is committed
+    transaction.on_commit(_clear)
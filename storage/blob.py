@@ -1,8 +1,49 @@
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import datetime as dt
+from hashlib import md5
+import logging
 import os
+import threading
+import time
+from typing import Any
+from urllib.parse import quote
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.storage import Storage
 from django.utils.deconstruct import deconstructible
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Number and total duration (in seconds) of the requests of this process by method,
+# e.g. `stats["GET.count"]` and `stats["GET.time"]`
+stats: Counter[str] = Counter()
+
+# number of blobs whose information is kept in the memory of each process
+BLOB_CACHE_SIZE = getattr(settings, "BLOB_CACHE_SIZE", 1000)
+# how long the information of the blobs is kept in the memory of each process
+# (the changes made by the other processes are seen after this delay)
+BLOB_MEMORY_CACHE_TIMEOUT = getattr(settings, "BLOB_MEMORY_CACHE_TIMEOUT", 10)
+# how long the information of the blobs is kept in the Django cache
+BLOB_CACHE_TIMEOUT = getattr(settings, "BLOB_CACHE_TIMEOUT", 60 * 60 * 24)
+# how long the missing blobs are remembered in the Django cache (they are never kept in memory)
+BLOB_MISSING_CACHE_TIMEOUT = getattr(settings, "BLOB_MISSING_CACHE_TIMEOUT", 60)
+
+# expiration time (`time.monotonic()`) and information of the existing blobs by cache key
+_blobs: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+_blobs_lock = threading.Lock()
+
+
+def clear_blob_cache():
+    """
+    Clear the information of the blobs kept in the memory of this process.
+    """
+    with _blobs_lock:
+        _blobs.clear()
 
 
 @deconstructible
@@ -11,11 +52,29 @@ class BlobFileStorage(Storage):
     # Most of the code was reverse engineered from
     # https://github.com/vercel/storage/tree/main/packages/blob/src/
 
-    def __init__(self, folder="", token=None):
+    def __init__(
+        self,
+        folder="",
+        token=None,
+        api_url="https://blob.vercel-storage.com/",
+        timeout=(5, 60),
+        retries=3,
+        backoff_factor=0.5,
+        multipart_threshold=32 * 1024 * 1024,
+        part_size=8 * 1024 * 1024,
+        max_workers=4,
+    ):
         """
         folder: base folder that will hold the contents of the storage
                 (useful if you use multiple storages on the same Blob).
         token: `BLOB_READ_WRITE_TOKEN` given by Vercel. Required.
+        api_url: URL of the Vercel Blob API.
+        timeout: timeout of the requests in seconds (or a (connect, read) tuple).
+        retries: number of retries of the idempotent requests on connection errors and 5xx errors.
+        backoff_factor: the retries wait 0, 2 * backoff_factor, 4 * backoff_factor... seconds.
+        multipart_threshold: size in bytes above which the files are uploaded in parts.
+        part_size: size in bytes of the parts (at least 5 MiB except for the last part).
+        max_workers: number of parts uploaded at the same time.
         """
         self.folder = folder.rstrip("/")
         if self.folder:
@@ -24,38 +83,168 @@ class BlobFileStorage(Storage):
         self._token = token or os.environ.get("BLOB_READ_WRITE_TOKEN")
         if not self._token:
             raise ValueError("A token is required to use BlobFileStorage")
+        self.api_url = api_url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self._session = None
+        self._session_pid = None
+        # the cache keys depend on the store (given by the token)
+        self._cache_prefix = "blob:" + md5(self._token.encode(), usedforsecurity=False).hexdigest()[:16]
 
-    def _request(self, method, url, *, data=None, json=None, headers=None):
+    @property
+    def session(self) -> requests.Session:
+        """
+        Return the session of this process (the connections can't be shared with the forked processes).
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=[500, 502, 503, 504],
+                # only the idempotent methods (not POST)
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+            )
+            session.mount(self.api_url, HTTPAdapter(max_retries=retry))
+            session.headers.update({"Authorization": f"Bearer {self._token}", "X-API-Version": "7"})
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def _request(self, method, url, *, params=None, data=None, json=None, headers=None):
         """Make a request to the Vercel Blob API."""
-        headers = {
-            "Authorization": f"Bearer {self._token}",
-            "X-API-Version": "7",
-            **(headers or {}),
-        }
-        params = None
         # pass data as query string parameters if the method is GET
         if method == "GET":
             params = data
             data = None
-        resp = requests.request(
-            method,
-            f"https://blob.vercel-storage.com/{url}",
-            params=params,
-            data=data,
-            json=json,
-            headers=headers,
-        )
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(
+                method,
+                self.api_url + url,
+                params=params,
+                data=data,
+                json=json,
+                headers=headers,
+                timeout=self.timeout,
+            )
+        finally:
+            duration = time.perf_counter() - start
+            stats[f"{method}.count"] += 1
+            stats[f"{method}.time"] += duration
+            logger.debug("%s %s took %.3f s", method, url, duration)
         try:
             resp.raise_for_status()
         except requests.HTTPError as err:
             # if there is an error, raise a second error with the content of the response
             # (which is more useful than the error code)
-            raise requests.HTTPError(resp.text) from err
+            raise requests.HTTPError(resp.text, response=resp) from err
         return resp.json()
 
+    def _cache_key(self, pathname: str):
+        return f"{self._cache_prefix}:{md5(pathname.encode(), usedforsecurity=False).hexdigest()}"
+
+    def _get_cached(self, pathnames: Iterable[str]) -> dict[str, dict[str, Any] | bool]:
+        """
+        Return the cached information of the given blobs (`False` if the blob doesn't exist).
+        The unknown blobs are missing from the returned dict.
+        """
+        keys = {self._cache_key(pathname): pathname for pathname in pathnames}
+        ret: dict[str, dict[str, Any] | bool] = {}
+        now = time.monotonic()
+        with _blobs_lock:
+            for key, pathname in keys.items():
+                if key in _blobs:
+                    expires, info = _blobs[key]
+                    if expires <= now:
+                        del _blobs[key]
+                        continue
+                    _blobs.move_to_end(key)
+                    ret[pathname] = info
+        missing = [key for key, pathname in keys.items() if pathname not in ret]
+        if missing:
+            found = cache.get_many(missing)
+            self._remember(found)
+            ret.update({keys[key]: info for key, info in found.items()})
+        return ret
+
+    def _remember(self, blobs: dict[str, dict[str, Any] | bool]):
+        """
+        Save the information of the existing blobs (by cache key) in the memory of this process
+        and forget the missing ones.
+        """
+        expires = time.monotonic() + BLOB_MEMORY_CACHE_TIMEOUT
+        with _blobs_lock:
+            for key, info in blobs.items():
+                if info:
+                    _blobs[key] = (expires, info)  # type: ignore
+                    _blobs.move_to_end(key)
+                else:
+                    _blobs.pop(key, None)
+            while len(_blobs) > BLOB_CACHE_SIZE:
+                _blobs.popitem(last=False)
+
+    def _set_cached(self, blobs: dict[str, dict[str, Any] | bool]):
+        """
+        Cache the information of the given blobs (by pathname, `False` if the blob doesn't exist).
+        """
+        for info in blobs.values():
+            if info:
+                self._learn_prefix(info)  # type: ignore
+        blobs = {self._cache_key(pathname): info for pathname, info in blobs.items()}
+        self._remember(blobs)
+        cache.set_many({key: info for key, info in blobs.items() if info}, BLOB_CACHE_TIMEOUT)
+        cache.set_many({key: info for key, info in blobs.items() if not info}, BLOB_MISSING_CACHE_TIMEOUT)
+
+    def _learn_prefix(self, info: dict[str, Any]):
+        """
+        Save the root URL of the store (the URL of a blob without its pathname).
+        """
+        if self._prefix is None and info["url"].endswith(info["pathname"]):
+            self._prefix = info["url"].removesuffix(info["pathname"])
+            cache.set(f"{self._cache_prefix}:prefix", self._prefix, None)
+
+    def _get_prefix(self) -> str | None:
+        if self._prefix is None:
+            self._prefix = cache.get(f"{self._cache_prefix}:prefix")
+        return self._prefix
+
+    def _list(self, prefix: str, **params):
+        """Return the blobs whose pathname starts with the given prefix (following the pagination)."""
+        data = {"prefix": prefix, **params}
+        while True:
+            resp = self._request("GET", "", data=data)
+            yield from resp["blobs"]
+            if not resp.get("hasMore"):
+                break
+            data["cursor"] = resp["cursor"]
+
+    def prefetch(self, names: Iterable[str]):
+        """
+        Fetch the information of the given files with one request by folder,
+        so `url`, `exists`, `size`... don't make any request for them.
+        """
+        pathnames = {self.folder + name for name in names}
+        pathnames -= self._get_cached(pathnames).keys()
+
+        folders: dict[str, set[str]] = {}
+        for pathname in pathnames:
+            folder, sep, _filename = pathname.rpartition("/")
+            folders.setdefault(folder + sep, set()).add(pathname)
+
+        for folder, wanted in folders.items():
+            blobs = {blob["pathname"]: blob for blob in self._list(folder, mode="folded") if blob["pathname"] in wanted}
+            self._set_cached({pathname: blobs.get(pathname, False) for pathname in wanted})
+
     def delete(self, name):
         """Delete a file."""
         self._request("POST", "delete", json={"urls": [self.folder + name]})
+        self._set_cached({self.folder + name: False})
 
     def exists(self, name):
         """Check if a file exists."""
@@ -67,23 +256,25 @@ class BlobFileStorage(Storage):
 
     def listdir(self, path):
         data = self._request("GET", "", data={"prefix": self.folder + path.rstrip("/") + "/", "mode": "folded"})
+        self._set_cached({blob["pathname"]: blob for blob in data["blobs"]})
         return data["folders"], [file["pathname"] for file in data["blobs"]]
 
     def size(self, name):
-        data = self._request("GET", "", data={"url": self.url(name)})
-        return data["size"]
+        return self.get_info(name)["size"]
 
     def get_info(self, name):
         """Return information about a blob as provided by the Vercel API."""
-        name = name or ""
+        pathname = self.folder + (name or "")
 
-        data = self._request("GET", "", data={"prefix": self.folder + name})
-        if not data["blobs"]:
+        info = self._get_cached([pathname]).get(pathname)
+        if info is None:
+            data = self._request("GET", "", data={"prefix": pathname})
+            blobs: dict[str, Any] = {blob["pathname"]: blob for blob in data["blobs"]}
+            info = blobs[pathname] = blobs.get(pathname, False)
+            self._set_cached(blobs)
+        if not info:
             raise FileNotFoundError(f"The file {name} doesn't exist")
-
-        # save the prefix for later use
-        self._prefix = data["blobs"][0]["url"].removesuffix(name).rstrip("/").removesuffix(self.folder).rstrip("/")
-        return data["blobs"][0]
+        return info
 
     def url(self, name):
         """
@@ -91,24 +282,83 @@ class BlobFileStorage(Storage):
 
         This function will raise `FileNotFoundError` during the first run if the file doesn't exist.
         """
-        if self._prefix:
-            return f"{self._prefix}{self.folder}/{name}"
+        prefix = self._get_prefix()
+        if prefix:
+            return f"{prefix}{self.folder}{name}"
 
         return self.get_info(name)["url"]
 
+    def _upload_part(self, params, headers, number, data):
+        """
+        Upload a part of a multipart upload (retried on connection errors and 5xx errors).
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self._request(
+                    "POST",
+                    "mpu",
+                    params=params,
+                    data=data,
+                    headers={**headers, "X-Mpu-Action": "upload", "X-Mpu-Part-Number": str(number)},
+                )
+                return {"partNumber": number, "etag": resp["etag"]}
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as err:
+                if attempt == self.retries or (err.response is not None and err.response.status_code < 500):
+                    raise
+                logger.warning("Retrying the part %d of %s: %s", number, params["pathname"], err)
+                time.sleep(self.backoff_factor * 2**attempt)
+
+    def _multipart_upload(self, pathname, content, headers):
+        """
+        Upload a file in parts of `part_size` bytes, `max_workers` parts at a time.
+        Only the parts being uploaded are kept in memory.
+        """
+        params = {"pathname": pathname}
+        upload = self._request("POST", "mpu", params=params, headers={**headers, "X-Mpu-Action": "create"})
+        headers = {"X-Mpu-Key": quote(upload["key"], safe="-_.!~*'()"), "X-Mpu-Upload-Id": upload["uploadId"]}
+
+        parts = []
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            pending = set()
+            for number, data in enumerate(iter(lambda: content.read(self.part_size), b""), 1):
+                if len(pending) >= self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.extend(future.result() for future in done)
+                pending.add(executor.submit(self._upload_part, params, headers, number, data))
+            parts.extend(future.result() for future in pending)
+
+        parts.sort(key=lambda part: part["partNumber"])
+        return self._request(
+            "POST", "mpu", params=params, json=parts, headers={**headers, "X-Mpu-Action": "complete"}
+        )
+
     def save(self, name, content, max_length=None):
-        """Save a file to the Vercel Blob."""
+        """
+        Save a file to the Vercel Blob.
+
+        The file is streamed (it isn't read in memory) or uploaded in parts if it's bigger than `multipart_threshold`.
+        """
         content.seek(0, os.SEEK_END)
         length = content.tell()
         content.seek(0)
         name = self.get_available_name(name, max_length)  # type: ignore
-        self._request(
-            "PUT",
-            self.folder + name,
-            data=content.read(),
-            headers={
-                "X-Add-Random-Suffix": "false",
-                "X-Content-Length": str(length),
+        headers = {"X-Add-Random-Suffix": "false"}
+        if length > self.multipart_threshold:
+            info = self._multipart_upload(self.folder + name, content, headers)
+        else:
+            info = self._request(
+                "PUT",
+                self.folder + name,
+                data=content,
+                headers={**headers, "X-Content-Length": str(length)},
+            )
+        self._set_cached(
+            {
+                self.folder + name: {
+                    "size": length,
+                    "uploadedAt": dt.datetime.now(dt.UTC).isoformat(),
+                    **info,
+                },
             }
         )
         return name
@@ -125,6 +375,6 @@ class BlobFileStorage(Storage):
     @property
     def base_location(self):
         """Return the root URL where the files are stored."""
-        return self._prefix or ""
+        return self._get_prefix() or ""
 
     location = base_location
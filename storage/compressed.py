@@ -0,0 +1,70 @@
+import gzip
+import os.path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from django.core.files.base import ContentFile
+
+# extensions of the files that are worth compressing
+COMPRESSIBLE_EXTENSIONS = {
+    ".css",
+    ".csv",
+    ".html",
+    ".ico",
+    ".js",
+    ".json",
+    ".map",
+    ".mjs",
+    ".svg",
+    ".txt",
+    ".xml",
+}
+# the smaller files are sent as is
+MIN_COMPRESS_SIZE = 256
+
+
+def compress(content: bytes) -> dict[str, bytes]:
+    """
+    Return the compressed versions of the content by extension (`.gz` and `.br` if `brotli` is installed).
+    The versions that aren't smaller than the content are skipped.
+    """
+    ret = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        ret[".br"] = brotli.compress(content)
+    return {ext: compressed for ext, compressed in ret.items() if len(compressed) < len(content)}
+
+
+class CompressedStaticFilesMixin:
+    """
+    A mixin for static files storages that writes gzip and Brotli versions of the collected files
+    next to them (`file.js.gz` and `file.js.br`), so they are never compressed when they are served.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set()
+        post_process = getattr(super(), "post_process", None)
+        if post_process is None:
+            names.update(paths)
+        else:
+            for name, hashed_name, processed in post_process(paths, dry_run, **options):
+                yield name, hashed_name, processed
+                names.add(name)
+                if hashed_name and not isinstance(processed, Exception):
+                    names.add(hashed_name)
+
+        if dry_run:
+            return
+
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(name) as file:  # type: ignore
+                content = file.read()
+            if len(content) < MIN_COMPRESS_SIZE:
+                continue
+            for ext, compressed in compress(content).items():
+                if self.exists(name + ext):  # type: ignore
+                    self.delete(name + ext)  # type: ignore
+                self._save(name + ext, ContentFile(compressed))  # type: ignore
@@ -1,7 +1,9 @@
 # These are the real storage adapters used by the website.
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
 from django.core.files.storage import FileSystemStorage
 
 from .blob import BlobFileStorage
+from .compressed import CompressedStaticFilesMixin
 from .filename_hash import FilenameHashMixin
 
 
@@ -15,3 +17,10 @@ class CustomBlobStorage(FilenameHashMixin, BlobFileStorage):
     """
     Custom Vercel Blob storage that adds a random hash to every created filename.
     """
+
+
+class CustomStaticFilesStorage(CompressedStaticFilesMixin, ManifestStaticFilesStorage):
+    """
+    Static files storage that adds a hash of the content to the filenames
+    and writes precompressed versions of the files.
+    """
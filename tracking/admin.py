@@ -19,7 +19,7 @@ class VisitAdmin(admin.ModelAdmin):
     date_hierarchy = "start_time"
 
     list_display = ("session_key", "user", "start_time", "session_expired", "pretty_time_on_site", "ip_address")
-    list_filter = ("user", "ip_address")
+    list_filter = ("user", "ip_address", "is_bot")
 
     fields = [
         "session_key",
@@ -27,6 +27,7 @@ class VisitAdmin(admin.ModelAdmin):
         ("ip_address", "ip_address_location"),
         "user_agent",
         "pretty_user_agent",
+        ("browser", "os", "device", "is_bot"),
         ("start_time", "expiry_time", "pretty_time_on_site"),
     ]
 
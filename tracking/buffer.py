@@ -0,0 +1,285 @@
+import atexit
+import dataclasses
+import datetime as dt
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from django.db import connection, transaction
+
+from .models import PageView, TrackedURL, Visit
+from .settings import TRACK_BUFFER_INTERVAL, TRACK_BUFFER_SIZE, TRACK_BUFFER_SPOOL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Hit:
+    """
+    A tracked request that hasn't been written to the database yet.
+    """
+
+    session_key: str
+    new_visit: bool
+    user_id: int | None
+    ip_address: str | None
+    user_agent: str | None
+    expiry_time: dt.datetime
+    time: dt.datetime
+    # `url` is `None` if page views aren't tracked
+    url: str | None = None
+    method: str = ""
+    referer: str = ""
+    query_string: str = ""
+
+    def to_json(self) -> str:
+        data = dataclasses.asdict(self)
+        data["expiry_time"] = self.expiry_time.isoformat()
+        data["time"] = self.time.isoformat()
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, line: str) -> "Hit":
+        data = json.loads(line)
+        data["expiry_time"] = dt.datetime.fromisoformat(data["expiry_time"])
+        data["time"] = dt.datetime.fromisoformat(data["time"])
+        return cls(**data)
+
+
+def write_hits(hits: list[Hit]):
+    """
+    Write the given hits to the database with a few bulk queries.
+    """
+    if not hits:
+        return
+
+    visits: dict[str, Visit] = {}
+    # visits are ordered by descending start time => keep the most recent one
+    for visit in Visit.objects.filter(session_key__in={hit.session_key for hit in hits if not hit.new_visit}):
+        visits.setdefault(visit.session_key, visit)
+
+    new_visits: list[Visit] = []
+    updated_visits: dict[int, Visit] = {}
+    pageviews: list[tuple[Visit, Hit]] = []
+
+    for hit in hits:
+        visit = None if hit.new_visit else visits.get(hit.session_key)
+        if visit is None:
+            visit = Visit(session_key=hit.session_key, ip_address=hit.ip_address, start_time=hit.time)
+            visits[hit.session_key] = visit
+            new_visits.append(visit)
+        elif visit.pk:
+            updated_visits[visit.pk] = visit
+
+        # same logic as `VisitorTrackingMiddleware._refresh_visit`
+        if hit.user_id and not visit.user_id:  # type: ignore
+            visit.user_id = hit.user_id  # type: ignore
+        visit.expiry_time = hit.expiry_time
+        if hit.user_agent:
+            visit.set_user_agent(hit.user_agent)
+        visit.time_on_site = int((hit.time - visit.start_time).total_seconds())
+
+        if hit.url is not None:
+            pageviews.append((visit, hit))
+
+    url_ids = TrackedURL.objects.get_ids(
+        value
+        for _visit, hit in pageviews
+        for value in (hit.url, hit.referer, hit.query_string)  # type: ignore
+    )
+
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Visit.objects.bulk_create(new_visits)
+        else:
+            # we need the primary keys for the page views
+            for visit in new_visits:
+                visit.save()
+        Visit.objects.bulk_update(
+            updated_visits.values(),
+            ["user", "expiry_time", "user_agent", "browser", "os", "device", "is_bot", "time_on_site"],
+        )
+        PageView.objects.bulk_create(
+            PageView(
+                visit=visit,
+                url_id=url_ids[hit.url],  # type: ignore
+                view_time=hit.time,
+                method=hit.method,
+                referer_id=url_ids.get(hit.referer),
+                query_string_id=url_ids.get(hit.query_string),
+            )
+            for visit, hit in pageviews
+        )
+
+
+def append_to_spool(spool: Path, data: str):
+    """
+    Append data to the spool file while holding a lock on it,
+    so `read_spool` never moves the file in the middle of a write.
+    """
+    while True:
+        with spool.open("a", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    moved = os.fstat(f.fileno()).st_ino != os.stat(spool).st_ino
+                except FileNotFoundError:
+                    moved = True
+                if moved:
+                    # `read_spool` has moved the file while we were waiting for the lock
+                    continue
+            f.write(data)
+            return
+
+
+def _save_progress(progress: Path, offset: int):
+    tmp = progress.with_name(progress.name + ".tmp")
+    tmp.write_text(str(offset), encoding="utf-8")
+    os.replace(tmp, progress)
+
+
+def read_spool(spool: Path | str, chunk_size=TRACK_BUFFER_SIZE):
+    """
+    Write the hits stored in the spool file to the database, `chunk_size` hits at a time.
+    Return the number of written hits.
+
+    The position after the last written chunk is saved, so an interrupted run
+    doesn't write the same hits again.
+    """
+    spool = Path(spool)
+    processing = spool.with_name(spool.name + ".processing")
+    progress = spool.with_name(spool.name + ".progress")
+
+    # a previous run may have been interrupted, so we finish it first
+    if not processing.exists():
+        # the progress of the previous file (if it has been deleted before the progress file)
+        progress.unlink(missing_ok=True)
+        try:
+            with spool.open("rb") as f:
+                # wait for the workers that are writing to the file
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                # the workers will create a new spool file on their next flush
+                os.replace(spool, processing)
+        except FileNotFoundError:
+            return 0
+
+    try:
+        offset = int(progress.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        offset = 0
+
+    count = 0
+    chunk: list[Hit] = []
+    with processing.open("rb") as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if not line.strip():
+                continue
+            chunk.append(Hit.from_json(line.decode("utf-8")))
+            if len(chunk) >= chunk_size:
+                write_hits(chunk)
+                count += len(chunk)
+                chunk = []
+                _save_progress(progress, offset)
+    write_hits(chunk)
+    count += len(chunk)
+
+    processing.unlink()
+    progress.unlink(missing_ok=True)
+    return count
+
+
+class HitBuffer:
+    """
+    In-process queue of hits.
+
+    A background thread writes them every `size` hits or `interval`,
+    either to the database or to the `spool` file if it is set.
+    The remaining hits are written when the process exits.
+    """
+
+    def __init__(self, size=TRACK_BUFFER_SIZE, interval=TRACK_BUFFER_INTERVAL, spool=TRACK_BUFFER_SPOOL):
+        self.size = size
+        self.interval = interval
+        self.spool = Path(spool) if spool else None
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # the hits and the thread of the parent process don't belong to the workers
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._hits: list[Hit] = []
+        self._thread: threading.Thread | None = None
+
+    def __len__(self):
+        return len(self._hits)
+
+    def add(self, hit: Hit):
+        """
+        Add a hit to the buffer and start the flusher thread if needed.
+        """
+        with self._lock:
+            self._hits.append(hit)
+            full = len(self._hits) >= self.size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tracking-flusher", daemon=True)
+                self._thread.start()
+
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval.total_seconds())
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=W0718
+                logger.exception("Could not write the tracking hits")
+            finally:
+                # don't keep an idle connection open in this thread
+                connection.close()
+
+    def flush(self):
+        """
+        Write all the buffered hits.
+        """
+        with self._lock:
+            hits, self._hits = self._hits, []
+
+        if not hits:
+            return
+
+        if self.spool:
+            append_to_spool(self.spool, "".join(hit.to_json() + "\n" for hit in hits))
+        else:
+            write_hits(hits)
+
+
+_hit_buffer: HitBuffer | None = None
+_hit_buffer_lock = threading.Lock()
+
+
+def get_hit_buffer() -> HitBuffer:
+    """
+    Return the hit buffer of this process.
+
+    It is created on the first buffered hit, so the exit and fork hooks
+    are only registered if `TRACK_BUFFER` is enabled.
+    """
+    global _hit_buffer  # pylint: disable=W0603
+    with _hit_buffer_lock:
+        if _hit_buffer is None:
+            _hit_buffer = HitBuffer()
+        return _hit_buffer
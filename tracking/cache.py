@@ -1,40 +1,162 @@
 # Inspired by:
 # https://web.archive.org/web/20130320190455/https://eflorenzano.com/blog/2008/11/28/drop-dead-simple-django-caching/
-from typing import Generic, TypeVar
+import hashlib
+from collections import Counter
+from collections.abc import Iterable
+from functools import cache as memoize
+from typing import Any, Generic, TypeVar
 
 from django.core.cache import cache
-from django.db import models
+from django.db import models, transaction
 from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save
 
+from .settings import TRACK_INSTANCE_CACHE_TIMEOUT
 
-def instance_cache_key(instance):
-    opts = instance._meta
-    if hasattr(opts, "model_name"):
-        name = opts.model_name
-    else:
-        name = opts.module_name
-    return "%s.%s:%s" % (opts.app_label, name, instance.pk)
+# Hits and misses of the instance cache in this process, e.g. `stats["tracking.visit.hits"]`
+stats: Counter[str] = Counter()
+
+
+@memoize
+def model_cache_version(model: type[models.Model]):
+    """
+    Return a version that changes when the fields of the model change,
+    so the instances pickled by a previous version of the code are never used.
+    """
+    fields = ",".join(f"{field.attname}:{field.get_internal_type()}" for field in model._meta.concrete_fields)
+    return hashlib.md5(fields.encode("utf-8")).hexdigest()[:8]
+
+
+def instance_cache_key(instance: models.Model | type[models.Model], pk: Any = None):
+    model = instance if isinstance(instance, type) else type(instance)
+    if pk is None:
+        pk = instance.pk
+    return f"{model._meta.label_lower}:{model_cache_version(model)}:{pk}"
+
+
+def cache_instances(model: type[models.Model], instances: Iterable[models.Model]):
+    cache.set_many(
+        {instance_cache_key(model, instance.pk): instance for instance in instances}, TRACK_INSTANCE_CACHE_TIMEOUT
+    )
+
+
+def invalidate(model: type[models.Model], pks: Iterable[Any]):
+    cache.delete_many([instance_cache_key(model, pk) for pk in pks])
+
+
+def invalidate_on_commit(model: type[models.Model], pks: Iterable[Any]):
+    """
+    Evict the instances now and when the transaction is committed
+    (another request may cache the previous rows before the transaction is committed).
+    """
+    keys = [instance_cache_key(model, pk) for pk in pks]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def post_save_cache(sender, instance, raw=False, **_kwargs):
+    invalidate(sender, [instance.pk])
+    if not raw:
+        # don't cache the changes of a transaction that may be rolled back
+        transaction.on_commit(lambda: cache_instances(sender, [instance]))
+
+
+def post_delete_cache(sender, instance, **_kwargs):
+    invalidate(sender, [instance.pk])
 
 
 _T = TypeVar("_T", bound=models.Model)
 
 
 class CacheQuerySet(QuerySet, Generic[_T]):
-    def filter(self, *args, **kwargs):
-        pk = None
-        for val in ("pk", "pk__exact", "id", "id__exact"):
-            if val in kwargs:
-                pk = kwargs[val]
-                break
-        if pk is not None:
-            opts = self.model._meta
-            key = "%s.%s:%s" % (opts.app_label, opts.model_name, pk)
-            obj = cache.get(key)
-            if obj is not None:
-                self._result_cache = [obj]
-        return super(CacheQuerySet, self).filter(*args, **kwargs)
+    """
+    Queryset that keeps the cache up to date when rows are changed without sending signals.
+
+    `update` needs an extra query to know the changed rows.
+    """
+
+    def update(self, **kwargs):
+        invalidate_on_commit(self.model, list(self.values_list("pk", flat=True)))
+        return super().update(**kwargs)
+
+    update.alters_data = True  # type: ignore
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        invalidate_on_commit(self.model, [obj.pk for obj in objs])
+        return super().bulk_update(objs, fields, batch_size)
+
+    bulk_update.alters_data = True  # type: ignore
 
 
 class CacheManager(models.Manager, Generic[_T]):
+    """
+    Manager with a read-through cache of the instances by primary key.
+
+    The instances are cached when they are saved and evicted when they are deleted.
+    The lookups bypass `get_queryset`, so don't use them on managers that filter the rows.
+
+    With the default `LocMemCache`, the cache is local to each process: the changes made in another process
+    (e.g. to a `Group`, a `Visit` or a `Year`) are seen after `TRACK_INSTANCE_CACHE_TIMEOUT` at most.
+    """
+
     def get_queryset(self):
-        return CacheQuerySet(self.model)
+        return CacheQuerySet(self.model, using=self._db)
+
+    def contribute_to_class(self, cls, name):
+        super().contribute_to_class(cls, name)
+        if not cls._meta.abstract:
+            post_save.connect(post_save_cache, sender=cls, dispatch_uid=f"{cls._meta.label_lower}_post_save_cache")
+            post_delete.connect(
+                post_delete_cache, sender=cls, dispatch_uid=f"{cls._meta.label_lower}_post_delete_cache"
+            )
+
+    def get_many(self, pks: Iterable[Any]) -> dict[Any, _T]:
+        """
+        Return the instances with the given primary keys (the missing ones are skipped).
+        """
+        pks = {pk for pk in pks if pk is not None}
+        keys = {instance_cache_key(self.model, pk): pk for pk in pks}
+        ret = {keys[key]: instance for key, instance in cache.get_many(keys.keys()).items()}
+
+        label = self.model._meta.label_lower
+        stats[f"{label}.hits"] += len(ret)
+        if len(ret) < len(pks):
+            stats[f"{label}.misses"] += len(pks) - len(ret)
+            missing = list(self.get_queryset().filter(pk__in=pks - ret.keys()))
+            cache_instances(self.model, missing)
+            ret.update((instance.pk, instance) for instance in missing)
+
+        return ret
+
+    def get_by_pk(self, pk: Any) -> _T:
+        """
+        Return the instance with the given primary key or raise `DoesNotExist`.
+        """
+        try:
+            return self.get_many([pk])[pk]
+        except KeyError:
+            raise self.model.DoesNotExist(  # type: ignore
+                f"{self.model._meta.object_name} matching query does not exist."
+            ) from None
+
+
+def fill_related(instances: Iterable[models.Model], field: str):
+    """
+    Set the related objects of a foreign key on the instances from the cache
+    (like `prefetch_related`, but without a query if all the objects are in the cache).
+
+    The related model must use a `CacheManager`.
+    """
+    instances = list(instances)
+    if not instances:
+        return
+    model_field = instances[0]._meta.get_field(field)
+    related = model_field.related_model._default_manager.get_many(  # type: ignore
+        getattr(instance, model_field.attname) for instance in instances
+    )
+    for instance in instances:
+        pk = getattr(instance, model_field.attname)
+        if pk in related:
+            model_field.set_cached_value(instance, related[pk])  # type: ignore
@@ -0,0 +1,160 @@
+"""
+Geolocation of the IP addresses of the visits.
+
+The locations are fetched in bulk by the `locate_ips` command and cached in the `IPLocation` table,
+so the admin never waits on the resolver.
+
+A resolver has a `batch_size` and a `resolve` method that takes a list of IP addresses and returns
+a dictionary of `IPLocation` field values for each located IP address
+(or `{"error": ...}` if the IP address can't be located).
+The IP addresses that are missing from the result (e.g. because of a network error) are tried again later.
+"""
+
+import logging
+import time
+from collections.abc import Iterable
+from typing import Any
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+try:
+    import geoip2.database
+    import geoip2.errors
+except ImportError:
+    geoip2 = None
+
+from .models import IPLocation
+from .settings import TRACK_GEOLOCATION_RESOLVER, TRACK_GEOLOCATION_RESOLVER_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+Results = dict[str, dict[str, Any]]
+
+LOCATION_FIELDS = ["city", "region", "country", "mobile", "proxy", "hosting", "error", "update_time"]
+
+
+class IPAPIResolver:
+    """
+    Resolver that uses the batch endpoint of ip-api.com.
+    """
+
+    batch_size = 100
+
+    def __init__(self, url="http://ip-api.com/batch", lang="fr", timeout=10):
+        self.url = url
+        self.lang = lang
+        self.timeout = timeout
+
+    def resolve(self, ips: list[str]) -> Results:
+        try:
+            response = requests.post(
+                self.url,
+                params={
+                    "fields": "status,message,query,city,regionName,country,mobile,proxy,hosting",
+                    "lang": self.lang,
+                },
+                json=ips,
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data: list[dict[str, Any]] = response.json()
+        except (requests.RequestException, ValueError):
+            logger.exception("Could not locate %d IP addresses", len(ips))
+            return {}
+
+        # the free endpoint is rate limited, wait until the next request is allowed
+        if response.headers.get("X-Rl") == "0":
+            time.sleep(int(response.headers.get("X-Ttl", 60)))
+
+        ret: Results = {}
+        for item in data:
+            if item.get("status") == "fail":
+                ret[item["query"]] = {"error": item.get("message") or "fail"}
+            else:
+                ret[item["query"]] = {
+                    "city": item.get("city", ""),
+                    "region": item.get("regionName", ""),
+                    "country": item.get("country", ""),
+                    "mobile": item.get("mobile", False),
+                    "proxy": item.get("proxy", False),
+                    "hosting": item.get("hosting", False),
+                }
+        return ret
+
+
+class GeoIP2Resolver:
+    """
+    Resolver that uses a local GeoIP2 / GeoLite2 City database file (needs the `geoip2` package).
+    """
+
+    batch_size = 1000
+
+    def __init__(self, path, lang="fr"):
+        if geoip2 is None:
+            raise ImproperlyConfigured("The geoip2 package is needed to use GeoIP2Resolver.")
+        self.reader = geoip2.database.Reader(path, locales=[lang, "en"])
+
+    def resolve(self, ips: list[str]) -> Results:
+        ret: Results = {}
+        for ip in ips:
+            try:
+                city = self.reader.city(ip)
+            except (geoip2.errors.AddressNotFoundError, ValueError) as err:  # type: ignore
+                ret[ip] = {"error": str(err)}
+                continue
+            ret[ip] = {
+                "city": city.city.name or "",
+                "region": city.subdivisions.most_specific.name or "",
+                "country": city.country.name or "",
+            }
+        return ret
+
+
+def get_resolver():
+    """
+    Return the resolver set in the `TRACK_GEOLOCATION_RESOLVER` setting.
+    """
+    return import_string(TRACK_GEOLOCATION_RESOLVER)(**TRACK_GEOLOCATION_RESOLVER_OPTIONS)
+
+
+def locate(ips: Iterable[str], resolver=None, force=False):
+    """
+    Fetch the locations of the IP addresses that aren't in the cache (or that have expired)
+    and store them in the cache. If `force` is set, all the locations are fetched again.
+
+    Return the number of fetched locations.
+    """
+    if resolver is None:
+        resolver = get_resolver()
+
+    ips = sorted(set(ips))
+    count = 0
+    for i in range(0, len(ips), resolver.batch_size):
+        batch = ips[i : i + resolver.batch_size]
+        if not force:
+            fresh = {
+                location.ip_address
+                for location in IPLocation.objects.filter(ip_address__in=batch)
+                if not location.expired()
+            }
+            batch = [ip for ip in batch if ip not in fresh]
+        if not batch:
+            continue
+
+        results = resolver.resolve(batch)
+        now = timezone.now()
+        # MySQL updates the rows on any unique conflict and doesn't accept `unique_fields`
+        unique_fields = ["ip_address"] if connection.features.supports_update_conflicts_with_target else None
+        IPLocation.objects.bulk_create(
+            [IPLocation(ip_address=ip, update_time=now, **data) for ip, data in results.items()],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=LOCATION_FIELDS,
+        )
+        count += len(results)
+
+    return count
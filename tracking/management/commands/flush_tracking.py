@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...buffer import read_spool
+from ...settings import TRACK_BUFFER_SPOOL
+
+
+class Command(BaseCommand):
+    """
+    Write the hits stored in the tracking spool file (`TRACK_BUFFER_SPOOL`) to the database.
+    """
+
+    help = "Write the hits stored in the tracking spool file to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--spool", default=TRACK_BUFFER_SPOOL, help="Path of the spool file")
+
+    def handle(self, spool=None, verbosity=1, **_options):
+        if not spool:
+            raise CommandError("No spool file: set TRACK_BUFFER_SPOOL or use --spool")
+
+        count = read_spool(spool)
+        if verbosity >= 1:
+            self.stdout.write(f"{count} hit(s) written")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ...geolocation import locate
+from ...models import Visit
+
+
+class Command(BaseCommand):
+    """
+    Fetch the locations of the IP addresses of the visits that aren't in the cache yet.
+
+    Run it regularly (e.g. with cron) so the locations are shown in the admin.
+    """
+
+    help = "Fetch the locations of the IP addresses of the visits."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Fetch again the locations that are in the cache")
+
+    def handle(self, force=False, verbosity=1, **_options):
+        ips = Visit.objects.order_by().values_list("ip_address", flat=True).distinct()
+        count = locate(ips.iterator(), force=force)
+        if verbosity >= 1:
+            self.stdout.write(f"Located {count} IP address(es)")
@@ -0,0 +1,31 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...retention import prune
+from ...settings import TRACK_MAX_AGE, TRACK_PRUNE_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Delete the visits and page views older than `TRACK_MAX_AGE`, optionally archiving them.
+    """
+
+    help = "Delete the visits and page views older than TRACK_MAX_AGE."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age", type=int, help="Maximum age of the visits in days (overrides TRACK_MAX_AGE)")
+        parser.add_argument("--chunk-size", type=int, default=TRACK_PRUNE_CHUNK_SIZE, help="Visits deleted at a time")
+        parser.add_argument(
+            "--archive", help="Append the deleted rows to this file (gzipped JSONL, e.g. archive.jsonl.gz)"
+        )
+
+    def handle(self, max_age=None, chunk_size=TRACK_PRUNE_CHUNK_SIZE, archive=None, verbosity=1, **_options):
+        max_age = dt.timedelta(days=max_age) if max_age is not None else TRACK_MAX_AGE
+        if max_age is None:
+            raise CommandError("No maximum age: set TRACK_MAX_AGE or use --max-age")
+
+        count = prune(timezone.now() - max_age, chunk_size, archive)
+        if verbosity >= 1:
+            self.stdout.write(f"{count} visit(s) deleted")
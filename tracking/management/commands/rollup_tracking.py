@@ -0,0 +1,31 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+
+from ...rollups import rollup
+
+
+class Command(BaseCommand):
+    """
+    Compute the daily statistics of the complete days that haven't been rolled up yet.
+
+    Run it once a day (e.g. with cron) to keep the tracking dashboard fast.
+    """
+
+    help = "Compute the daily tracking statistics of the days that haven't been rolled up yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=dt.date.fromisoformat,
+            help="First day to (re)compute (YYYY-MM-DD), by default the day after the last rolled up day",
+        )
+        parser.add_argument("--until", type=dt.date.fromisoformat, help="Last day to (re)compute (YYYY-MM-DD)")
+
+    def handle(self, since=None, until=None, verbosity=1, **_options):
+        days = rollup(since, until)
+        if verbosity >= 1:
+            if days:
+                self.stdout.write(f"Rolled up {len(days)} day(s) from {days[0]} to {days[-1]}")
+            else:
+                self.stdout.write("Nothing to roll up")
@@ -1,17 +1,23 @@
 import datetime as dt
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
 from typing import Any, Generic, TypeVar
 
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import Avg, Count
+from django.db.models import Avg, Count, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast
 from django.utils import timezone
 
-from .settings import TRACK_ANONYMOUS_USERS, TRACK_PAGEVIEWS
+from .cache import CacheManager
+from .settings import TRACK_ANONYMOUS_USERS, TRACK_PAGEVIEWS, TRACK_URL_CACHE_SIZE
 
 _T = TypeVar("_T", bound=models.Model)
 
 
-class VisitorManager(models.Manager, Generic[_T]):
+class VisitorManager(CacheManager[_T]):
     def active(self, registered_only=True):
         """
         Returns all active users, e.g. not logged and non-expired session.
@@ -38,150 +44,154 @@ class VisitorManager(models.Manager, Generic[_T]):
 
         for all users, registered users and guests.
         """
-        visitors = self.filter(start_time__gte=start_date, start_time__lt=end_date)
-
-        stats: dict[str, Any] = {
-            "total": 0,
-            "unique": 0,
-            "return_ratio": 0,
-        }
-
-        # All visitors
-        stats["total"] = total_count = visitors.count()
-        unique_count = 0
-
-        # No visitors! Nothing more to do.
-        if not total_count:
-            return stats
-
-        # Avg time on site
-        total_time_on_site = visitors.aggregate(avg_tos=Avg("time_on_site"))["avg_tos"]
-        stats["time_on_site"] = dt.timedelta(seconds=int(total_time_on_site))
-
-        # Registered user sessions
-        registered_visitors = visitors.filter(user__isnull=False)
-        registered_total_count = registered_visitors.count()
-
-        if registered_total_count:
-            registered_unique_count = registered_visitors.values("user").distinct().count()
-            # Avg time on site
-            time_on_site = registered_visitors.aggregate(avg_tos=Avg("time_on_site"))["avg_tos"]
-
-            # Update the total unique count..
-            unique_count += registered_unique_count
-
-            # Set the registered stats..
-            returns = registered_total_count - registered_unique_count
-            stats["registered"] = {
-                "total": registered_total_count,
-                "unique": registered_unique_count,
-                "return_ratio": (returns / registered_total_count) * 100,
-                "time_on_site": dt.timedelta(seconds=int(time_on_site)),
-            }
-
-        # Get stats for our guests..
-        guests = visitors.none()
-        if TRACK_ANONYMOUS_USERS and not registered_only:
-            guests = visitors.filter(user__isnull=True)
-            guest_total_count = guests.count()
-
-            if guest_total_count:
-                guest_unique_count = guests.values("ip_address").distinct().count()
-                # Avg time on site
-                guest_time_on_site = guests.aggregate(avg_tos=Avg("time_on_site"))["avg_tos"]
-                # return rate
-                returns = guest_total_count - guest_unique_count
-                return_ratio = (returns / guest_total_count) * 100
-                time_on_site = dt.timedelta(seconds=int(guest_time_on_site))
-            else:
-                guest_total_count = 0
-                guest_unique_count = 0
-                return_ratio = 0.0
-                time_on_site = dt.timedelta(0)
-
-            # Update the total unique count
-            unique_count += guest_unique_count
-            stats["guests"] = {
-                "total": guest_total_count,
-                "unique": guest_unique_count,
-                "return_ratio": return_ratio,
-                "time_on_site": time_on_site,
-            }
-
-        # Finish setting the total visitor counts
-        returns = total_count - unique_count
-        stats["unique"] = unique_count
-        stats["return_ratio"] = (returns / total_count) * 100
-
-        # If pageviews are being tracked, add the aggregate pages-per-visit
-        if TRACK_PAGEVIEWS:
-            if "registered" in stats:
-                pages_per_visit = (
-                    registered_visitors.annotate(page_count=Count("pageviews"))
-                    .filter(page_count__gt=0)
-                    .aggregate(pages_per_visit=Avg("page_count"))["pages_per_visit"]
-                )
-                stats["registered"]["pages_per_visit"] = pages_per_visit
-
-            if TRACK_ANONYMOUS_USERS and not registered_only:
-                stats["guests"]["pages_per_visit"] = (
-                    guests.annotate(page_count=Count("pageviews"))
-                    .filter(page_count__gt=0)
-                    .aggregate(pages_per_visit=Avg("page_count"))["pages_per_visit"]
-                )
-
-                total_per_visit = (
-                    visitors.annotate(page_count=Count("pageviews"))
-                    .filter(page_count__gt=0)
-                    .aggregate(pages_per_visit=Avg("page_count"))["pages_per_visit"]
-                )
-            else:
-                if "registered" in stats:
-                    total_per_visit = stats["registered"]["pages_per_visit"]
-                else:
-                    total_per_visit = 0
-
-            stats["pages_per_visit"] = total_per_visit
-
-        return stats
-
-    def user_stats(self, start_date: dt.datetime | None = None, end_date: dt.datetime | None = None):
-        user_kwargs: dict[str, Any] = {
-            "visit_history__start_time__lt": end_date,
-        }
-        visit_kwargs: dict[str, Any] = {
-            "start_time__lt": end_date,
-        }
+        from .rollups import pageview_counts as get_pageview_counts
+        from .rollups import split_range, visit_counts
+
+        # use the daily rollups for the complete days and the raw rows for the rest
+        days, raw_ranges = split_range(start_date, end_date)
+        counts = visit_counts(days, raw_ranges)
+
+        pageview_counts = None
+        if TRACK_PAGEVIEWS and counts["total"]:
+            pageview_counts = get_pageview_counts(days, raw_ranges)
+
+        return visit_stats(counts, pageview_counts, registered_only)
+
+    def _user_filters(self, start_date: dt.datetime | None, end_date: dt.datetime | None):
+        # filters on the users and on the page views of `user_stats`
+        user_kwargs: dict[str, Any] = {}
+        visit_kwargs: dict[str, Any] = {}
+        if end_date:
+            user_kwargs["visit_history__start_time__lt"] = end_date
+            visit_kwargs["visit__start_time__lt"] = end_date
         if start_date:
             user_kwargs["visit_history__start_time__gte"] = start_date
-            visit_kwargs["start_time__gte"] = start_date
+            visit_kwargs["visit__start_time__gte"] = start_date
         else:
             user_kwargs["visit_history__start_time__isnull"] = False
-            visit_kwargs["start_time__isnull"] = False
+        return user_kwargs, visit_kwargs
+
+    def user_count(self, start_date: dt.datetime | None = None, end_date: dt.datetime | None = None) -> int:
+        """
+        Returns the number of users that have visits in the date range (the length of `user_stats`).
+        """
+        user_kwargs, _visit_kwargs = self._user_filters(start_date, end_date)
+        return get_user_model().objects.filter(**user_kwargs).distinct().count()
+
+    def user_stats(
+        self,
+        start_date: dt.datetime | None = None,
+        end_date: dt.datetime | None = None,
+        limit: int | None = None,
+        offset=0,
+    ):
+        """
+        Returns the users that have visits in the date range, annotated with:
+        * `visit_count`
+        * `time_on_site` (average)
+        * `pages_per_visit` (average, only for the visits with page views)
+
+        The users with the highest time on site come first.
+        Use `limit` and `offset` to return only a page of the users (and `user_count` to count them).
+        """
+        user_kwargs, visit_kwargs = self._user_filters(start_date, end_date)
+
+        # Aggregate pageviews per visit for all the users at once
+        pageviews = self.model._meta.get_field("pageviews").related_model.objects  # type: ignore
+        pages_per_visit = (
+            pageviews.filter(visit__user=OuterRef("pk"), **visit_kwargs)
+            .order_by()
+            .values("visit__user")
+            .annotate(
+                pages_per_visit=Cast(Count("pk"), models.FloatField()) / Count("visit", distinct=True),
+            )
+            .values("pages_per_visit")
+        )
 
         username_field = get_user_model().USERNAME_FIELD  # type: ignore
-        users = list(
+        users = (
             get_user_model()
             .objects.filter(**user_kwargs)
-            .annotate(visit_count=Count("visit_history"), time_on_site=Avg("visit_history__time_on_site"))
+            .annotate(
+                visit_count=Count("visit_history"),
+                time_on_site=Avg("visit_history__time_on_site"),
+                pages_per_visit=Subquery(pages_per_visit, output_field=models.FloatField()),
+            )
             .filter(visit_count__gt=0)
             .order_by("-time_on_site", username_field)
         )
+        if limit is not None:
+            users = users[offset : offset + limit]
+        elif offset:
+            users = users[offset:]
 
-        # Aggregate pageviews per visit
+        users = list(users)
         for user in users:
-            user.pages_per_visit = (  # type: ignore
-                user.visit_history.filter(**visit_kwargs)  # type: ignore
-                .annotate(page_count=Count("pageviews"))
-                .filter(page_count__gt=0)
-                .aggregate(pages_per_visit=Avg("page_count"))["pages_per_visit"]
-            )
-
             # Lop off the floating point, turn into dt.timedelta
             user.time_on_site = dt.timedelta(seconds=int(user.time_on_site))  # type: ignore
         return users
 
 
+def url_hash(value: str):
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+# LRU cache of the URL ids of this process
+_url_ids: OrderedDict[str, int] = OrderedDict()
+_url_ids_lock = threading.Lock()
+
+
+def clear_url_cache():
+    """
+    Clear the cache of `TrackedURLManager.get_ids` (e.g. when the rows have been deleted).
+    """
+    with _url_ids_lock:
+        _url_ids.clear()
+
+
+class TrackedURLManager(models.Manager, Generic[_T]):
+    def get_ids(self, values: Iterable[str]) -> dict[str, int]:
+        """
+        Return the ids of the given URLs, creating the missing rows.
+
+        The ids are cached in memory so the rows are only queried once per process.
+        The empty values are skipped (they are stored as `NULL`).
+        """
+        ret: dict[str, int] = {}
+        missing: dict[str, str] = {}
+        with _url_ids_lock:
+            for value in set(values):
+                if not value:
+                    continue
+                pk = _url_ids.get(value)
+                if pk is None:
+                    missing[url_hash(value)] = value
+                else:
+                    _url_ids.move_to_end(value)
+                    ret[value] = pk
+
+        if missing:
+            found = dict(self.filter(hash__in=missing).values_list("hash", "pk"))
+            if len(found) < len(missing):
+                self.bulk_create(
+                    [self.model(hash=digest, value=value) for digest, value in missing.items() if digest not in found],
+                    # another process may have created the same rows
+                    ignore_conflicts=True,
+                )
+                found.update(self.filter(hash__in=missing.keys() - found.keys()).values_list("hash", "pk"))
+
+            with _url_ids_lock:
+                for digest, pk in found.items():
+                    ret[missing[digest]] = _url_ids[missing[digest]] = pk
+                while len(_url_ids) > TRACK_URL_CACHE_SIZE:
+                    _url_ids.popitem(last=False)
+
+        return ret
+
+    def get_by_natural_key(self, value: str):
+        return self.get(pk=self.get_ids([value])[value])
+
+
 class PageviewManager(models.Manager, Generic[_T]):
     def stats(self, start_date: dt.datetime | None = None, end_date: dt.datetime | None = None, registered_only=False):
         """
@@ -190,53 +200,180 @@ class PageviewManager(models.Manager, Generic[_T]):
 
         for all users, registered users and guests.
         """
-        pageviews = self.filter(
-            visitor__start_time__lt=end_date,
-            visitor__start_time__gte=start_date,
-        ).select_related("visitor")
-
-        stats: dict[str, Any] = {
-            "total": 0,
-            "unique": 0,
-        }
+        from .rollups import pageview_counts, split_range
+
+        return pageview_stats(pageview_counts(*split_range(start_date, end_date)), registered_only)
+
+
+# the URL ids are 32-bit integers (see `pageview_aggregates`)
+URL_ID_LIMIT = 2**32
+
+REGISTERED = Q(user__isnull=False)
+GUESTS = Q(user__isnull=True)
+
+
+def visit_aggregates(visitors: models.QuerySet) -> dict[str, Any]:
+    """
+    Return the raw counts needed by `visit_stats` in a single query.
+
+    The times on site are sums, so the counts of several querysets can be added
+    (except the `unique` counts).
+    """
+    return visitors.aggregate(
+        total=Count("pk"),
+        total_time_on_site=Sum("time_on_site", default=0),
+        registered_total=Count("pk", filter=REGISTERED),
+        registered_unique=Count("user", distinct=True),
+        registered_time_on_site=Sum("time_on_site", filter=REGISTERED, default=0),
+        guests_total=Count("pk", filter=GUESTS),
+        guests_unique=Count("ip_address", distinct=True, filter=GUESTS),
+        guests_time_on_site=Sum("time_on_site", filter=GUESTS, default=0),
+    )
+
+
+def pageview_aggregates(pageviews: models.QuerySet) -> dict[str, Any]:
+    """
+    Return the raw counts needed by `pageview_stats` and `visit_stats` in a single query.
+
+    `unique` counts the distinct (visit, URL id) pairs and `visits` counts the visits that have page views.
+    All the counts can be added.
+    """
+    registered = Q(visit__user__isnull=False)
+    guests = Q(visit__user__isnull=True)
+    # a single integer per (visit, URL id) pair instead of a string built for every row
+    visit_url = ExpressionWrapper(F("visit") * URL_ID_LIMIT + F("url"), output_field=models.BigIntegerField())
+    return pageviews.aggregate(
+        total=Count("pk"),
+        unique=Count(visit_url, distinct=True),
+        visits=Count("visit", distinct=True),
+        registered_total=Count("pk", filter=registered),
+        registered_unique=Count(visit_url, distinct=True, filter=registered),
+        registered_visits=Count("visit", distinct=True, filter=registered),
+        guests_total=Count("pk", filter=guests),
+        guests_unique=Count(visit_url, distinct=True, filter=guests),
+        guests_visits=Count("visit", distinct=True, filter=guests),
+    )
+
+
+def _pages_per_visit(total: int, visits: int):
+    # average number of page views of the visits that have page views
+    return total / visits if visits else None
+
+
+def visit_stats(counts: dict[str, Any], pageview_counts: dict[str, Any] | None = None, registered_only=False):
+    """
+    Build the `VisitorManager.stats` dictionary from the results of `visit_aggregates`
+    and `pageview_aggregates`.
+    """
+    stats: dict[str, Any] = {
+        "total": 0,
+        "unique": 0,
+        "return_ratio": 0,
+    }
+
+    # All visitors
+    stats["total"] = total_count = counts["total"]
+    unique_count = 0
+
+    # No visitors! Nothing more to do.
+    if not total_count:
+        return stats
 
-        stats["total"] = total_views = pageviews.count()
-        unique_count = 0
+    stats["time_on_site"] = dt.timedelta(seconds=int(counts["total_time_on_site"] / total_count))
 
-        if not total_views:
-            return stats
+    # Registered user sessions
+    registered_total_count = counts["registered_total"]
+    if registered_total_count:
+        registered_unique_count = counts["registered_unique"]
+        unique_count += registered_unique_count
 
-        # Registered user sessions
-        registered_pageviews = pageviews.filter(visitor__user__isnull=False)
-        registered_count = registered_pageviews.count()
+        returns = registered_total_count - registered_unique_count
+        stats["registered"] = {
+            "total": registered_total_count,
+            "unique": registered_unique_count,
+            "return_ratio": (returns / registered_total_count) * 100,
+            "time_on_site": dt.timedelta(seconds=int(counts["registered_time_on_site"] / registered_total_count)),
+        }
 
-        if registered_count:
-            registered_unique_count = registered_pageviews.values("visitor", "url").distinct().count()
+    # Get stats for our guests..
+    include_guests = TRACK_ANONYMOUS_USERS and not registered_only
+    if include_guests:
+        guest_total_count = counts["guests_total"]
+        guest_unique_count = counts["guests_unique"] if guest_total_count else 0
+        if guest_total_count:
+            returns = guest_total_count - guest_unique_count
+            return_ratio = (returns / guest_total_count) * 100
+            time_on_site = dt.timedelta(seconds=int(counts["guests_time_on_site"] / guest_total_count))
+        else:
+            return_ratio = 0.0
+            time_on_site = dt.timedelta(0)
+
+        unique_count += guest_unique_count
+        stats["guests"] = {
+            "total": guest_total_count,
+            "unique": guest_unique_count,
+            "return_ratio": return_ratio,
+            "time_on_site": time_on_site,
+        }
 
-            # Update the total unique count...
-            unique_count += registered_unique_count
+    # Finish setting the total visitor counts
+    returns = total_count - unique_count
+    stats["unique"] = unique_count
+    stats["return_ratio"] = (returns / total_count) * 100
 
-            stats["registered"] = {
-                "total": registered_count,
-                "unique": registered_unique_count,
-            }
+    # If pageviews are being tracked, add the aggregate pages-per-visit
+    if pageview_counts is not None:
+        if "registered" in stats:
+            stats["registered"]["pages_per_visit"] = _pages_per_visit(
+                pageview_counts["registered_total"], pageview_counts["registered_visits"]
+            )
+
+        if include_guests:
+            stats["guests"]["pages_per_visit"] = _pages_per_visit(
+                pageview_counts["guests_total"], pageview_counts["guests_visits"]
+            )
+            total_per_visit = _pages_per_visit(pageview_counts["total"], pageview_counts["visits"])
+        elif "registered" in stats:
+            total_per_visit = stats["registered"]["pages_per_visit"]
+        else:
+            total_per_visit = 0
 
-        if TRACK_ANONYMOUS_USERS and not registered_only:
-            guest_pageviews = pageviews.filter(visitor__user__isnull=True)
-            guest_count = guest_pageviews.count()
+        stats["pages_per_visit"] = total_per_visit
 
-            if guest_count:
-                guest_unique_count = guest_pageviews.values("visitor", "url").distinct().count()
+    return stats
 
-                # Update the total unique count...
-                unique_count += guest_unique_count
 
-                stats["guests"] = {
-                    "total": guest_count,
-                    "unique": guest_unique_count,
-                }
+def pageview_stats(counts: dict[str, Any], registered_only=False):
+    """
+    Build the `PageviewManager.stats` dictionary from the results of `pageview_aggregates`.
+    """
+    stats: dict[str, Any] = {
+        "total": 0,
+        "unique": 0,
+    }
 
-        # Finish setting the total visitor counts
-        stats["unique"] = unique_count
+    stats["total"] = total_views = counts["total"]
+    unique_count = 0
 
+    if not total_views:
         return stats
+
+    # Registered user sessions
+    if counts["registered_total"]:
+        unique_count += counts["registered_unique"]
+        stats["registered"] = {
+            "total": counts["registered_total"],
+            "unique": counts["registered_unique"],
+        }
+
+    if TRACK_ANONYMOUS_USERS and not registered_only and counts["guests_total"]:
+        unique_count += counts["guests_unique"]
+        stats["guests"] = {
+            "total": counts["guests_total"],
+            "unique": counts["guests_unique"],
+        }
+
+    # Finish setting the total visitor counts
+    stats["unique"] = unique_count
+
+    return stats
@@ -10,23 +10,24 @@ from django.http import HttpRequest, HttpResponse
 from django.utils import timezone
 from django.utils.encoding import smart_str
 
-from .models import PageView, Visit
+from .buffer import Hit, get_hit_buffer
+from .models import PageView, TrackedURL, Visit
 from .settings import (
     MAX_VISIT_TIME,
     TRACK_AJAX_REQUESTS,
     TRACK_ANONYMOUS_USERS,
+    TRACK_BUFFER,
     TRACK_IGNORE_STATUS_CODES,
     TRACK_IGNORE_URLS,
-    TRACK_IGNORE_USER_AGENTS,
     TRACK_PAGEVIEWS,
     TRACK_QUERY_STRING,
     TRACK_REFERER,
     TRACK_SUPERUSERS,
 )
+from .user_agent import is_ignored
 from .utils import get_ip_address
 
 track_ignore_urls = [re.compile(x) for x in TRACK_IGNORE_URLS]
-track_ignore_user_agents = [re.compile(x, re.IGNORECASE) for x in TRACK_IGNORE_USER_AGENTS]
 
 
 class VisitorTrackingMiddleware:
@@ -66,32 +67,43 @@ class VisitorTrackingMiddleware:
             if url.match(path):
                 return False
 
-        # Do not track ignored user agents
-        user_agent = request.META.get("HTTP_USER_AGENT", "")
-        for user_agent_pattern in track_ignore_user_agents:
-            if user_agent_pattern.match(user_agent):
-                return False
+        # Do not track ignored user agents, everything else says we should track this hit
+        return not is_ignored(request.META.get("HTTP_USER_AGENT", ""))
+
+    def _continues_visit(self, request: HttpRequest, visit_time: dt.datetime):
+        """
+        Return `True` if the request is part of the visit of the last request in the session.
+        """
+        last_access_ts = request.session.get("last_access_ts")
+
+        # Save the last access timestamp
+        request.session["last_access_ts"] = visit_time.timestamp()
 
-        # everything says we should track this hit
-        return True
+        if last_access_ts is None:
+            return False
+
+        last_access = dt.datetime.fromtimestamp(last_access_ts, tz=dt.timezone.utc if settings.USE_TZ else None)
+        return (visit_time - last_access) <= MAX_VISIT_TIME
+
+    def _get_user_agent(self, request: HttpRequest):
+        user_agent = request.META.get("HTTP_USER_AGENT", None)
+        if user_agent:
+            return smart_str(user_agent, encoding="latin-1", errors="ignore")
+        return None
 
     def _refresh_visit(self, user: User | None, request: HttpRequest, visit_time: dt.datetime):
         # A Visit row is unique by session_key
         session_key = request.session.session_key
 
         visit = None
-        last_access_ts = request.session.get("last_access_ts")
-
-        if last_access_ts is not None:
-            last_access = dt.datetime.fromtimestamp(last_access_ts, tz=dt.timezone.utc if settings.USE_TZ else None)
-            if (visit_time - last_access) <= MAX_VISIT_TIME:
-                try:
-                    visit = Visit.objects.filter(session_key=session_key).first()
-                except Visit.DoesNotExist:
-                    pass
-
-        # Save the last access timestamp
-        request.session["last_access_ts"] = visit_time.timestamp()
+        if self._continues_visit(request, visit_time):
+            try:
+                visit = Visit.objects.get_by_pk(request.session.get("tracking_visit"))
+            except Visit.DoesNotExist:
+                pass
+            # the session key changes when the user logs in
+            if visit is None or visit.session_key != session_key:
+                visit = Visit.objects.filter(session_key=session_key).first()
 
         if visit is None:
             # Log the ip address. Start time is managed via the field
@@ -109,9 +121,9 @@ class VisitorTrackingMiddleware:
         visit.expiry_time = request.session.get_expiry_date()
 
         # grab the latest User-Agent and store it
-        user_agent = request.META.get("HTTP_USER_AGENT", None)
+        user_agent = self._get_user_agent(request)
         if user_agent:
-            visit.user_agent = smart_str(user_agent, encoding="latin-1", errors="ignore")
+            visit.set_user_agent(user_agent)
 
         time_on_site = 0
         if visit.start_time:
@@ -120,10 +132,11 @@ class VisitorTrackingMiddleware:
 
         with transaction.atomic():
             visit.save()
+        request.session["tracking_visit"] = visit.pk
 
         return visit
 
-    def _add_pageview(self, visit, request, view_time):
+    def _get_pageview_data(self, request: HttpRequest):
         referer = ""
         query_string = ""
 
@@ -133,16 +146,42 @@ class VisitorTrackingMiddleware:
         if TRACK_QUERY_STRING:
             query_string = request.META.get("QUERY_STRING", "")
 
+        return {
+            "url": request.path,
+            "method": request.method,
+            "referer": referer,
+            "query_string": query_string,
+        }
+
+    def _add_pageview(self, visit, request, view_time):
+        data = self._get_pageview_data(request)
+        url_ids = TrackedURL.objects.get_ids([data["url"], data["referer"], data["query_string"]])
         pageview = PageView(
             visit=visit,
-            url=request.path,
             view_time=view_time,
-            method=request.method,
-            referer=referer,
-            query_string=query_string,
+            url_id=url_ids[data["url"]],
+            method=data["method"],
+            referer_id=url_ids.get(data["referer"]),
+            query_string_id=url_ids.get(data["query_string"]),
         )
         pageview.save()
 
+    def _buffer_hit(self, user: User | None, request: HttpRequest, visit_time: dt.datetime):
+        """
+        Queue the hit instead of writing it to the database (see `tracking.buffer`).
+        """
+        hit = Hit(
+            session_key=request.session.session_key,  # type: ignore
+            new_visit=not self._continues_visit(request, visit_time),
+            user_id=user.id if user else None,  # type: ignore
+            ip_address=get_ip_address(request),
+            user_agent=self._get_user_agent(request),
+            expiry_time=request.session.get_expiry_date(),
+            time=visit_time,
+            **(self._get_pageview_data(request) if TRACK_PAGEVIEWS else {}),
+        )
+        get_hit_buffer().add(hit)
+
     def process_response(self, request: HttpRequest, response: HttpResponse):
         # If dealing with a non-authenticated user, we still should track the
         # session since if authentication happens, the `session_key` carries
@@ -165,6 +204,10 @@ class VisitorTrackingMiddleware:
         # is the only time we can guarantee.
         now = timezone.now()
 
+        if TRACK_BUFFER:
+            self._buffer_hit(user, request, now)
+            return response
+
         # update/create the visit object for this request
         visit = self._refresh_visit(user, request, now)
 
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tracking", "0002_alter_pageview_method_alter_pageview_query_string_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyPageStats",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField(db_index=True, verbose_name="date")),
+                ("url", models.TextField(verbose_name="URL")),
+                ("registered", models.BooleanField(verbose_name="registered users")),
+                ("views", models.PositiveIntegerField(verbose_name="page views")),
+                ("unique_views", models.PositiveIntegerField(verbose_name="unique page views")),
+            ],
+            options={
+                "verbose_name": "daily page statistics",
+                "verbose_name_plural": "daily page statistics",
+                "ordering": ("-date",),
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyVisitStats",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField(db_index=True, verbose_name="date")),
+                ("ip_address", models.GenericIPAddressField(null=True, verbose_name="IP address")),
+                ("visits", models.PositiveIntegerField(verbose_name="visits")),
+                ("time_on_site", models.PositiveBigIntegerField(verbose_name="time on site")),
+                ("visits_with_pageviews", models.PositiveIntegerField(verbose_name="visits with page views")),
+                (
+                    "user",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="User",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "daily visit statistics",
+                "verbose_name_plural": "daily visit statistics",
+                "ordering": ("-date",),
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tracking", "0003_daily_stats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pageview",
+            index=models.Index(fields=["view_time"], name="tracking_pageview_view_time"),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(fields=["start_time", "user"], name="tracking_visit_start_user"),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(fields=["session_key", "-start_time"], name="tracking_visit_session"),
+        ),
+    ]
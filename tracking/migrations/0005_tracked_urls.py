@@ -0,0 +1,217 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:02
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# (model, field) pairs whose text is moved to the `TrackedURL` table
+URL_FIELDS = [
+    ("PageView", "url"),
+    ("PageView", "referer"),
+    ("PageView", "query_string"),
+    ("DailyPageStats", "url"),
+]
+# fields that can't be `NULL` (the empty values of the other fields are stored as `NULL`)
+REQUIRED_FIELDS = {("PageView", "url"), ("DailyPageStats", "url")}
+# number of rows updated at once
+CHUNK_SIZE = 1000
+
+
+def intern_urls(apps, schema_editor):
+    TrackedURL = apps.get_model("tracking", "TrackedURL")
+    url_ids: dict[str, int] = {}
+
+    def get_id(value):
+        pk = url_ids.get(value)
+        if pk is None:
+            url, _created = TrackedURL.objects.get_or_create(
+                hash=hashlib.sha1(value.encode("utf-8")).hexdigest(),
+                defaults={"value": value},
+            )
+            pk = url_ids[value] = url.pk
+        return pk
+
+    # the rows are read in chunks ordered by primary key so each table is scanned once
+    for model_name, field in URL_FIELDS:
+        model = apps.get_model("tracking", model_name)
+        required = (model_name, field) in REQUIRED_FIELDS
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by("pk").values_list("pk", field)[:CHUNK_SIZE])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            model.objects.bulk_update(
+                [model(pk=pk, **{f"{field}_ref_id": get_id(value)}) for pk, value in rows if value or required],
+                [f"{field}_ref"],
+            )
+
+
+def restore_urls(apps, schema_editor):
+    TrackedURL = apps.get_model("tracking", "TrackedURL")
+    for model_name, field in URL_FIELDS:
+        model = apps.get_model("tracking", model_name)
+        for url in TrackedURL.objects.iterator():
+            model.objects.filter(**{f"{field}_ref": url}).update(**{field: url.value})
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tracking", "0004_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrackedURL",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("hash", models.CharField(max_length=40, unique=True, verbose_name="hash")),
+                ("value", models.TextField(verbose_name="value")),
+            ],
+            options={
+                "verbose_name": "tracked URL",
+                "verbose_name_plural": "tracked URLs",
+            },
+        ),
+        migrations.AddField(
+            model_name="pageview",
+            name="url_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pageview",
+            name="referer_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+            ),
+        ),
+        migrations.AddField(
+            model_name="pageview",
+            name="query_string_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailypagestats",
+            name="url_ref",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+            ),
+        ),
+        migrations.RunPython(intern_urls, restore_urls),
+        # the text columns need a default to be added back when the migration is reverted
+        migrations.AlterField(
+            model_name="pageview",
+            name="url",
+            field=models.TextField(default="", verbose_name="URL"),
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="referer",
+            field=models.TextField(default="", verbose_name="referer"),
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="query_string",
+            field=models.TextField(default="", verbose_name="query string"),
+        ),
+        migrations.AlterField(
+            model_name="dailypagestats",
+            name="url",
+            field=models.TextField(default="", verbose_name="URL"),
+        ),
+        migrations.RemoveField(
+            model_name="pageview",
+            name="url",
+        ),
+        migrations.RemoveField(
+            model_name="pageview",
+            name="referer",
+        ),
+        migrations.RemoveField(
+            model_name="pageview",
+            name="query_string",
+        ),
+        migrations.RemoveField(
+            model_name="dailypagestats",
+            name="url",
+        ),
+        migrations.RenameField(
+            model_name="pageview",
+            old_name="url_ref",
+            new_name="url",
+        ),
+        migrations.RenameField(
+            model_name="pageview",
+            old_name="referer_ref",
+            new_name="referer",
+        ),
+        migrations.RenameField(
+            model_name="pageview",
+            old_name="query_string_ref",
+            new_name="query_string",
+        ),
+        migrations.RenameField(
+            model_name="dailypagestats",
+            old_name="url_ref",
+            new_name="url",
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="url",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+                verbose_name="URL",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="referer",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+                verbose_name="referer",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pageview",
+            name="query_string",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+                verbose_name="query string",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="dailypagestats",
+            name="url",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="tracking.trackedurl",
+                verbose_name="URL",
+            ),
+        ),
+    ]
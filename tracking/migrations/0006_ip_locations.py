@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tracking", "0005_tracked_urls"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IPLocation",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("ip_address", models.GenericIPAddressField(unique=True, verbose_name="IP address")),
+                ("city", models.CharField(blank=True, max_length=100, verbose_name="city")),
+                ("region", models.CharField(blank=True, max_length=100, verbose_name="region")),
+                ("country", models.CharField(blank=True, max_length=100, verbose_name="country")),
+                ("mobile", models.BooleanField(default=False, verbose_name="mobile connection")),
+                ("proxy", models.BooleanField(default=False, verbose_name="proxy")),
+                ("hosting", models.BooleanField(default=False, verbose_name="hosting")),
+                ("error", models.TextField(blank=True, verbose_name="error")),
+                ("update_time", models.DateTimeField(default=django.utils.timezone.now, verbose_name="update time")),
+            ],
+            options={
+                "verbose_name": "IP address location",
+                "verbose_name_plural": "IP address locations",
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:53
+
+import re
+
+import user_agents
+from django.conf import settings
+from django.db import migrations, models
+
+# copy of `tracking.user_agent.get_user_agent_info` when this migration was written
+BOT_USER_AGENTS = getattr(
+    settings,
+    "TRACK_BOT_USER_AGENTS",
+    (r"bot\b", "crawl", "spider", "slurp", r"^curl/", r"^wget/", r"^python-requests/", "headless"),
+)
+BOT_USER_AGENTS_RE = re.compile("|".join(f"(?:{pattern})" for pattern in BOT_USER_AGENTS), re.IGNORECASE)
+
+
+def get_user_agent_info(user_agent: str):
+    parsed = user_agents.parse(user_agent)
+    return {
+        "browser": parsed.browser.family,
+        "os": parsed.os.family,
+        "device": parsed.get_device(),
+        "is_bot": parsed.is_bot or bool(BOT_USER_AGENTS and BOT_USER_AGENTS_RE.search(user_agent)),
+    }
+
+
+def parse_user_agents(apps, schema_editor):
+    Visit = apps.get_model("tracking", "Visit")
+    values = Visit.objects.exclude(user_agent="").order_by().values_list("user_agent", flat=True).distinct()
+    for user_agent in values.iterator():
+        Visit.objects.filter(user_agent=user_agent).update(**get_user_agent_info(user_agent))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tracking", "0006_ip_locations"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="visit",
+            name="browser",
+            field=models.CharField(blank=True, max_length=100, verbose_name="browser"),
+        ),
+        migrations.AddField(
+            model_name="visit",
+            name="device",
+            field=models.CharField(blank=True, max_length=100, verbose_name="device"),
+        ),
+        migrations.AddField(
+            model_name="visit",
+            name="is_bot",
+            field=models.BooleanField(default=False, verbose_name="bot"),
+        ),
+        migrations.AddField(
+            model_name="visit",
+            name="os",
+            field=models.CharField(blank=True, max_length=100, verbose_name="operating system"),
+        ),
+        migrations.AddIndex(
+            model_name="visit",
+            index=models.Index(fields=["is_bot", "start_time"], name="tracking_visit_bot_start"),
+        ),
+        migrations.RunPython(parse_user_agents, migrations.RunPython.noop),
+    ]
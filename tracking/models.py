@@ -1,15 +1,15 @@
 from datetime import timedelta
-from typing import Any
 
-import requests
-import user_agents
 from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext
 from django.utils.translation import gettext_lazy as _
 
-from .managers import PageviewManager, VisitorManager
+from .managers import PageviewManager, TrackedURLManager, VisitorManager
+from .settings import TRACK_GEOLOCATION_ERROR_TTL, TRACK_GEOLOCATION_TTL
+from .user_agent import get_user_agent_info
+from .user_agent import parse as parse_user_agent
 
 
 class Visit(models.Model):
@@ -24,6 +24,11 @@ class Visit(models.Model):
     )
     ip_address = models.GenericIPAddressField(_("IP address"))
     user_agent = models.TextField(_("user agent"))
+    # parsed from the user agent when the visit is saved
+    browser = models.CharField(_("browser"), max_length=100, blank=True)
+    os = models.CharField(_("operating system"), max_length=100, blank=True)
+    device = models.CharField(_("device"), max_length=100, blank=True)
+    is_bot = models.BooleanField(_("bot"), default=False)
     start_time = models.DateTimeField(_("start time"), default=timezone.now)
     expiry_time = models.DateTimeField(_("session expiry time"))
     time_on_site = models.IntegerField(_("time on site"))
@@ -34,46 +39,33 @@ class Visit(models.Model):
         verbose_name = _("visit")
         ordering = ("-start_time",)
         permissions = (("visitor_log", "Can view visitor"),)
-
-    def ip_address_location(self):
-        req = requests.get(
-            f"http://ip-api.com/json/{self.ip_address}",
-            {
-                "fields": "status,message,city,regionName,country,mobile,proxy,hosting",
-                "lang": "fr",
-            },
+        indexes = (
+            # date range statistics and pruning
+            models.Index(fields=("start_time", "user"), name="tracking_visit_start_user"),
+            # lookup of the current visit of a session
+            models.Index(fields=("session_key", "-start_time"), name="tracking_visit_session"),
+            # statistics without the bots
+            models.Index(fields=("is_bot", "start_time"), name="tracking_visit_bot_start"),
         )
-        try:
-            data: dict[str, Any] = req.json()
-        except requests.JSONDecodeError as err:
-            return f"JSONDecodeError : {err}"
-        if data.get("status") == "fail":
-            return data.get("message", "")
-        extra = []
-        if data.get("mobile"):
-            extra.append(_("mobile connection"))
-        if data.get("proxy"):
-            extra.append(_("proxy"))
-        if data.get("hosting"):
-            extra.append(_("hosting"))
 
-        # Translators: This string is used as a separator between list elements
-        sep = gettext(", ")
-        ret = sep.join(
-            (
-                data.get("city", ""),
-                data.get("regionName", ""),
-                data.get("country", ""),
-            )
-        )
-        if extra:
-            ret += " (" + sep.join(extra) + ")"
-        return ret
+    def set_user_agent(self, user_agent: str):
+        """
+        Store the user agent and the information parsed from it.
+        """
+        self.user_agent = user_agent
+        self.browser, self.os, self.device, self.is_bot = get_user_agent_info(user_agent)
+
+    def ip_address_location(self):
+        # only read the cache, the locations are fetched by the `locate_ips` command
+        location = IPLocation.objects.filter(ip_address=self.ip_address).first()
+        if location is None:
+            return _("not located yet")
+        return str(location)
 
     ip_address_location.short_description = _("IP address location")
 
     def pretty_user_agent(self):
-        return str(user_agents.parse(self.user_agent))
+        return str(parse_user_agent(self.user_agent))
 
     pretty_user_agent.short_description = _("Information about user agent")
 
@@ -95,6 +87,28 @@ class Visit(models.Model):
     pretty_time_on_site.short_description = _("time on site")
 
 
+class TrackedURL(models.Model):
+    """
+    A URL (or a referer, or a query string) stored once and referenced by the page views.
+    """
+
+    # TEXT columns can't have a unique index on every database, so the unique key is the hash
+    hash = models.CharField(_("hash"), max_length=40, unique=True)
+    value = models.TextField(_("value"))
+
+    objects = TrackedURLManager["TrackedURL"]()
+
+    class Meta:
+        verbose_name = _("tracked URL")
+        verbose_name_plural = _("tracked URLs")
+
+    def __str__(self):
+        return self.value
+
+    def natural_key(self):
+        return (self.value,)
+
+
 class PageView(models.Model):
     visit = models.ForeignKey(
         Visit,
@@ -102,9 +116,26 @@ class PageView(models.Model):
         on_delete=models.CASCADE,
         verbose_name=_("Visit"),
     )
-    url = models.TextField(_("URL"))
-    referer = models.TextField(_("referer"))
-    query_string = models.TextField(_("query string"))
+    url = models.ForeignKey(
+        TrackedURL,
+        related_name="+",
+        on_delete=models.PROTECT,
+        verbose_name=_("URL"),
+    )
+    referer = models.ForeignKey(
+        TrackedURL,
+        related_name="+",
+        null=True,
+        on_delete=models.PROTECT,
+        verbose_name=_("referer"),
+    )
+    query_string = models.ForeignKey(
+        TrackedURL,
+        related_name="+",
+        null=True,
+        on_delete=models.PROTECT,
+        verbose_name=_("query string"),
+    )
     method = models.CharField(_("method"), max_length=10)
     view_time = models.DateTimeField(_("view time"))
 
@@ -114,3 +145,105 @@ class PageView(models.Model):
         verbose_name = _("page view")
         verbose_name_plural = _("page views")
         ordering = ("-view_time",)
+        indexes = (models.Index(fields=("view_time",), name="tracking_pageview_view_time"),)
+
+
+class IPLocation(models.Model):
+    """
+    Cached location of an IP address.
+
+    The rows are fetched by the `locate_ips` command (see `tracking.geolocation`).
+    If the IP address couldn't be located, `error` is set and the row is kept for a shorter time.
+    """
+
+    ip_address = models.GenericIPAddressField(_("IP address"), unique=True)
+    city = models.CharField(_("city"), max_length=100, blank=True)
+    region = models.CharField(_("region"), max_length=100, blank=True)
+    country = models.CharField(_("country"), max_length=100, blank=True)
+    mobile = models.BooleanField(_("mobile connection"), default=False)
+    proxy = models.BooleanField(_("proxy"), default=False)
+    hosting = models.BooleanField(_("hosting"), default=False)
+    error = models.TextField(_("error"), blank=True)
+    update_time = models.DateTimeField(_("update time"), default=timezone.now)
+
+    class Meta:
+        verbose_name = _("IP address location")
+        verbose_name_plural = _("IP address locations")
+
+    def __str__(self):
+        if self.error:
+            return self.error
+
+        extra = []
+        if self.mobile:
+            extra.append(_("mobile connection"))
+        if self.proxy:
+            extra.append(_("proxy"))
+        if self.hosting:
+            extra.append(_("hosting"))
+
+        # Translators: This string is used as a separator between list elements
+        sep = gettext(", ")
+        ret = sep.join((self.city, self.region, self.country))
+        if extra:
+            ret += " (" + sep.join(extra) + ")"
+        return ret
+
+    def expired(self):
+        """
+        The location must be fetched again.
+        """
+        ttl = TRACK_GEOLOCATION_ERROR_TTL if self.error else TRACK_GEOLOCATION_TTL
+        return self.update_time + ttl <= timezone.now()
+
+
+class DailyVisitStats(models.Model):
+    """
+    Visits of a day, grouped by user (or by IP address for the guests).
+
+    The rows are computed from the `Visit` objects by the `rollup_tracking` command.
+    """
+
+    date = models.DateField(_("date"), db_index=True)
+    # the statistics of the deleted users are still counted as registered users
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="+",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        verbose_name=_("User"),
+    )
+    ip_address = models.GenericIPAddressField(_("IP address"), null=True)
+    visits = models.PositiveIntegerField(_("visits"))
+    time_on_site = models.PositiveBigIntegerField(_("time on site"))
+    visits_with_pageviews = models.PositiveIntegerField(_("visits with page views"))
+
+    class Meta:
+        verbose_name = _("daily visit statistics")
+        verbose_name_plural = _("daily visit statistics")
+        ordering = ("-date",)
+
+
+class DailyPageStats(models.Model):
+    """
+    Page views of a day, grouped by URL and by kind of user (registered or guest).
+
+    The rows are computed from the `PageView` objects by the `rollup_tracking` command.
+    """
+
+    date = models.DateField(_("date"), db_index=True)
+    url = models.ForeignKey(
+        TrackedURL,
+        related_name="+",
+        on_delete=models.PROTECT,
+        verbose_name=_("URL"),
+    )
+    registered = models.BooleanField(_("registered users"))
+    views = models.PositiveIntegerField(_("page views"))
+    unique_views = models.PositiveIntegerField(_("unique page views"))
+
+    class Meta:
+        verbose_name = _("daily page statistics")
+        verbose_name_plural = _("daily page statistics")
+        ordering = ("-date",)
@@ -0,0 +1,54 @@
+import datetime as dt
+import gzip
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.core import serializers
+from django.db import transaction
+
+from .models import PageView, Visit
+from .rollups import day_bounds, last_complete_day, rollup
+from .settings import TRACK_PRUNE_CHUNK_SIZE
+
+
+def prune(cutoff: dt.datetime, chunk_size=TRACK_PRUNE_CHUNK_SIZE, archive: Path | str | None = None):
+    """
+    Delete the visits (and their page views) that started before `cutoff`,
+    `chunk_size` visits at a time so the tables aren't locked for a long time.
+
+    The daily rollups are computed first so the statistics are kept
+    (the visits of the days that can't be rolled up yet are never deleted).
+    If `archive` is set, the deleted rows are appended to this gzipped JSONL file
+    (it can be restored with `manage.py loaddata`).
+
+    Return the number of deleted visits.
+    """
+    rollup()
+    cutoff = min(cutoff, day_bounds(last_complete_day())[1])
+
+    count = 0
+    with ExitStack() as stack:
+        archive_file = stack.enter_context(gzip.open(archive, "at", encoding="utf-8")) if archive else None
+        while True:
+            pks = list(
+                Visit.objects.filter(start_time__lt=cutoff)
+                .order_by("start_time")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not pks:
+                break
+
+            with transaction.atomic():
+                if archive_file:
+                    archive_file.write(serializers.serialize("jsonl", Visit.objects.filter(pk__in=pks)))
+                    archive_file.write(
+                        # keep the URLs themselves in the archive, not the ids of the `TrackedURL` rows
+                        serializers.serialize(
+                            "jsonl", PageView.objects.filter(visit__in=pks), use_natural_foreign_keys=True
+                        )
+                    )
+                    archive_file.flush()
+                Visit.objects.filter(pk__in=pks).delete()
+            count += len(pks)
+
+    return count
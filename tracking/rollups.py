@@ -0,0 +1,228 @@
+import datetime as dt
+from typing import Any
+
+from django.db import transaction
+from django.db.models import BooleanField, Count, Exists, ExpressionWrapper, Max, OuterRef, Q, QuerySet, Sum
+from django.utils import timezone
+
+from .managers import GUESTS, REGISTERED, pageview_aggregates, visit_aggregates
+from .models import DailyPageStats, DailyVisitStats, PageView, Visit
+from .settings import MAX_VISIT_TIME
+
+Days = tuple[dt.date, dt.date] | None
+Ranges = list[tuple[dt.datetime, dt.datetime]]
+
+
+def day_bounds(day: dt.date) -> tuple[dt.datetime, dt.datetime]:
+    """
+    Return the start and the end of a day in the current time zone.
+    """
+    start = timezone.make_aware(dt.datetime.combine(day, dt.time.min))
+    end = timezone.make_aware(dt.datetime.combine(day + dt.timedelta(days=1), dt.time.min))
+    return start, end
+
+
+def last_rolled_up_day() -> dt.date | None:
+    """
+    Return the last day that has been rolled up.
+    """
+    return DailyVisitStats.objects.aggregate(last=Max("date"))["last"]
+
+
+def last_complete_day() -> dt.date:
+    """
+    Return the last day whose visits can't change anymore.
+    """
+    return timezone.localdate(timezone.now() - MAX_VISIT_TIME) - dt.timedelta(days=1)
+
+
+def split_range(start: dt.datetime, end: dt.datetime) -> tuple[Days, Ranges]:
+    """
+    Split a date range into the complete days that have been rolled up
+    (first and last day, or `None`) and the remaining date ranges.
+    """
+    last = last_rolled_up_day()
+    if last is None:
+        return None, [(start, end)]
+
+    first_day = timezone.localdate(start)
+    if day_bounds(first_day)[0] < start:
+        first_day += dt.timedelta(days=1)
+    last_day = min(last, timezone.localdate(end) - dt.timedelta(days=1))
+    if first_day > last_day:
+        return None, [(start, end)]
+
+    rollup_start = day_bounds(first_day)[0]
+    rollup_end = day_bounds(last_day)[1]
+    raw_ranges = []
+    if start < rollup_start:
+        raw_ranges.append((start, rollup_start))
+    if rollup_end < end:
+        raw_ranges.append((rollup_end, end))
+    return (first_day, last_day), raw_ranges
+
+
+def _ranges_q(raw_ranges: Ranges, field: str):
+    ret = Q()
+    for start, end in raw_ranges:
+        ret |= Q(**{f"{field}__gte": start, f"{field}__lt": end})
+    return ret
+
+
+def _add_counts(parts: list[dict[str, Any]]) -> dict[str, Any]:
+    ret: dict[str, Any] = {}
+    for part in parts:
+        for key, value in part.items():
+            ret[key] = ret.get(key, 0) + (value or 0)
+    return ret
+
+
+def _count_union(*querysets: QuerySet) -> int:
+    """
+    Return the number of distinct values in the given single-column querysets.
+    """
+    return querysets[0].union(*querysets[1:]).count()
+
+
+def rollup_visit_aggregates(days: tuple[dt.date, dt.date]) -> dict[str, Any]:
+    """
+    Same as `visit_aggregates` but for the rolled up days.
+    """
+    return DailyVisitStats.objects.filter(date__range=days).aggregate(
+        total=Sum("visits", default=0),
+        total_time_on_site=Sum("time_on_site", default=0),
+        registered_total=Sum("visits", filter=REGISTERED, default=0),
+        registered_unique=Count("user", distinct=True),
+        registered_time_on_site=Sum("time_on_site", filter=REGISTERED, default=0),
+        guests_total=Sum("visits", filter=GUESTS, default=0),
+        guests_unique=Count("ip_address", distinct=True, filter=GUESTS),
+        guests_time_on_site=Sum("time_on_site", filter=GUESTS, default=0),
+    )
+
+
+def rollup_pageview_aggregates(days: tuple[dt.date, dt.date]) -> dict[str, Any]:
+    """
+    Same as `pageview_aggregates` but for the rolled up days.
+    """
+    registered = Q(registered=True)
+    guests = Q(registered=False)
+    return {
+        **DailyPageStats.objects.filter(date__range=days).aggregate(
+            total=Sum("views", default=0),
+            unique=Sum("unique_views", default=0),
+            registered_total=Sum("views", filter=registered, default=0),
+            registered_unique=Sum("unique_views", filter=registered, default=0),
+            guests_total=Sum("views", filter=guests, default=0),
+            guests_unique=Sum("unique_views", filter=guests, default=0),
+        ),
+        **DailyVisitStats.objects.filter(date__range=days).aggregate(
+            visits=Sum("visits_with_pageviews", default=0),
+            registered_visits=Sum("visits_with_pageviews", filter=REGISTERED, default=0),
+            guests_visits=Sum("visits_with_pageviews", filter=GUESTS, default=0),
+        ),
+    }
+
+
+def visit_counts(days: Days, raw_ranges: Ranges) -> dict[str, Any]:
+    """
+    Return the `visit_aggregates` counts from the rollups and the raw visits.
+    """
+    parts = []
+    if days:
+        parts.append(rollup_visit_aggregates(days))
+    if raw_ranges:
+        raw_visits = Visit.objects.filter(_ranges_q(raw_ranges, "start_time"))
+        parts.append(visit_aggregates(raw_visits))
+
+    counts = _add_counts(parts)
+    if days and raw_ranges:
+        # the unique visitors of the two parts can't be added
+        rollups = DailyVisitStats.objects.filter(date__range=days).order_by()
+        raw_visits = raw_visits.order_by()
+        counts["registered_unique"] = _count_union(
+            rollups.filter(REGISTERED).values("user"),
+            raw_visits.filter(REGISTERED).values("user"),
+        )
+        counts["guests_unique"] = _count_union(
+            rollups.filter(GUESTS).values("ip_address"),
+            raw_visits.filter(GUESTS).values("ip_address"),
+        )
+    return counts
+
+
+def pageview_counts(days: Days, raw_ranges: Ranges) -> dict[str, Any]:
+    """
+    Return the `pageview_aggregates` counts from the rollups and the raw page views.
+    """
+    parts = []
+    if days:
+        parts.append(rollup_pageview_aggregates(days))
+    if raw_ranges:
+        parts.append(pageview_aggregates(PageView.objects.filter(_ranges_q(raw_ranges, "visit__start_time"))))
+    return _add_counts(parts)
+
+
+def rollup_day(day: dt.date):
+    """
+    Compute (or recompute) the rollups of a day.
+    """
+    start, end = day_bounds(day)
+    visits = Visit.objects.filter(start_time__gte=start, start_time__lt=end).order_by()
+    has_pageviews = Exists(PageView.objects.filter(visit=OuterRef("pk")))
+    annotations = {
+        "count": Count("pk"),
+        "total_time_on_site": Sum("time_on_site"),
+        "with_pageviews": Count("pk", filter=has_pageviews),
+    }
+
+    visit_rows = [
+        DailyVisitStats(
+            date=day,
+            user_id=row.get("user"),
+            ip_address=row.get("ip_address"),
+            visits=row["count"],
+            time_on_site=row["total_time_on_site"],
+            visits_with_pageviews=row["with_pageviews"],
+        )
+        for queryset in (visits.filter(REGISTERED).values("user"), visits.filter(GUESTS).values("ip_address"))
+        for row in queryset.annotate(**annotations)
+    ]
+    page_rows = [
+        DailyPageStats(date=day, url_id=row.pop("url"), **row)
+        for row in PageView.objects.filter(visit__start_time__gte=start, visit__start_time__lt=end)
+        .order_by()
+        .annotate(registered=ExpressionWrapper(Q(visit__user__isnull=False), output_field=BooleanField()))
+        .values("url", "registered")
+        .annotate(views=Count("pk"), unique_views=Count("visit", distinct=True))
+    ]
+
+    with transaction.atomic():
+        DailyVisitStats.objects.filter(date=day).delete()
+        DailyPageStats.objects.filter(date=day).delete()
+        DailyVisitStats.objects.bulk_create(visit_rows)
+        DailyPageStats.objects.bulk_create(page_rows)
+
+
+def rollup(since: dt.date | None = None, until: dt.date | None = None):
+    """
+    Roll up all the complete days from `since` (by default the day after the last rolled up day,
+    or the first day with visits) to `until`. Return the rolled up days.
+    """
+    if since is None:
+        last = last_rolled_up_day()
+        if last is not None:
+            since = last + dt.timedelta(days=1)
+        elif first_visit := Visit.objects.order_by("start_time").first():
+            since = timezone.localdate(first_visit.start_time)
+        else:
+            return []
+
+    until = min(until or last_complete_day(), last_complete_day())
+
+    days = []
+    day = since
+    while day <= until:
+        rollup_day(day)
+        days.append(day)
+        day += dt.timedelta(days=1)
+    return days
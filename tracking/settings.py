@@ -13,7 +13,50 @@ TRACK_PAGEVIEWS = getattr(settings, "TRACK_PAGEVIEWS", False)
 
 TRACK_IGNORE_URLS = getattr(settings, "TRACK_IGNORE_URLS", (r"^(favicon\.ico|robots\.txt)$",))
 TRACK_IGNORE_USER_AGENTS = getattr(settings, "TRACK_IGNORE_USER_AGENTS", ())
+# The visits whose user agent contains one of these patterns are marked as bots
+TRACK_BOT_USER_AGENTS = getattr(
+    settings,
+    "TRACK_BOT_USER_AGENTS",
+    (r"bot\b", "crawl", "spider", "slurp", r"^curl/", r"^wget/", r"^python-requests/", "headless"),
+)
+# Number of parsed user agents kept in memory by each process
+TRACK_USER_AGENT_CACHE_SIZE = getattr(settings, "TRACK_USER_AGENT_CACHE_SIZE", 1000)
 TRACK_IGNORE_STATUS_CODES = getattr(settings, "TRACK_IGNORE_STATUS_CODES", ())
 
+# Lifetime of the instances in the cache of `tracking.cache.CacheManager`
+# (the changes made in the other processes may be seen only after this delay if the cache isn't shared)
+TRACK_INSTANCE_CACHE_TIMEOUT = getattr(settings, "TRACK_INSTANCE_CACHE_TIMEOUT", 60 * 5)
+
+# Number of users shown on each page of the dashboard
+TRACK_DASHBOARD_USERS = getattr(settings, "TRACK_DASHBOARD_USERS", 50)
+
 TRACK_REFERER = getattr(settings, "TRACK_REFERER", True)
 TRACK_QUERY_STRING = getattr(settings, "TRACK_QUERY_STRING", True)
+# Number of URL ids kept in memory by each process (see `TrackedURLManager.get_ids`)
+TRACK_URL_CACHE_SIZE = getattr(settings, "TRACK_URL_CACHE_SIZE", 1000)
+
+# Buffered mode: hits are queued in the worker and written in bulk by a background thread
+TRACK_BUFFER = getattr(settings, "TRACK_BUFFER", False)
+TRACK_BUFFER_SIZE = getattr(settings, "TRACK_BUFFER_SIZE", 100)
+TRACK_BUFFER_INTERVAL = getattr(settings, "TRACK_BUFFER_INTERVAL", timedelta(seconds=10))
+if not isinstance(TRACK_BUFFER_INTERVAL, timedelta):
+    TRACK_BUFFER_INTERVAL = timedelta(seconds=TRACK_BUFFER_INTERVAL)
+# If set, the buffered hits are appended to this file and written by the `flush_tracking` command
+TRACK_BUFFER_SPOOL = getattr(settings, "TRACK_BUFFER_SPOOL", None)
+
+# Visits older than this are deleted by the `prune_tracking` command (`None` = keep everything)
+TRACK_MAX_AGE = getattr(settings, "TRACK_MAX_AGE", None)
+if TRACK_MAX_AGE is not None and not isinstance(TRACK_MAX_AGE, timedelta):
+    TRACK_MAX_AGE = timedelta(days=TRACK_MAX_AGE)
+TRACK_PRUNE_CHUNK_SIZE = getattr(settings, "TRACK_PRUNE_CHUNK_SIZE", 1000)
+
+# IP address geolocation (see `tracking.geolocation`)
+TRACK_GEOLOCATION_RESOLVER = getattr(settings, "TRACK_GEOLOCATION_RESOLVER", "tracking.geolocation.IPAPIResolver")
+TRACK_GEOLOCATION_RESOLVER_OPTIONS = getattr(settings, "TRACK_GEOLOCATION_RESOLVER_OPTIONS", {})
+TRACK_GEOLOCATION_TTL = getattr(settings, "TRACK_GEOLOCATION_TTL", timedelta(days=30))
+if not isinstance(TRACK_GEOLOCATION_TTL, timedelta):
+    TRACK_GEOLOCATION_TTL = timedelta(days=TRACK_GEOLOCATION_TTL)
+# The addresses that couldn't be located are tried again after this delay
+TRACK_GEOLOCATION_ERROR_TTL = getattr(settings, "TRACK_GEOLOCATION_ERROR_TTL", timedelta(days=1))
+if not isinstance(TRACK_GEOLOCATION_ERROR_TTL, timedelta):
+    TRACK_GEOLOCATION_ERROR_TTL = timedelta(days=TRACK_GEOLOCATION_ERROR_TTL)
@@ -0,0 +1,565 @@
+import datetime as dt
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import buffer as buffer_module
+from .buffer import Hit, HitBuffer, append_to_spool, fcntl, get_hit_buffer, read_spool, write_hits
+from .cache import cache_instances
+from .cache import stats as cache_stats
+from .geolocation import IPAPIResolver, locate
+from .managers import clear_url_cache
+from .middleware import VisitorTrackingMiddleware
+from .models import IPLocation, PageView, TrackedURL, Visit
+from .retention import prune
+from .rollups import rollup, split_range
+from .user_agent import get_user_agent_info
+
+
+def make_hit(session_key="abc", new_visit=False, minutes=0, url="/"):
+    now = timezone.now()
+    return Hit(
+        session_key=session_key,
+        new_visit=new_visit,
+        user_id=None,
+        ip_address="127.0.0.1",
+        user_agent="Mozilla/5.0",
+        expiry_time=now + dt.timedelta(days=1),
+        time=now + dt.timedelta(minutes=minutes),
+        url=url,
+        method="GET",
+    )
+
+
+class TrackingTestCase(TestCase):
+    """
+    Test case that doesn't reuse the cached rows of the previous tests.
+    """
+
+    def setUp(self):
+        # the rows of the previous tests have been rolled back
+        clear_url_cache()
+        cache.clear()
+
+
+class BufferTests(TrackingTestCase):
+    """
+    Tests on the buffered write pipeline.
+    """
+
+    def test_write_hits(self):
+        """
+        The hits of a session are grouped in one visit
+        """
+        with self.assertNumQueries(8):
+            # SELECT visits + SELECT / INSERT / SELECT URLs
+            # + SAVEPOINT + INSERT visits + INSERT page views + RELEASE SAVEPOINT
+            write_hits([make_hit(new_visit=True), make_hit(minutes=5, url="/a"), make_hit("def", new_visit=True)])
+
+        self.assertEqual(Visit.objects.count(), 2)
+        self.assertEqual(PageView.objects.count(), 3)
+        visit = Visit.objects.get(session_key="abc")
+        self.assertEqual(visit.time_on_site, 5 * 60)
+        self.assertEqual(visit.pageviews.count(), 2)
+
+    def test_existing_visit(self):
+        """
+        A hit that continues a visit updates the existing row
+        """
+        write_hits([make_hit(new_visit=True)])
+        write_hits([make_hit(minutes=10)])
+        self.assertEqual(Visit.objects.count(), 1)
+        self.assertEqual(Visit.objects.get().time_on_site, 10 * 60)
+
+        write_hits([make_hit(new_visit=True, minutes=60)])
+        self.assertEqual(Visit.objects.count(), 2)
+
+    def test_spool(self):
+        """
+        The hits are written to the spool file, then to the database
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = Path(tmpdir) / "tracking.jsonl"
+            buffer = HitBuffer(spool=spool)
+            buffer._thread = True  # type: ignore  # don't start the flusher thread
+            buffer.add(make_hit(new_visit=True))
+            buffer.add(make_hit(minutes=1))
+            buffer.flush()
+
+            self.assertEqual(len(buffer), 0)
+            self.assertEqual(Visit.objects.count(), 0)
+
+            self.assertEqual(read_spool(spool), 2)
+            self.assertFalse(spool.exists())
+            self.assertEqual(Visit.objects.count(), 1)
+            self.assertEqual(PageView.objects.count(), 2)
+
+    def test_spool_progress(self):
+        """
+        An interrupted run doesn't write the hits of the previous chunks again
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = Path(tmpdir) / "tracking.jsonl"
+            hits = [make_hit("abc", new_visit=True), make_hit("def", new_visit=True), make_hit("ghi", new_visit=True)]
+            spool.write_text("".join(hit.to_json() + "\n" for hit in hits), encoding="utf-8")
+
+            calls = []
+
+            def fail_on_second_chunk(chunk):
+                calls.append(chunk)
+                if len(calls) == 2:
+                    raise RuntimeError("database error")
+                write_hits(chunk)
+
+            with mock.patch("tracking.buffer.write_hits", fail_on_second_chunk), self.assertRaises(RuntimeError):
+                read_spool(spool, chunk_size=1)
+            self.assertEqual(Visit.objects.count(), 1)
+
+            self.assertEqual(read_spool(spool, chunk_size=1), 2)
+            self.assertEqual(sorted(Visit.objects.values_list("session_key", flat=True)), ["abc", "def", "ghi"])
+            self.assertEqual(list(Path(tmpdir).iterdir()), [])
+
+    def test_flush_command(self):
+        """
+        The `flush_tracking` command writes the hits of the spool file
+        """
+        with self.assertRaises(CommandError):
+            call_command("flush_tracking")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = Path(tmpdir) / "tracking.jsonl"
+            append_to_spool(spool, make_hit(new_visit=True).to_json() + "\n")
+            stdout = StringIO()
+            call_command("flush_tracking", spool=str(spool), stdout=stdout)
+            self.assertEqual(stdout.getvalue(), "1 hit(s) written\n")
+            self.assertEqual(Visit.objects.count(), 1)
+
+    def test_middleware(self):
+        """
+        The middleware queues the hits in the buffer of the process when `TRACK_BUFFER` is enabled
+        """
+        buffer = HitBuffer()
+        buffer._thread = True  # type: ignore  # don't start the flusher thread
+        request = RequestFactory().get("/a", HTTP_USER_AGENT="Mozilla/5.0")
+        request.session = SessionStore()
+        middleware = VisitorTrackingMiddleware(lambda request: HttpResponse())
+
+        with mock.patch("tracking.middleware.TRACK_BUFFER", False):
+            middleware(request)
+        self.assertIsNone(buffer_module._hit_buffer)
+        self.assertEqual(Visit.objects.count(), 1)
+
+        with (
+            mock.patch("tracking.middleware.TRACK_BUFFER", True),
+            mock.patch("tracking.buffer._hit_buffer", buffer),
+        ):
+            with self.assertNumQueries(0):
+                middleware(request)
+            self.assertIs(get_hit_buffer(), buffer)
+        self.assertEqual(len(buffer), 1)
+
+        buffer.flush()
+        self.assertEqual(Visit.objects.count(), 1)
+        self.assertEqual(Visit.objects.get().session_key, request.session.session_key)
+        self.assertEqual(list(PageView.objects.values_list("url__value", flat=True)), ["/a", "/a"])
+
+    @unittest.skipIf(fcntl is None, "fcntl isn't available")
+    def test_spool_rotation(self):
+        """
+        The hits written while the spool file is moved go to the new spool file
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spool = Path(tmpdir) / "tracking.jsonl"
+            processing = Path(tmpdir) / "tracking.jsonl.processing"
+            spool.write_text("old\n", encoding="utf-8")
+
+            # `read_spool` holds the lock while a worker tries to write
+            with spool.open("rb") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)  # type: ignore
+                writer = threading.Thread(target=append_to_spool, args=(spool, "new\n"))
+                writer.start()
+                writer.join(0.1)
+                os.replace(spool, processing)
+            writer.join()
+
+            self.assertEqual(processing.read_text(encoding="utf-8"), "old\n")
+            self.assertEqual(spool.read_text(encoding="utf-8"), "new\n")
+
+    def test_url_interning(self):
+        """
+        The URLs are stored once and their ids are cached
+        """
+        hit = make_hit(new_visit=True)
+        hit.referer = "https://example.com/"
+        write_hits([hit, make_hit(url="/a")])
+        self.assertEqual(
+            sorted(TrackedURL.objects.values_list("value", flat=True)), ["/", "/a", "https://example.com/"]
+        )
+        pageview = PageView.objects.get(url__value="/")
+        self.assertEqual(pageview.referer.value, "https://example.com/")  # type: ignore
+        self.assertIsNone(pageview.query_string)
+
+        with self.assertNumQueries(0):
+            url_ids = TrackedURL.objects.get_ids(["/", "/a", ""])
+        self.assertEqual(url_ids, {"/": pageview.url_id, "/a": TrackedURL.objects.get(value="/a").pk})  # type: ignore
+
+    def test_user_agent_info(self):
+        """
+        The parsed user agent is stored on the visit
+        """
+        hit = make_hit(new_visit=True)
+        hit.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0"
+        bot = make_hit("def", new_visit=True)
+        bot.user_agent = "python-requests/2.32.3"
+        write_hits([hit, bot])
+
+        self.assertEqual(
+            list(Visit.objects.order_by("session_key").values_list("browser", "os", "device", "is_bot")),
+            [("Firefox", "Windows", "PC", False), ("Python Requests", "Other", "Other", True)],
+        )
+        self.assertTrue(get_user_agent_info("Mozilla/5.0 (compatible; Googlebot/2.1)").is_bot)
+
+
+class CacheTests(TrackingTestCase):
+    """
+    Tests on the instance cache.
+    """
+
+    def test_get_by_pk(self):
+        """
+        The instances are read from the cache and evicted when they change
+        """
+        write_hits([make_hit(new_visit=True), make_hit("def", new_visit=True)])
+        pks = list(Visit.objects.values_list("pk", flat=True))
+
+        hits = cache_stats["tracking.visit.hits"]
+        with self.assertNumQueries(1):
+            self.assertEqual(set(Visit.objects.get_many(pks)), set(pks))
+        with self.assertNumQueries(0):
+            visit = Visit.objects.get_by_pk(pks[0])
+        self.assertEqual(cache_stats["tracking.visit.hits"], hits + 1)
+
+        Visit.objects.filter(pk=pks[0]).update(time_on_site=42)
+        self.assertEqual(Visit.objects.get_by_pk(pks[0]).time_on_site, 42)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            visit = Visit.objects.get(pk=pks[0])
+            visit.time_on_site = 43
+            visit.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(Visit.objects.get_by_pk(pks[0]).time_on_site, 43)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Visit.objects.filter(pk=pks[0]).update(time_on_site=44)
+            # another request caches the previous row before the commit
+            cache_instances(Visit, [visit])
+        self.assertEqual(Visit.objects.get_by_pk(pks[0]).time_on_site, 44)
+
+        visit.delete()
+        with self.assertRaises(Visit.DoesNotExist):
+            Visit.objects.get_by_pk(pks[0])
+
+
+class StatsTests(TrackingTestCase):
+    """
+    Tests on the visit and page view statistics.
+    """
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user("lfavole")
+        hits = [
+            make_hit("a", new_visit=True),
+            make_hit("a", minutes=10, url="/a"),
+            make_hit("a", minutes=20, url="/a"),
+            make_hit("b", new_visit=True),
+            make_hit("c", new_visit=True, url="/c"),
+        ]
+        hits[0].user_id = hits[3].user_id = user.pk
+        write_hits(hits)
+        self.start = timezone.now() - dt.timedelta(days=1)
+        self.end = timezone.now() + dt.timedelta(days=1)
+
+    def test_visit_stats(self):
+        """
+        The visit statistics are computed in two queries
+        """
+        with self.assertNumQueries(3):
+            # last rolled up day + visits + page views
+            stats = Visit.objects.stats(self.start, self.end)
+
+        self.assertEqual(stats["total"], 3)
+        self.assertEqual(stats["unique"], 2)
+        self.assertEqual(stats["time_on_site"], dt.timedelta(seconds=20 * 60 // 3))
+        self.assertEqual(stats["registered"]["total"], 2)
+        self.assertEqual(stats["registered"]["unique"], 1)
+        self.assertEqual(stats["registered"]["return_ratio"], 50)
+        self.assertEqual(stats["registered"]["pages_per_visit"], 2)
+        self.assertEqual(stats["guests"]["total"], 1)
+        self.assertEqual(stats["guests"]["unique"], 1)
+        self.assertEqual(stats["guests"]["pages_per_visit"], 1)
+        self.assertAlmostEqual(stats["pages_per_visit"], 5 / 3)
+
+    def test_user_stats(self):
+        """
+        The user statistics are computed in one query
+        """
+        get_user_model().objects.create_user("other")
+        with self.assertNumQueries(1):
+            users = Visit.objects.user_stats(self.start, self.end)
+
+        self.assertEqual(len(users), 1)
+        self.assertEqual(users[0].username, "lfavole")
+        self.assertEqual(users[0].visit_count, 2)
+        self.assertEqual(users[0].time_on_site, dt.timedelta(minutes=10))
+        self.assertEqual(users[0].pages_per_visit, 2)
+
+        self.assertEqual(Visit.objects.user_stats(self.start, self.end, limit=10, offset=1), [])
+        with self.assertNumQueries(1):
+            self.assertEqual(Visit.objects.user_count(self.start, self.end), 1)
+
+    def test_dashboard(self):
+        """
+        The dashboard shows the number of users and links to the other pages of users
+        """
+        hit = make_hit("d", new_visit=True)
+        hit.user_id = get_user_model().objects.create_user("other").pk
+        write_hits([hit])
+        self.client.force_login(get_user_model().objects.create_superuser("admin"))
+
+        with mock.patch("tracking.views.TRACK_DASHBOARD_USERS", 1):
+            response = self.client.get(reverse("tracking-dashboard"))
+            self.assertContains(response, "2 registered users")
+            self.assertContains(response, "Page 1 of 2")
+            self.assertEqual([user.username for user in response.context["user_stats"]], ["lfavole"])
+            self.assertContains(response, "?users_page=2")
+
+            response = self.client.get(reverse("tracking-dashboard"), {"users_page": 2})
+            self.assertContains(response, "Page 2 of 2")
+            self.assertEqual([user.username for user in response.context["user_stats"]], ["other"])
+
+    def test_pageview_stats(self):
+        """
+        The page view statistics are computed in one query (and the last rolled up day)
+        """
+        with self.assertNumQueries(2):
+            stats = PageView.objects.stats(self.start, self.end)
+
+        self.assertEqual(stats["total"], 5)
+        # ("a", "/"), ("a", "/a"), ("b", "/"), ("c", "/c")
+        self.assertEqual(stats["unique"], 4)
+        self.assertEqual(stats["registered"], {"total": 4, "unique": 3})
+        self.assertEqual(stats["guests"], {"total": 1, "unique": 1})
+
+
+class HistoryTestCase(TrackingTestCase):
+    """
+    Test case with visits in the previous days.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user("lfavole")
+        day = 24 * 60
+        hits = [
+            make_hit("a", new_visit=True, minutes=-5 * day),
+            make_hit("a", minutes=-5 * day + 10, url="/a"),
+            make_hit("b", new_visit=True, minutes=-4 * day, url="/b"),
+            make_hit("c", new_visit=True, minutes=-3 * day),
+            make_hit("c", minutes=-3 * day + 1, url="/c"),
+            make_hit("d", new_visit=True),
+            make_hit("e", new_visit=True, url="/e"),
+        ]
+        for hit in hits[:3] + hits[5:6]:
+            hit.user_id = self.user.pk
+        for hit in hits[3:5]:
+            hit.ip_address = "10.0.0.1"
+        write_hits(hits)
+        self.start = timezone.now() - dt.timedelta(days=7)
+        self.end = timezone.now() + dt.timedelta(minutes=1)
+
+
+class RollupTests(HistoryTestCase):
+    """
+    Tests on the daily rollups.
+    """
+
+    def test_split_range(self):
+        """
+        Only the complete rolled up days are used
+        """
+        self.assertEqual(split_range(self.start, self.end), (None, [(self.start, self.end)]))
+        rollup()
+        days, raw_ranges = split_range(self.start, self.end)
+        self.assertEqual(days[0], timezone.localdate(self.start) + dt.timedelta(days=1))  # type: ignore
+        self.assertEqual(len(raw_ranges), 2)
+        self.assertEqual(raw_ranges[0][0], self.start)
+        self.assertEqual(raw_ranges[1][1], self.end)
+
+    def test_same_stats(self):
+        """
+        The statistics are the same with and without rollups
+        """
+        visit_stats = Visit.objects.stats(self.start, self.end)
+        pageview_stats = PageView.objects.stats(self.start, self.end)
+        self.assertEqual(visit_stats["registered"]["unique"], 1)
+
+        days = rollup()
+        self.assertTrue(days)
+        self.assertEqual(Visit.objects.stats(self.start, self.end), visit_stats)
+        self.assertEqual(PageView.objects.stats(self.start, self.end), pageview_stats)
+
+        # only the rollups
+        end = timezone.now() - dt.timedelta(days=2)
+        visit_stats = Visit.objects.stats(self.start, end)
+        self.assertEqual(visit_stats["total"], 3)
+        self.assertEqual(visit_stats["guests"]["unique"], 1)
+
+    def test_deleted_user(self):
+        """
+        The rolled up visits of a deleted user are still counted as registered visits
+        """
+        rollup()
+        end = timezone.now() - dt.timedelta(days=2)
+        visit_stats = Visit.objects.stats(self.start, end)
+        self.user.delete()
+        self.assertEqual(Visit.objects.stats(self.start, end), visit_stats)
+        self.assertEqual(visit_stats["registered"], {**visit_stats["registered"], "total": 2, "unique": 1})
+
+
+class RetentionTests(HistoryTestCase):
+    """
+    Tests on the pruning of the old visits.
+    """
+
+    def test_prune(self):
+        """
+        The old visits are deleted and archived, but their statistics are kept
+        """
+        end = timezone.now() - dt.timedelta(days=2)
+        visit_stats = Visit.objects.stats(self.start, end)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = Path(tmpdir) / "archive.jsonl.gz"
+            self.assertEqual(prune(end, chunk_size=2, archive=archive), 3)
+            with gzip.open(archive, "rt", encoding="utf-8") as f:
+                self.assertEqual(len(f.readlines()), 3 + 5)
+
+        self.assertEqual(Visit.objects.count(), 2)
+        self.assertEqual(PageView.objects.count(), 2)
+        self.assertEqual(Visit.objects.stats(self.start, end), visit_stats)
+
+        # the visits of today aren't rolled up yet
+        self.assertEqual(prune(timezone.now()), 0)
+        self.assertEqual(Visit.objects.count(), 2)
+
+
+class FakeResolver:
+    """
+    Resolver that locates all the IP addresses in Paris, except the private ones.
+    """
+
+    batch_size = 2
+
+    def __init__(self):
+        self.calls: list[list[str]] = []
+
+    def resolve(self, ips):
+        self.calls.append(ips)
+        return {
+            ip: {"error": "private range"} if ip.startswith("10.") else {"city": "Paris", "country": "France"}
+            for ip in ips
+        }
+
+
+class IPAPIHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the batch endpoint of ip-api.com.
+    """
+
+    def do_POST(self):  # pylint: disable=C0103
+        ips = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        data = [
+            {"status": "fail", "message": "reserved range", "query": ip}
+            if ip.startswith("127.")
+            else {"status": "success", "query": ip, "city": "Lyon", "regionName": "Rhône", "country": "France"}
+            for ip in ips
+        ]
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GeolocationTests(TrackingTestCase):
+    """
+    Tests on the cached geolocation of the IP addresses.
+    """
+
+    def test_locate(self):
+        """
+        The locations are fetched in batches and only once
+        """
+        resolver = FakeResolver()
+        self.assertEqual(locate(["1.1.1.1", "2.2.2.2", "10.0.0.1", "1.1.1.1"], resolver), 3)
+        self.assertEqual(resolver.calls, [["1.1.1.1", "10.0.0.1"], ["2.2.2.2"]])
+        self.assertEqual(str(IPLocation.objects.get(ip_address="1.1.1.1")), "Paris, , France")
+        self.assertEqual(str(IPLocation.objects.get(ip_address="10.0.0.1")), "private range")
+
+        self.assertEqual(locate(["1.1.1.1", "10.0.0.1"], resolver), 0)
+
+        # the errors expire before the locations
+        IPLocation.objects.update(update_time=timezone.now() - dt.timedelta(days=2))
+        self.assertEqual(locate(["1.1.1.1", "10.0.0.1"], resolver), 1)
+        self.assertEqual(resolver.calls[-1], ["10.0.0.1"])
+        self.assertEqual(locate(["1.1.1.1"], resolver, force=True), 1)
+
+    def test_admin_reads_cache(self):
+        """
+        The admin doesn't fetch the locations
+        """
+        write_hits([make_hit(new_visit=True)])
+        visit = Visit.objects.get()
+        with self.assertNumQueries(1):
+            self.assertEqual(visit.ip_address_location(), "not located yet")
+
+        locate([visit.ip_address], FakeResolver())
+        self.assertEqual(visit.ip_address_location(), "Paris, , France")
+
+    def test_ip_api_resolver(self):
+        """
+        The ip-api.com resolver uses the batch endpoint
+        """
+        server = ThreadingHTTPServer(("127.0.0.1", 0), IPAPIHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            resolver = IPAPIResolver(url=f"http://127.0.0.1:{server.server_address[1]}/batch", timeout=5)
+            self.assertEqual(locate(["127.0.0.1", "8.8.8.8"], resolver), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(str(IPLocation.objects.get(ip_address="8.8.8.8")), "Lyon, Rhône, France")
+        self.assertEqual(IPLocation.objects.get(ip_address="127.0.0.1").error, "reserved range")
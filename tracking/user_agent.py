@@ -0,0 +1,54 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+import user_agents
+from user_agents.parsers import UserAgent
+
+from .settings import TRACK_BOT_USER_AGENTS, TRACK_IGNORE_USER_AGENTS, TRACK_USER_AGENT_CACHE_SIZE
+
+
+def _combine(patterns) -> re.Pattern | None:
+    # one regex is much faster than trying each pattern in turn
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+
+ignore_user_agents_re = _combine(TRACK_IGNORE_USER_AGENTS)
+bot_user_agents_re = _combine(TRACK_BOT_USER_AGENTS)
+
+
+def is_ignored(user_agent: str):
+    """
+    Return `True` if the user agent matches (at its start) one of the `TRACK_IGNORE_USER_AGENTS` patterns.
+    """
+    return bool(ignore_user_agents_re and ignore_user_agents_re.match(user_agent))
+
+
+@lru_cache(maxsize=TRACK_USER_AGENT_CACHE_SIZE)
+def parse(user_agent: str) -> UserAgent:
+    """
+    Same as `user_agents.parse` but the results are cached (the same user agents come again and again).
+    """
+    return user_agents.parse(user_agent)
+
+
+class UserAgentInfo(NamedTuple):
+    browser: str
+    os: str
+    device: str
+    is_bot: bool
+
+
+def get_user_agent_info(user_agent: str):
+    """
+    Return the information about a user agent that is stored on the visits.
+    """
+    parsed = parse(user_agent)
+    return UserAgentInfo(
+        browser=parsed.browser.family,
+        os=parsed.os.family,
+        device=parsed.get_device(),
+        is_bot=parsed.is_bot or bool(bot_user_agents_re and bot_user_agents_re.search(user_agent)),
+    )
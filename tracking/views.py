@@ -1,3 +1,4 @@
+import math
 from datetime import timedelta
 
 from django import forms
@@ -5,8 +6,9 @@ from django.contrib.auth.decorators import permission_required
 from django.shortcuts import render
 from django.utils.timezone import now
 
-from .models import PageView, Visit
-from .settings import TRACK_PAGEVIEWS
+from .models import DailyVisitStats, PageView, Visit
+from .rollups import day_bounds
+from .settings import TRACK_DASHBOARD_USERS, TRACK_PAGEVIEWS
 
 # tracking wants to accept more formats than default, here they are
 input_formats = [
@@ -21,6 +23,7 @@ input_formats = [
 class DashboardForm(forms.Form):
     start = forms.DateTimeField(required=False, input_formats=input_formats)
     end = forms.DateTimeField(required=False, input_formats=input_formats)
+    users_page = forms.IntegerField(required=False, min_value=1)
 
 
 @permission_required("tracking.visitor_log")
@@ -30,12 +33,15 @@ def dashboard(request):
     """
     end_time = now()
     start_time = end_time - timedelta(days=7)
-    defaults = {"start": start_time, "end": end_time}
+    users_page = 1
+    defaults = {"start": start_time, "end": end_time, "users_page": users_page}
 
-    form = DashboardForm(data=request.GET or defaults)
+    # the page links only change `users_page`
+    form = DashboardForm(data={**defaults, **request.GET.dict()})
     if form.is_valid():
         start_time = form.cleaned_data["start"]
         end_time = form.cleaned_data["end"]
+        users_page = form.cleaned_data["users_page"] or 1
 
     # determine when tracking began
     try:
@@ -44,11 +50,24 @@ def dashboard(request):
     except (IndexError, Visit.DoesNotExist):
         track_start_time = now()
 
+    # the oldest visits may have been pruned, but their statistics are kept in the rollups
+    first_rollup = DailyVisitStats.objects.order_by("date").first()
+    if first_rollup:
+        track_start_time = min(track_start_time, day_bounds(first_rollup.date)[0])
+
     # If the start_date is before tracking began, warn about incomplete data
     warn_incomplete = start_time < track_start_time
 
     # queries take `date` objects (for now)
-    user_stats = Visit.objects.user_stats(start_time, end_time)
+    users_count = Visit.objects.user_count(start_time, end_time)
+    users_pages = max(1, math.ceil(users_count / TRACK_DASHBOARD_USERS))
+    users_page = min(users_page, users_pages)
+    user_stats = Visit.objects.user_stats(
+        start_time,
+        end_time,
+        limit=TRACK_DASHBOARD_USERS,
+        offset=(users_page - 1) * TRACK_DASHBOARD_USERS,
+    )
     visitor_stats = Visit.objects.stats(start_time, end_time)
     if TRACK_PAGEVIEWS:
         pageview_stats = PageView.objects.stats(start_time, end_time)
@@ -60,6 +79,9 @@ def dashboard(request):
         "track_start_time": track_start_time,
         "warn_incomplete": warn_incomplete,
         "user_stats": user_stats,
+        "users_count": users_count,
+        "users_page": users_page,
+        "users_pages": users_pages,
         "visitor_stats": visitor_stats,
         "pageview_stats": pageview_stats,
     }